@@ -1,19 +1,16 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import io
-import base64
 import datetime
-import joblib
+import html
 import os
+import time
 
-# Intentamos importar SHAP de forma segura
-try:
-    import shap
-    SHAP_AVAILABLE = True
-except ImportError:
-    SHAP_AVAILABLE = False
+# Pandas, Matplotlib, SHAP, joblib... se importan al entrar en la simulación
+# (y se precargan en segundo plano mientras se muestra la portada)
+from audit import AuditLog
+from batching import BatcherClosedError, MicroBatcher, QueueFullError
+from history import HistoryStore
+from registry import ModelRegistry
+from report import create_html_report, format_date, recommendation_for, risk_label_for, shap_rows_html
 
 # =========================================================
 # 1. CONFIGURACIÓN Y CLASES (GLOBAL)
@@ -34,22 +31,129 @@ class MockModel:
         prob = 1 / (1 + np.exp(-(score - 100) / 15)) 
         return [[1-prob, prob]]
 
-# --- FUNCIÓN DE CARGA DEL MODELO ---
+# Versiones del modelo: cada .pkl de MODEL_DIR (con su bundle <nombre>_bundle de export_model.py)
+MODEL_DIR = os.environ.get("CDSS_MODEL_DIR", "modelos")
+DEFAULT_MODEL = "diabetes_rf_pipeline"  # Activa mientras no haya fichero ACTIVE (python registry.py --activate)
+MAX_LOADED_MODELS = int(os.environ.get("CDSS_MAX_MODELS", "2"))
+MODEL_MEMORY_MB = os.environ.get("CDSS_MODEL_MEMORY_MB")  # Límite opcional de memoria medida de los modelos cargados
+VALIDATION_PATH = "modelos/validation.csv"  # Opcional: datos clínicos (o prob_diabetes) + Outcome
+
+# Broker de inferencia: espera máxima para completar un lote y tamaño máximo del lote
+BROKER_MAX_WAIT_MS = float(os.environ.get("CDSS_BROKER_MAX_WAIT_MS", "2"))
+BROKER_MAX_BATCH = int(os.environ.get("CDSS_BROKER_MAX_BATCH", "64"))
+
+# Tiempos por fase: se activan con ?debug=1 en la URL (o CDSS_TIMING=1 para todas las sesiones)
+TIMING_ALWAYS = os.environ.get("CDSS_TIMING") == "1"
+TIMING_LOG = os.environ.get("CDSS_TIMING_LOG", "logs/timings.jsonl")
+
+# Historial local de evaluaciones (SQLite)
+HISTORY_PATH = os.environ.get("CDSS_HISTORY_DB", "datos/historial.sqlite")
+# Registro de auditoría de cada cálculo (segmentos JSONL rotados y comprimidos)
+AUDIT_DIR = os.environ.get("CDSS_AUDIT_DIR", "logs/audit")
+# Valor inicial del campo ID: mientras no se cambie, las evaluaciones no se guardan en el historial
+DEFAULT_PATIENT_ID = "Paciente #8842-X"
+
+# --- REGISTRO DE VERSIONES DEL MODELO ---
 @st.cache_resource
-def load_model():
-    model_path = "modelos/diabetes_rf_pipeline.pkl"
-    if os.path.exists(model_path):
-        try:
-            return joblib.load(model_path)
-        except Exception as e:
-            st.error(f"Error cargando modelo: {e}")
-            return MockModel()
-    else:
+def load_registry():
+    """Registro común a todas las sesiones: carga cada versión al primer uso y expulsa las menos usadas."""
+    max_bytes = float(MODEL_MEMORY_MB) * 1024 * 1024 if MODEL_MEMORY_MB else None
+    return ModelRegistry(MODEL_DIR, default=DEFAULT_MODEL, max_loaded=MAX_LOADED_MODELS, max_bytes=max_bytes)
+
+def start_warmup():
+    """Versión activa (ModelWarmup). La primera vez lanza en otro hilo la importación de dependencias y su carga."""
+    try:
+        return load_registry().get()
+    except Exception as e:
+        st.error(f"Error en el registro de modelos: {e}")
+        return None
+
+# --- FUNCIÓN DE CARGA DEL MODELO ---
+def load_model(handle):
+    """Pipeline de la versión (lo guarda el registro). Sin modelo o con error se avisa y se simula con MockModel."""
+    if handle is None:
+        st.warning(f"No hay ningún modelo en {MODEL_DIR}/: los resultados son una simulación.")
+        return MockModel()
+    try:
+        # Si la precarga aún no ha terminado, se espera solo lo que le falte.
+        # Con el bundle mmap la precarga no deserializa el pickle: se hace al necesitarlo (SHAP)
+        model = handle.load_pipeline()
+    except Exception as e:
+        st.error(f"Error cargando modelo: {e}")
         return MockModel()
+    return model if model is not None else MockModel()
 
-# Inicialización segura
-if 'model' not in st.session_state:
-    st.session_state.model = load_model()
+# --- MOTOR DE INFERENCIA RÁPIDO ---
+def load_engine(handle):
+    """Motor compilado: el bundle mmap de la precarga o, si no hay, compilado y validado desde el pipeline."""
+    try:
+        return handle.load_engine() if handle is not None else None
+    except Exception:
+        return None
+
+# --- HISTORIAL DE EVALUACIONES ---
+@st.cache_resource
+def load_history_store(path):
+    """Base SQLite del historial y su hilo escritor, comunes a todas las sesiones del proceso."""
+    return HistoryStore(path)
+
+@st.cache_resource
+def load_audit_log(directory):
+    """Registro de auditoría y su hilo escritor, comunes a todas las sesiones del proceso."""
+    return AuditLog(directory)
+
+# --- CACHÉ DE PREDICCIONES ---
+@st.cache_resource(max_entries=MAX_LOADED_MODELS + 1)
+def load_prediction_cache(model_key):
+    """Probabilidades ya calculadas, compartidas entre sesiones (clave: variables cuantizadas)."""
+    return LRUCache(maxsize=4096)
+
+# --- ANÁLISIS DEL UMBRAL SOBRE VALIDACIÓN ---
+@st.cache_resource(max_entries=MAX_LOADED_MODELS + 1)
+def load_validation_analysis(path, mtime, _predictor, model_key):
+    """Métricas por umbral del CSV de validación por defecto (se recalcula si el fichero cambia)."""
+    return analysis_from_frame(pd.read_csv(path), _predictor)
+
+# --- SUPERFICIES DE RIESGO «WHAT-IF» ---
+@st.cache_resource(max_entries=MAX_LOADED_MODELS + 1)
+def load_surface_cache(model_key):
+    """Rejillas Glucosa × BMI ya puntuadas (clave: resto de variables del paciente), comunes a todas las sesiones."""
+    return LRUCache(maxsize=64)
+
+# --- ANÁLISIS DE SENSIBILIDAD ---
+@st.cache_resource(max_entries=MAX_LOADED_MODELS + 1)
+def load_sensitivity_cache(model_key):
+    """Barridos por variable ya puntuados (clave: datos clínicos del paciente), comunes a todas las sesiones."""
+    return LRUCache(maxsize=256)
+
+# --- BROKER DE INFERENCIA ENTRE SESIONES ---
+@st.cache_resource(max_entries=MAX_LOADED_MODELS + 1, on_release=lambda broker: broker.close(timeout=1.0))
+def load_inference_broker(_predictor, model_key):
+    """Agrupa en lotes las peticiones de una fila de todas las sesiones y las resuelve con futures."""
+    def predict_batch(rows):
+        X = pd.DataFrame(np.vstack(rows), columns=FEATURE_COLUMNS)
+        return np.asarray(_predictor.predict_proba(X))[:, 1]
+    return MicroBatcher(predict_batch, max_batch_size=BROKER_MAX_BATCH, max_wait_ms=BROKER_MAX_WAIT_MS, name="inference-broker")
+
+# --- EXPLAINER SHAP COMPARTIDO ---
+@st.cache_resource(max_entries=MAX_LOADED_MODELS + 1)
+def load_explainer(_pipeline, model_key, _forest=None):
+    """Explicador por versión del modelo (SHAP exacto, submuestra y Saabas, con sus cachés), común a todas las sesiones."""
+    return BudgetedExplainer(_pipeline, forest=_forest)
+
+@st.cache_data
+def load_explain_check(path, mtime, model_path, model_mtime):
+    """Desviaciones del chequeo offline de approx_explain.py (None si no hay o es de otro modelo)."""
+    return load_deviation_check(model_path)
+
+# --- RESUMEN SHAP GLOBAL PRECALCULADO ---
+@st.cache_resource(max_entries=MAX_LOADED_MODELS + 1)
+def load_global_shap(model_path, model_key, manifest_mtime):
+    """SHAP de la cohorte de referencia (global_shap.py), mapeado en memoria. None si no hay o es de otro modelo."""
+    return GlobalShapSummary.load(model_path)
+
+# La precarga arranca con la portada, que no necesita el modelo
+start_warmup()
 
 if 'predict_clicked' not in st.session_state:
     st.session_state.predict_clicked = False
@@ -62,128 +166,9 @@ if 'shap_data' not in st.session_state:
 # 2. FUNCIONES AUXILIARES
 # =========================================================
 
-def fig_to_html(fig):
-    """Convierte una figura de Matplotlib a string HTML base64."""
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight', transparent=True, dpi=300)
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode()
-    return f'<img src="data:image/png;base64,{img_str}" style="width:100%; object-fit:contain;">'
-
-def fig_to_bytes(fig):
-    """Convierte figura a bytes para st.image (Permite zoom con fondo BLANCO)."""
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png', bbox_inches='tight', transparent=False, facecolor='white', dpi=300)
-    buf.seek(0)
-    return buf
-
 def get_help_icon(description):
     return f"""<span style="display:inline-block; width:16px; height:16px; line-height:16px; text-align:center; border-radius:50%; background:#E0E0E0; color:#777; font-size:0.7rem; font-weight:bold; cursor:help; margin-left:6px; position:relative; top:-1px;" title="{description}">?</span>"""
 
-def create_html_report(patient_name, date_str, prob, risk_label, inputs_dict, shap_rows_html, recommendation):
-    """Genera un informe HTML completo con logo correcto y tabla SHAP."""
-    
-    c_dark = "#2C3E50"
-    c_pink = "#E97F87"
-    c_teal = "#4DB6AC"
-    c_gray = "#bdc3c7"
-    c_bg_head = "#F8F9FA"
-    
-    risk_color = c_pink if "ALTO" in risk_label else c_teal
-    
-    # Construir tabla de datos clínicos
-    inputs_rows = ""
-    for k, v in inputs_dict.items():
-        inputs_rows += f"<tr><td style='padding:8px; border-bottom:1px solid #eee; color:#666;'>{k}</td><td style='padding:8px; border-bottom:1px solid #eee; font-weight:bold; color:{c_dark}; text-align:right;'>{v}</td></tr>"
-
-    # Construir sección SHAP (Explicabilidad)
-    shap_section_html = ""
-    if shap_rows_html:
-        shap_section_html = f"""
-        <div class="section">
-            <div class="section-title">Análisis Individual: Factores Determinantes (SHAP)</div>
-            <p style="font-size:12px; color:#666; margin-bottom:15px;">Desglose de las variables que más han influido (positiva o negativamente) en el cálculo del riesgo para este paciente concreto.</p>
-            <table style="width:100%; font-size:12px;">
-                <thead>
-                    <tr style="background:#eee; color:#777;">
-                        <th style="padding:8px; text-align:left;">Variable Clínica</th>
-                        <th style="padding:8px; text-align:center;">Valor Paciente</th>
-                        <th style="padding:8px; text-align:right;">Contribución al Riesgo</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {shap_rows_html}
-                </tbody>
-            </table>
-        </div>
-        """
-
-    html = f"""
-    <html>
-    <head>
-        <style>
-            body {{ font-family: 'Helvetica', sans-serif; color: #333; padding: 40px; max-width: 800px; margin: 0 auto; }}
-            .header {{ text-align: center; margin-bottom: 30px; border-bottom: 2px solid {c_pink}; padding-bottom: 20px; }}
-            /* ESTILOS DEL LOGO EXACTOS */
-            .logo {{ font-size: 26px; font-weight: 800; color: {c_dark}; letter-spacing: -1px; }}
-            .logo span.pink {{ color: {c_pink}; }}
-            .logo span.gray {{ color: {c_gray}; }}
-            
-            .meta {{ font-size: 11px; color: #999; margin-top: 5px; text-transform: uppercase; letter-spacing: 1px; }}
-            .patient-info {{ background: {c_bg_head}; padding: 15px; border-radius: 8px; margin-bottom: 30px; display: flex; justify-content: space-between; }}
-            .section {{ margin-bottom: 30px; }}
-            .section-title {{ color: {c_dark}; font-size: 14px; font-weight: 800; text-transform: uppercase; margin-bottom: 12px; border-left: 4px solid {c_pink}; padding-left: 10px; }}
-            .risk-box {{ padding: 25px; background: {risk_color}15; border-radius: 12px; border: 2px solid {risk_color}; text-align: center; margin-bottom: 30px; }}
-            .risk-val {{ font-size: 42px; font-weight: 900; color: {risk_color}; line-height: 1; }}
-            .risk-txt {{ font-size: 16px; font-weight: 800; color: {c_dark}; text-transform: uppercase; margin-top: 10px; }}
-            .rec-box {{ background: #fff; border: 1px solid #ddd; padding: 15px; border-radius: 8px; font-size: 13px; line-height: 1.5; border-left: 4px solid {risk_color}; }}
-            table {{ width: 100%; border-collapse: collapse; font-size: 13px; }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <div class="logo">D<span class="pink">IA</span>BETES<span class="gray">.</span><span class="pink">NME</span></div>
-            <div class="meta">Clinical Decision Support System Report</div>
-        </div>
-        
-        <div class="patient-info">
-            <div><span style="color:#999; font-size:11px;">PACIENTE:</span><br><strong>{patient_name}</strong></div>
-            <div style="text-align:right;"><span style="color:#999; font-size:11px;">FECHA:</span><br><strong>{date_str}</strong></div>
-        </div>
-
-        <div class="risk-box">
-            <div class="risk-val">{prob*100:.1f}%</div>
-            <div class="risk-txt">{risk_label}</div>
-            <div style="font-size:12px; color:#777; margin-top:8px; font-weight:500;">Probabilidad estimada de Diabetes Tipo 2</div>
-        </div>
-
-        {shap_section_html}
-
-        <div class="section">
-            <div class="section-title">Protocolo de Acción Recomendado</div>
-            <div class="rec-box">
-                <strong>Intervención Sugerida:</strong><br>
-                {recommendation}
-            </div>
-        </div>
-
-        <div class="section">
-            <div class="section-title">Datos Clínicos Registrados</div>
-            <table>
-                {inputs_rows}
-            </table>
-        </div>
-
-        <div style="font-size:10px; color:#aaa; text-align:center; margin-top:50px; border-top:1px solid #eee; padding-top:15px; line-height:1.4;">
-            Documento generado automáticamente por el prototipo DIABETES.NME.<br>
-            Herramienta de soporte a la decisión clínica desarrollada con fines académicos. <strong>No sustituye el criterio médico profesional.</strong><br>
-            <strong style="color:{c_dark};">TFM Desarrollado por: Nerea Moreno Escamilla</strong> | CEMP 2025
-        </div>
-    </body>
-    </html>
-    """
-    return html
-
 # =========================================================
 # 3. NAVEGACIÓN
 # =========================================================
@@ -193,6 +178,9 @@ if "page" not in st.session_state:
 def ir_a_simulacion():
     st.session_state.page = "simulacion"
 
+def ir_a_cohorte():
+    st.session_state.page = "cohorte"
+
 def volver_inicio():
     st.session_state.page = "landing"
 
@@ -292,12 +280,123 @@ if st.session_state.page == "landing":
         if st.button("INICIAR          "):
             ir_a_simulacion()
             st.rerun()
+        if st.button("COHORTE (CSV)    "):
+            ir_a_cohorte()
+            st.rerun()
 
 # =========================================================
 # 5. PÁGINA: SIMULACIÓN
 # =========================================================
 elif st.session_state.page == "simulacion":
 
+    # --- DEPENDENCIAS PESADAS (ya en memoria si la precarga ha terminado) ---
+    import numpy as np
+    import pandas as pd
+
+    from cache import LRUCache
+    from charts import importance_png, shap_beeswarm_png, shap_waterfall_png
+    from cohort import patient_alerts
+    from approx_explain import (DEFAULT_BUDGET_MS, MODE_AUTO, MODE_EXACT, MODE_LABELS, BudgetedExplainer, check_path_for,
+                                load_deviation_check, method_note)
+    from features import FEATURE_COLUMNS, body_mass_index, build_feature_array, feature_key, resistance_index
+    from global_shap import MANIFEST_NAME, GlobalShapSummary, summary_dir_for
+    from sensitivity import sensitivity_curves
+    from svg_charts import calibration_svg, donut_svg, risk_trend_svg, sensitivity_svg
+    from threshold_analysis import analysis_from_frame
+    from timing import REGISTRY, SpanRecorder
+    from what_if import compute_risk_surface
+
+    # Desactivado, cada span() devuelve el mismo contexto vacío
+    timer = SpanRecorder(enabled=TIMING_ALWAYS or st.query_params.get("debug") == "1")
+
+    # Los controles de una pestaña cerrada no se dibujan y Streamlit descartaría su valor:
+    # reasignarlos al principio de cada rerun lo conserva
+    for widget_key in ("threshold", "whatif_mode", "global_view"):
+        if widget_key in st.session_state:
+            st.session_state[widget_key] = st.session_state[widget_key]
+    st.session_state.setdefault("threshold", 0.27)
+
+    # Intentamos importar SHAP de forma segura
+    try:
+        import shap
+        SHAP_AVAILABLE = True
+    except ImportError:
+        SHAP_AVAILABLE = False
+
+    # Versión del modelo de este rerun: si se activa otra, la recoge el rerun siguiente y este
+    # termina con la que ya tiene. Las cachés compartidas van por versión (model_key).
+    model_handle = start_warmup()
+    model_key = model_handle.version if model_handle is not None else "simulación"
+    if st.session_state.get('model_key') != model_key:
+        st.session_state.model_key = model_key
+        st.session_state.pop('model', None)
+
+    def get_pipeline():
+        """Pipeline de la versión activa (o MockModel). Con el bundle mmap solo se deserializa la primera vez que se pide."""
+        if 'model' in st.session_state:
+            return st.session_state.model
+        model = load_model(model_handle)
+        # Solo la simulación se fija en la sesión: el pipeline real lo guarda (y lo expulsa) el registro
+        if isinstance(model, MockModel):
+            st.session_state.model = model
+        return model
+
+    def predict_one(predictor, input_data):
+        """Probabilidad de un paciente a través del broker compartido (lotes entre sesiones)."""
+        if isinstance(predictor, MockModel):
+            return predictor.predict_proba(input_data)[0][1]
+        broker = load_inference_broker(predictor, model_key)
+        try:
+            future = broker.submit(input_data.iloc[0].to_numpy(dtype=float))
+        except (QueueFullError, BatcherClosedError):
+            # Cola saturada o broker ya liberado (la versión salió de la caché): se resuelve en este hilo
+            return predictor.predict_proba(input_data)[0][1]
+        try:
+            return future.result(timeout=10)
+        except Exception:
+            # Lote fallido o sin respuesta a tiempo (TimeoutError): también se resuelve en este hilo
+            future.cancel()
+            return predictor.predict_proba(input_data)[0][1]
+
+    def get_threshold_analysis(uploaded):
+        """Análisis del CSV subido en esta sesión o, si no hay, del conjunto de validación por defecto."""
+        scorer = load_engine(model_handle) or get_pipeline()
+        if uploaded is not None:
+            cached = st.session_state.get('threshold_analysis')
+            if cached is None or cached[0] != uploaded.file_id:
+                st.session_state.threshold_analysis = (uploaded.file_id, analysis_from_frame(pd.read_csv(uploaded), scorer))
+            return st.session_state.threshold_analysis[1]
+        if 'threshold_analysis' in st.session_state:
+            # El uploader se vacía al volver a Panel General desde otra pestaña: se sigue usando lo subido
+            return st.session_state.threshold_analysis[1]
+        if os.path.exists(VALIDATION_PATH):
+            return load_validation_analysis(VALIDATION_PATH, os.path.getmtime(VALIDATION_PATH), scorer, model_key)
+        return None
+
+    def forget_validation_upload():
+        """Solo al quitar el fichero a mano se vuelve al conjunto de validación por defecto."""
+        if st.session_state.get('validation_csv') is None:
+            st.session_state.pop('threshold_analysis', None)
+
+    def get_explain_check():
+        """Desviaciones offline de los modos aproximados (se releen si cambia el JSON o el modelo)."""
+        if model_handle is None:
+            return None
+        model_path = model_handle.model_path
+        path = check_path_for(model_path)
+        if os.path.exists(path) and os.path.exists(model_path):
+            return load_explain_check(path, os.path.getmtime(path), model_path, os.path.getmtime(model_path))
+        return None
+
+    def get_global_shap():
+        """Resumen SHAP precalculado de la versión activa (se relee si se vuelve a generar)."""
+        if model_handle is None:
+            return None
+        manifest = os.path.join(summary_dir_for(model_handle.model_path), MANIFEST_NAME)
+        if not os.path.exists(manifest):
+            return None
+        return load_global_shap(model_handle.model_path, model_key, os.path.getmtime(manifest))
+
     CEMP_PINK = "#E97F87"
     CEMP_DARK = "#2C3E50" 
     GOOD_TEAL = "#4DB6AC"
@@ -642,20 +741,18 @@ elif st.session_state.page == "simulacion":
             st.session_state.predict_clicked = False
             st.session_state.shap_data = None
 
-        patient_name = st.text_input("ID Paciente", value="Paciente #8842-X", label_visibility="collapsed", on_change=reset_on_change)
+        patient_name = st.text_input("ID Paciente", value=DEFAULT_PATIENT_ID, label_visibility="collapsed", on_change=reset_on_change)
         default_date = datetime.date.today()
         consult_date = st.date_input("Fecha Predicción", value=default_date, label_visibility="collapsed", on_change=reset_on_change)
         
-        meses_es = {1: "Ene", 2: "Feb", 3: "Mar", 4: "Abr", 5: "May", 6: "Jun", 
-                    7: "Jul", 8: "Ago", 9: "Sep", 10: "Oct", 11: "Nov", 12: "Dic"}
-        date_str = f"{consult_date.day} {meses_es[consult_date.month]} {consult_date.year}"
+        date_str = format_date(consult_date)
 
         st.markdown("---")
         
         glucose = input_biomarker("Glucosa 2h (mg/dL)", 50, 350, 50, "gluc", "Concentración plasmática a las 2h de test de tolerancia oral.", format_str="%d")
         insulin = input_biomarker("Insulina (µU/ml)", 0, 900, 0, "ins", "Insulina a las 2h de ingesta.", format_str="%d")
         
-        proxy_index = int(glucose * insulin)
+        proxy_index = int(resistance_index(glucose, insulin))
         proxy_str = f"{proxy_index}" 
 
         st.markdown(f"""
@@ -674,10 +771,7 @@ elif st.session_state.page == "simulacion":
         weight = input_biomarker("Peso (kg)", 30.0, 250.0, 30.0, "weight", "Peso corporal actual.")
         height = input_biomarker("Altura (m)", 1.00, 2.20, 1.00, "height", "Altura en metros.")
         
-        if height > 0:
-            bmi = weight / (height * height)
-        else:
-            bmi = 0
+        bmi = body_mass_index(weight, height)
         bmi_sq = bmi ** 2
         
         st.markdown(f"""
@@ -726,26 +820,205 @@ elif st.session_state.page == "simulacion":
         
         st.caption("Valores basados en el estudio Pima Indians Diabetes.")
 
+        explain_mode, explain_budget = MODE_AUTO, DEFAULT_BUDGET_MS
+        if SHAP_AVAILABLE:
+            with st.expander("⚙️ Explicabilidad"):
+                explain_mode = st.selectbox("Método de explicación", list(MODE_LABELS), format_func=MODE_LABELS.get, key="explain_mode",
+                                            help="En automático se usa SHAP exacto si cabe en el presupuesto; si no, una aproximación.")
+                explain_budget = st.number_input("Presupuesto de latencia (ms)", min_value=1.0, max_value=2000.0, value=DEFAULT_BUDGET_MS,
+                                                 step=5.0, key="explain_budget_ms", disabled=explain_mode != MODE_AUTO)
+
 
     st.markdown(f"<h1 style='color:{CEMP_DARK}; margin-bottom: 10px; font-size: 2.2rem;'>Evaluación de Riesgo Diabético</h1>", unsafe_allow_html=True)
 
-    tab1, tab2, tab3, tab4 = st.tabs(["Panel General", "Explicabilidad", "Framework de Acción", "Ficha Técnica"])
+    # El umbral se lee del estado: su control está en Panel General, que puede no estar abierto
+    threshold = st.session_state.threshold
 
-    with tab1:
-        st.write("")
+    # PREPARAR DATOS PARA EL MODELO REAL (mismo cálculo que lotes, servicio y benchmark)
+    feature_row = build_feature_array(pregnancies, glucose, blood_pressure, insulin, bmi, dpf, age)
+    input_data = pd.DataFrame(feature_row, columns=FEATURE_COLUMNS)
+    
+    # Camino rápido: motor compilado (bundle mmap o validado al cargar); si no, el pipeline original
+    engine = load_engine(model_handle)
+    if engine is not None and not isinstance(st.session_state.get('model'), MockModel):
+        predictor = engine
+    else:
+        predictor = get_pipeline()
+
+    # Modo exploración: mientras no se pulse CALCULAR RIESGO, la probabilidad sale de la superficie precalculada
+    risk_surface, whatif_prob = None, None
+    if st.session_state.get('whatif_mode') and not isinstance(predictor, MockModel):
+        try:
+            covariates = (pregnancies, blood_pressure, insulin, round(dpf, 2), age)
+            with timer.span("modelo: superficie what-if"):
+                risk_surface = load_surface_cache(model_key).get_or_compute(
+                    covariates, lambda: compute_risk_surface(predictor, *covariates)
+                )
+            whatif_prob = risk_surface.lookup(glucose, bmi)
+        except Exception:
+            risk_surface = None
+
+    simulated = isinstance(predictor, MockModel)
+    if whatif_prob is not None and not st.session_state.predict_clicked:
+        prob = whatif_prob
+    elif hasattr(predictor, 'predict_proba'):
+        try:
+            # Si estos valores ya se puntuaron (en esta u otra sesión) no se llama al modelo
+            prediction_cache = load_prediction_cache(model_key)
+            with timer.span("modelo: predicción"):
+                prob = prediction_cache.get_or_compute(
+                    feature_key(feature_row[0]),
+                    lambda: predict_one(predictor, input_data)
+                )
+        except Exception as e:
+            # Solo este rerun se simula: el siguiente vuelve a intentarlo con el modelo real
+            st.warning(f"No se pudo calcular la predicción con el modelo: {e}. Resultado simulado.")
+            simulated = True
+            prob = MockModel().predict_proba(input_data)[0][1]
+    else:
+        st.session_state.model = MockModel()
+        prob = 0.5
+
+    is_high = prob > threshold 
+    simulated = simulated or isinstance(st.session_state.get('model'), MockModel)
+    prediction_model = "simulación" if simulated else model_key
+    
+    distancia_al_corte = abs(prob - threshold)
+    if distancia_al_corte > 0.15:
+        conf_text, conf_color = "ALTA", GOOD_TEAL
+        conf_desc = "Probabilidad claramente alejada del umbral."
+    elif distancia_al_corte > 0.05:
+        conf_text, conf_color = "MEDIA", "#F39C12"
+        conf_desc = "Probabilidad relativamente cerca del umbral."
+    else:
+        conf_text, conf_color = "BAJA", CEMP_PINK
+        conf_desc = "Zona de incertidumbre clínica."
+
+    risk_color = CEMP_PINK if is_high else GOOD_TEAL
+    risk_label = risk_label_for(is_high)
+    risk_icon = "🔴" if is_high else "🟢"
+    risk_bg = "#FFF5F5" if is_high else "#F0FDF4"
+    risk_border = CEMP_PINK if is_high else GOOD_TEAL
+    
+    # Mismas reglas que los hallazgos de la página de cohorte
+    alerts = patient_alerts({'Glucose': glucose, 'BMI': bmi, 'Indice_resistencia': proxy_index,
+                             'BloodPressure': blood_pressure})
+    
+    if not alerts: insight_txt, insight_bd, alert_icon = "Sin hallazgos significativos", GOOD_TEAL, "✅"
+    else: insight_txt, insight_bd, alert_icon = " • ".join(alerts), CEMP_PINK, "⚠️"
+
+    # Cada CALCULAR RIESGO se guarda en el historial y en la auditoría: se encola y los hilos escritores lo persisten
+    evaluation, history_future = None, None
+    if st.session_state.pop('record_pending', False) and st.session_state.predict_clicked \
+            and not simulated:
+        evaluation = {
+            'patient_id': patient_name, 'eval_date': consult_date.isoformat(), 'created_at': time.time(),
+            'prob': float(prob), 'threshold': float(threshold), 'high_risk': int(is_high),
+            'pregnancies': pregnancies, 'glucose': glucose, 'blood_pressure': blood_pressure, 'insulin': insulin,
+            'weight': weight, 'height': height, 'bmi': bmi, 'dpf': dpf, 'age': age,
+            'model_version': prediction_model,
+        }
+        if patient_name != DEFAULT_PATIENT_ID:
+            try:
+                history_future = load_history_store(HISTORY_PATH).record(evaluation)
+            except Exception as e:
+                st.warning(f"No se pudo guardar la evaluación en el historial: {e}")
+        try:
+            # Nadie espera este Future: si la escritura falla, lo cuenta el propio registro (Ficha Técnica)
+            load_audit_log(AUDIT_DIR).log({
+                **evaluation,
+                'recommendation': recommendation_for(glucose, prob, threshold),
+            })
+        except Exception as e:
+            st.warning(f"No se pudo registrar el cálculo en la auditoría: {e}")
+
+    # Pestañas perezosas: solo se ejecuta (y se envía) la pestaña abierta
+    tab1, tab2, tab3, tab4 = st.tabs(["Panel General", "Explicabilidad", "Framework de Acción", "Ficha Técnica"],
+                                     key="sim_tab", on_change="rerun")
+
+    if tab1.open:
+        with tab1, timer.span("pestaña: Panel General"):
+            st.write("")
         
-        with st.expander("Ajuste de Sensibilidad Clínica"):
-            c_calib_1, c_calib_2 = st.columns([1, 2], gap="large")
-            with c_calib_1:
-                st.caption("Selecciona manualmente el umbral de decisión.")
-                threshold = st.slider("Umbral", 0.0, 1.0, 0.27, 0.01, label_visibility="collapsed")
+            with st.expander("Ajuste de Sensibilidad Clínica"):
+                c_calib_1, c_calib_2 = st.columns([1, 2], gap="large")
+                with c_calib_1:
+                    st.caption("Selecciona manualmente el umbral de decisión.")
+                    threshold = st.slider("Umbral", 0.0, 1.0, step=0.01, key="threshold", label_visibility="collapsed")
+
+                    validation_file = st.file_uploader("Conjunto de validación (CSV con Outcome)", type="csv", key="validation_csv", on_change=forget_validation_upload,
+                                                       help="Datos clínicos de la barra lateral (o la columna prob_diabetes de batch_scoring.py) y la etiqueta real Outcome.")
+                    try:
+                        analysis = get_threshold_analysis(validation_file)
+                    except Exception as e:
+                        st.error(f"No se pudo analizar el conjunto de validación: {e}")
+                        analysis = None
+
+                    if analysis is not None:
+                        # Búsqueda binaria sobre las probabilidades ya ordenadas: no se vuelve a puntuar nada
+                        live = analysis.at(threshold)
+                        live_cells = [("Sensibilidad", live['sensitivity']), ("Especificidad", live['specificity']),
+                                      ("VPP", live['ppv']), ("F2-Score", live['f2'])]
+                        cells_html = "".join(
+                            f"""<div style="background:white; border:1px solid #EEE; border-radius:8px; padding:6px 8px; text-align:center;">
+                            <div style="font-size:0.65rem; color:#999; font-weight:700; text-transform:uppercase;">{name}</div>
+                            <div style="font-size:1.05rem; color:{CEMP_DARK}; font-weight:800;">{'—' if value != value else f'{value:.3f}'}</div>
+                        </div>""" for name, value in live_cells)
+                        st.markdown(f"""
+                    <div style="display:grid; grid-template-columns:1fr 1fr; gap:6px; margin:5px 15px 8px 0;">{cells_html}</div>
+                    <div style="font-size:0.75rem; color:{NOTE_GRAY_TEXT}; margin-right:15px; margin-bottom:10px;">
+                        VP <b>{live['tp']}</b> · FP <b>{live['fp']}</b> · VN <b>{live['tn']}</b> · FN <b>{live['fn']}</b>
+                        &nbsp;(n = {analysis.n}, AUC {analysis.auc:.3f})
+                    </div>
+                    """, unsafe_allow_html=True)
                 
-                # --- NUEVA FUNCIÓN: MODAL (POP-UP) CON EL MISMO ESTILO QUE TAB 4 ---
-                @st.dialog("Ficha Técnica Resumida")
-                def ver_metricas_modal():
-                    # Aquí re-inyectamos los estilos para asegurar que se vean IGUAL dentro del modal
-                    # y usamos la misma estructura HTML que en Tab 4.
-                    st.markdown(f"""
+                    # --- NUEVA FUNCIÓN: MODAL (POP-UP) CON EL MISMO ESTILO QUE TAB 4 ---
+                    @st.dialog("Ficha Técnica Resumida")
+                    def ver_metricas_modal():
+                        # Con conjunto de validación las métricas se calculan en vivo (también para el umbral elegido);
+                        # sin él se muestran las publicadas del test independiente
+                        columns = [("Umbral Estándar (0.5)", 0.5, "badge-standard"), ("Umbral Óptimo (0.27)", 0.27, "badge-optimal")]
+                        if analysis is not None:
+                            if threshold not in (0.5, 0.27):
+                                columns.append((f"Tu Selección ({threshold:.2f})", threshold, "badge-standard"))
+                            stats = [analysis.at(t) for _, t, _ in columns]
+                            values = {
+                                "Accuracy": [f"{m['accuracy']:.3f}" for m in stats],
+                                "Precision": [f"{m['ppv']:.3f}" for m in stats],
+                                "Recall (Sensibilidad)": [f"{m['sensitivity']:.3f}" for m in stats],
+                                "Especificidad": [f"{m['specificity']:.3f}" for m in stats],
+                                "F2-Score": [f"{m['f2']:.3f}" for m in stats],
+                                "VP / FP / VN / FN": [f"{m['tp']} / {m['fp']} / {m['tn']} / {m['fn']}" for m in stats],
+                                "AUC-ROC": [f"{analysis.auc:.3f}"] * len(stats),
+                            }
+                            metrics_title = "Métricas de Rendimiento (Validación)"
+                            metrics_desc = f"Calculadas sobre el conjunto de validación cargado ({analysis.n} pacientes, {analysis.positives} con diabetes). Se prioriza la <strong>Sensibilidad (Recall)</strong> para minimizar falsos negativos."
+                        else:
+                            values = {
+                                "Accuracy": ["0.738", "0.719"],
+                                "Precision": ["0.604", "0.560"],
+                                "Recall (Sensibilidad)": ["0.733", "0.924"],
+                                "F2-Score": ["0.703", "0.818"],
+                                "AUC-ROC": ["0.815", "0.815"],
+                            }
+                            metrics_title = "Métricas de Rendimiento (Test)"
+                            metrics_desc = "Evaluación sobre conjunto de test independiente (10 repeticiones). Se prioriza la <strong>Sensibilidad (Recall)</strong> para minimizar falsos negativos."
+
+                        metrics_head = "".join(f'<th><span class="{badge}">{label}</span></th>' for label, _, badge in columns)
+                        body_rows = []
+                        for name, row in values.items():
+                            highlight = name in ("Recall (Sensibilidad)", "F2-Score")
+                            cells = "".join(
+                                f'<td class="highlight-optimal">{v}</td>' if highlight and columns[i][1] == 0.27 else f"<td>{v}</td>"
+                                for i, v in enumerate(row))
+                            row_class = ' class="highlight-row"' if highlight else ""
+                            name_style = f' style="color:{CEMP_DARK}; font-weight:800;"' if highlight else ""
+                            body_rows.append(f'<tr{row_class}><td class="metric-name-col"{name_style}>{name}</td>{cells}</tr>')
+                        metrics_body = "".join(body_rows)
+
+                        # Aquí re-inyectamos los estilos para asegurar que se vean IGUAL dentro del modal
+                        # y usamos la misma estructura HTML que en Tab 4.
+                        st.markdown(f"""
                     <style>
                         /* ESTILOS PARA LA TABLA DE MÉTRICAS (Replicados para el Modal) */
                         .metrics-table {{
@@ -821,50 +1094,25 @@ elif st.session_state.page == "simulacion":
                     </style>
                     
                     <div>
-                        <div class="tech-card-title">Métricas de Rendimiento (Test)</div>
+                        <div class="tech-card-title">{metrics_title}</div>
                         <p style="font-size:0.9rem; color:#666; margin-bottom:15px; text-align: justify;">
-                            Evaluación sobre conjunto de test independiente (10 repeticiones). Se prioriza la <strong>Sensibilidad (Recall)</strong> para minimizar falsos negativos.
+                            {metrics_desc}
                         </p>
                         <table class="metrics-table">
                             <thead>
                                 <tr>
                                     <th></th>
-                                    <th><span class="badge-standard">Umbral Estándar (0.5)</span></th>
-                                    <th><span class="badge-optimal">Umbral Óptimo (0.27)</span></th>
+                                    {metrics_head}
                                 </tr>
                             </thead>
                             <tbody>
-                                <tr>
-                                    <td class="metric-name-col">Accuracy</td>
-                                    <td>0.738</td>
-                                    <td>0.719</td>
-                                </tr>
-                                <tr>
-                                    <td class="metric-name-col">Precision</td>
-                                    <td>0.604</td>
-                                    <td>0.560</td>
-                                </tr>
-                                <tr class="highlight-row">
-                                    <td class="metric-name-col" style="color:{CEMP_DARK}; font-weight:800;">Recall (Sensibilidad)</td>
-                                    <td>0.733</td>
-                                    <td class="highlight-optimal">0.924</td>
-                                </tr>
-                                <tr class="highlight-row">
-                                    <td class="metric-name-col" style="color:{CEMP_DARK}; font-weight:800;">F2-Score</td>
-                                    <td>0.703</td>
-                                    <td class="highlight-optimal">0.818</td>
-                                </tr>
-                                <tr>
-                                    <td class="metric-name-col">AUC-ROC</td>
-                                    <td>0.815</td>
-                                    <td>0.815</td>
-                                </tr>
+                                {metrics_body}
                             </tbody>
                         </table>
                     </div>
                     """, unsafe_allow_html=True)
 
-                st.markdown(f"""
+                    st.markdown(f"""
                 <div style="background-color:{NOTE_GRAY_BG}; margin-right: 15px; padding:15px; border-radius:8px; border:1px solid #E9ECEF; color:{NOTE_GRAY_TEXT}; font-size:0.85rem; display:flex; align-items:start; gap:10px; text-align: justify;">
                     <span style="font-size:1.1rem;">💡</span> 
                     <div>
@@ -873,8 +1121,8 @@ elif st.session_state.page == "simulacion":
                 </div>
                 """, unsafe_allow_html=True)
                 
-                # CSS específico para el botón de métricas (Rosa transparente)
-                st.markdown(f"""
+                    # CSS específico para el botón de métricas (Rosa transparente)
+                    st.markdown(f"""
                 <style>
                 section[data-testid="stMain"] button[kind="secondary"] {{
                     background-color: rgba(233, 127, 135, 0.15) !important;
@@ -889,109 +1137,26 @@ elif st.session_state.page == "simulacion":
                 </style>
                 """, unsafe_allow_html=True)
                 
-                # BOTÓN QUE ABRE EL MODAL
-                st.write("") 
-                if st.button("Ver Tabla Comparativa", type="secondary", use_container_width=True):
-                    ver_metricas_modal()
-
-            with c_calib_2:
-                x = np.linspace(-0.15, 1.25, 500)
-                y_sanos = 1.9 * np.exp(-((x - 0.1)**2) / (2 * 0.11**2)) + \
-                          0.5 * np.exp(-((x - 0.55)**2) / (2 * 0.15**2))
-                y_enfermos = 0.35 * np.exp(-((x - 0.28)**2) / (2 * 0.1**2)) + \
-                             1.4 * np.exp(-((x - 0.68)**2) / (2 * 0.16**2))
-                
-                fig_calib, ax_calib = plt.subplots(figsize=(6, 2.5))
-                # Fondo transparente para este gráfico pequeño que va sobre el fondo de la app
-                fig_calib.patch.set_facecolor('none')
-                ax_calib.set_facecolor('none')
-                ax_calib.fill_between(x, y_sanos, color="#BDC3C7", alpha=0.3, label="Clase 0: No Diabetes")
-                ax_calib.plot(x, y_sanos, color="gray", lw=0.8, alpha=0.6)
-                ax_calib.fill_between(x, y_enfermos, color=CEMP_PINK, alpha=0.3, label="Clase 1: Diabetes")
-                ax_calib.plot(x, y_enfermos, color=CEMP_PINK, lw=0.8, alpha=0.6)
-                ax_calib.axvline(0.27, color=OPTIMAL_GREEN, linestyle="--", linewidth=1.5, label="Óptimo (0.27)")
-                ax_calib.axvline(threshold, color=CEMP_DARK, linestyle="--", linewidth=2, label="Tu Selección")
-                ax_calib.set_yticks([])
-                ax_calib.set_xlim(-0.2, 1.25)
-                ax_calib.spines['top'].set_visible(False)
-                ax_calib.spines['right'].set_visible(False)
-                ax_calib.spines['bottom'].set_visible(False)
-                ax_calib.spines['left'].set_visible(False)
-                ax_calib.set_xlabel("Probabilidad Predicha", fontsize=8, color="#888")
-                ax_calib.legend(loc='upper right', fontsize=6, frameon=False)
-                
-                st.image(fig_to_bytes(fig_calib), use_container_width=True)
-                plt.close(fig_calib)
-
-        # PREPARAR DATOS PARA EL MODELO REAL
-        is_prediabetes = 1 if glucose >= 140 else 0
+                    # BOTÓN QUE ABRE EL MODAL
+                    st.write("") 
+                    if st.button("Ver Tabla Comparativa", type="secondary", use_container_width=True):
+                        ver_metricas_modal()
+
+                with c_calib_2:
+                    # SVG generado a partir de los números: sin Matplotlib en cada interacción
+                    with timer.span("gráfico: calibración"):
+                        densities = analysis.class_densities() if analysis is not None else None
+                        st.markdown(calibration_svg(threshold, 0.27, CEMP_PINK, CEMP_DARK, OPTIMAL_GREEN, densities), unsafe_allow_html=True)
+
+            c_left, c_right = st.columns([1.8, 1], gap="medium") 
         
-        # DataFrame con los nombres de columna EXACTOS
-        input_data = pd.DataFrame([[
-            pregnancies,
-            glucose,
-            blood_pressure,
-            insulin,
-            bmi,
-            dpf,
-            age,
-            proxy_index, # Indice_resistencia
-            bmi_sq,      # BMI_square
-            is_prediabetes
-        ]], columns=['Pregnancies', 'Glucose', 'BloodPressure', 'Insulin', 'BMI', 'DPF', 'Age', 'Indice_resistencia', 'BMI_square', 'Is_prediabetes'])
-        
-        if 'model' in st.session_state and hasattr(st.session_state.model, 'predict_proba'):
-            try:
-                prob = st.session_state.model.predict_proba(input_data)[0][1]
-            except:
-                st.session_state.model = MockModel()
-                prob = 0.5
-        else:
-            st.session_state.model = MockModel()
-            prob = 0.5
+            with c_left:
+                if st.session_state.predict_clicked:
+                    badges_html = f"""<div style="background:{risk_bg}; border:1px solid {risk_border}; color:{risk_border}; font-weight:bold; font-size:0.9rem; padding:8px 16px; border-radius:30px;">{risk_icon} {risk_label}</div><div style="background:#F8F9FA; border-radius:8px; padding: 4px 10px; border:1px solid #EEE; margin-top:5px;" title="{conf_desc}"><span style="font-size:0.7rem; color:#999; font-weight:600;">FIABILIDAD: </span><span style="font-size:0.75rem; color:{conf_color}; font-weight:800;">{conf_text}</span></div>"""
+                else:
+                    badges_html = """<div style="color:#BDC3C7; font-size:0.8rem; font-weight:600; padding:10px; font-style:italic;">Análisis pendiente...</div>"""
 
-        is_high = prob > threshold 
-        
-        distancia_al_corte = abs(prob - threshold)
-        if distancia_al_corte > 0.15:
-            conf_text, conf_color = "ALTA", GOOD_TEAL
-            conf_desc = "Probabilidad claramente alejada del umbral."
-        elif distancia_al_corte > 0.05:
-            conf_text, conf_color = "MEDIA", "#F39C12"
-            conf_desc = "Probabilidad relativamente cerca del umbral."
-        else:
-            conf_text, conf_color = "BAJA", CEMP_PINK
-            conf_desc = "Zona de incertidumbre clínica."
-
-        risk_color = CEMP_PINK if is_high else GOOD_TEAL
-        risk_label = "ALTO RIESGO" if is_high else "BAJO RIESGO"
-        risk_icon = "🔴" if is_high else "🟢"
-        risk_bg = "#FFF5F5" if is_high else "#F0FDF4"
-        risk_border = CEMP_PINK if is_high else GOOD_TEAL
-        
-        alerts = []
-        if glucose >= 200: alerts.append("Posible Diabetes")
-        elif glucose >= 140: alerts.append("Posible Prediabetes")
-        if bmi >= 40: alerts.append("Obesidad Mórbida (G3)")
-        elif bmi >= 35: alerts.append("Obesidad G2")
-        elif bmi >= 30: alerts.append("Obesidad G1")
-        elif bmi >= 25: alerts.append("Sobrepeso")
-        elif bmi < 18.5 and bmi > 0: alerts.append("Bajo Peso")
-        if proxy_index > 19769.5: alerts.append("Resistencia Insulina")
-        if blood_pressure > 90: alerts.append("Hipertensión Diastólica")
-        
-        if not alerts: insight_txt, insight_bd, alert_icon = "Sin hallazgos significativos", GOOD_TEAL, "✅"
-        else: insight_txt, insight_bd, alert_icon = " • ".join(alerts), CEMP_PINK, "⚠️"
-
-        c_left, c_right = st.columns([1.8, 1], gap="medium") 
-        
-        with c_left:
-            if st.session_state.predict_clicked:
-                badges_html = f"""<div style="background:{risk_bg}; border:1px solid {risk_border}; color:{risk_border}; font-weight:bold; font-size:0.9rem; padding:8px 16px; border-radius:30px;">{risk_icon} {risk_label}</div><div style="background:#F8F9FA; border-radius:8px; padding: 4px 10px; border:1px solid #EEE; margin-top:5px;" title="{conf_desc}"><span style="font-size:0.7rem; color:#999; font-weight:600;">FIABILIDAD: </span><span style="font-size:0.75rem; color:{conf_color}; font-weight:800;">{conf_text}</span></div>"""
-            else:
-                badges_html = """<div style="color:#BDC3C7; font-size:0.8rem; font-weight:600; padding:10px; font-style:italic;">Análisis pendiente...</div>"""
-
-            st.markdown(f"""
+                st.markdown(f"""
             <div class="card card-auto" style="flex-direction:row; align-items:center; justify-content:space-between;">
                 <div style="display:flex; align-items:center; gap:20px; flex-grow:1;">
                     <div style="background:rgba(233, 127, 135, 0.1); width:60px; height:60px; border-radius:50%; display:flex; align-items:center; justify-content:center; font-size:2rem; color:{CEMP_DARK};">👤</div>
@@ -1006,10 +1171,10 @@ elif st.session_state.page == "simulacion":
                 </div>
             </div>""", unsafe_allow_html=True)
 
-            g_pos = min(100, max(0, (glucose - 50) / 3.0)) 
-            b_pos = min(100, max(0, (bmi - 10) * 2.5)) 
+                g_pos = min(100, max(0, (glucose - 50) / 3.0)) 
+                b_pos = min(100, max(0, (bmi - 10) * 2.5)) 
             
-            st.markdown(f"""<div class="card">
+                st.markdown(f"""<div class="card">
                 <span class="card-header">CONTEXTO POBLACIONAL</span>
                 <div style="margin-top:15px;">
                     <div style="font-size:0.8rem; font-weight:bold; color:#666; margin-bottom:5px;">GLUCOSA 2H (TEST TOLERANCIA) <span style="font-weight:normal">({glucose} mg/dL)</span></div>
@@ -1042,8 +1207,37 @@ elif st.session_state.page == "simulacion":
                 </div>
             </div>""", unsafe_allow_html=True)
 
-        with c_right:
-            st.markdown(f"""<div class="card card-auto" style="border-left:5px solid {insight_bd}; justify-content:center;">
+                with st.expander("Exploración «what-if»: superficie Glucosa × BMI"):
+                    st.toggle("Activar superficie de riesgo precalculada", key="whatif_mode",
+                              help="Puntúa de una vez una rejilla de glucosa y BMI con el resto de variables fijas; al mover esos deslizadores la probabilidad se interpola sin llamar al modelo.")
+                    if risk_surface is not None:
+                        m_x, m_y = risk_surface.position(glucose, bmi)
+                        with timer.span("gráfico: superficie what-if"):
+                            surface_uri = risk_surface.png_data_uri([GOOD_TEAL, '#FFD54F', CEMP_PINK])
+                        whatif_txt = f"{whatif_prob:.1%}" if whatif_prob is not None else "fuera de la rejilla"
+                        st.markdown(f"""<div style="display:flex; gap:8px; align-items:stretch; margin-top:5px;">
+                        <div style="writing-mode:vertical-rl; transform:rotate(180deg); font-size:0.7rem; color:#888; text-align:center;">BMI ({risk_surface.bmi[0]:.0f} – {risk_surface.bmi[-1]:.0f})</div>
+                        <div style="flex-grow:1;">
+                            <div style="position:relative; width:100%; aspect-ratio:2/1; border-radius:6px; overflow:hidden; border:1px solid #EEE;">
+                                <img src="{surface_uri}" style="position:absolute; inset:0; width:100%; height:100%;">
+                                <div style="position:absolute; left:{m_x}%; top:{m_y}%; width:14px; height:14px; margin:-7px 0 0 -7px; border-radius:50%; background:white; border:3px solid {CEMP_DARK}; box-shadow:0 0 4px rgba(0,0,0,0.4);" title="Paciente actual"></div>
+                            </div>
+                            <div style="display:flex; justify-content:space-between; font-size:0.7rem; color:#888; margin-top:3px;">
+                                <span>{risk_surface.glucose[0]:.0f}</span><span>Glucosa (mg/dL)</span><span>{risk_surface.glucose[-1]:.0f}</span>
+                            </div>
+                        </div>
+                    </div>
+                    <div style="display:flex; align-items:center; gap:8px; font-size:0.7rem; color:#888; margin-top:8px;">
+                        <span>0%</span><div style="flex-grow:1; height:6px; border-radius:3px; background:{RISK_GRADIENT};"></div><span>100%</span>
+                    </div>
+                    <div style="font-size:0.85rem; color:{CEMP_DARK}; margin-top:8px;">Probabilidad estimada en el punto actual: <b>{whatif_txt}</b> <span style="color:#888;">(umbral {threshold:.0%})</span></div>
+                    """, unsafe_allow_html=True)
+                        st.caption("Valor interpolado sobre la rejilla; al pulsar CALCULAR RIESGO se usa siempre la predicción exacta del modelo.")
+                    elif st.session_state.get('whatif_mode'):
+                        st.caption("La superficie no está disponible con el modelo de demostración.")
+
+            with c_right:
+                st.markdown(f"""<div class="card card-auto" style="border-left:5px solid {insight_bd}; justify-content:center;">
                 <span class="card-header" style="color:{insight_bd}; margin-bottom:10px;">HALLAZGOS CLAVE</span>
                 <div style="display:flex; justify-content:space-between; align-items:center;">
                     <h3 style="margin:0; color:{CEMP_DARK}; font-size:1.1rem; line-height:1.4;">{insight_txt}</h3>
@@ -1051,123 +1245,88 @@ elif st.session_state.page == "simulacion":
                 </div>
             </div>""", unsafe_allow_html=True)
             
-            # --- LÓGICA DE BOTONES Y CÁLCULO SHAP PARA INFORME ---
-            if st.session_state.predict_clicked:
+                # --- LÓGICA DE BOTONES Y CÁLCULO SHAP PARA INFORME ---
+                if st.session_state.predict_clicked:
                 
-                # 1. Calcular SHAP para el informe (si está disponible)
-                shap_html_rows = ""
-                if SHAP_AVAILABLE and hasattr(st.session_state.model, 'named_steps'):
-                    try:
-                        pipeline = st.session_state.model
-                        step1 = pipeline.named_steps['imputer'].transform(input_data)
-                        step2 = pipeline.named_steps['scaler'].transform(step1)
-                        model_step = pipeline.named_steps['model']
-                        explainer = shap.TreeExplainer(model_step)
-                        shap_values = explainer.shap_values(step2)
-                        
-                        # Obtener valores para la clase positiva (Diabetes)
-                        if isinstance(shap_values, list): shap_val_instance = shap_values[1][0]
-                        elif len(shap_values.shape) == 3: shap_val_instance = shap_values[0, :, 1]
-                        else: shap_val_instance = shap_values[0]
+                    # 1. Calcular SHAP para el informe (si está disponible)
+                    shap_html_rows = ""
+                    explanation_note = None
+                    if SHAP_AVAILABLE and hasattr(get_pipeline(), 'named_steps'):
+                        try:
+                            pipeline = get_pipeline()
+                            # Valores para la clase positiva (Diabetes), compartidos con la pestaña Explicabilidad
+                            with timer.span("shap"):
+                                explanation = load_explainer(pipeline, model_key, engine).explain(input_data, explain_mode, explain_budget)
+                            shap_val_instance = explanation.values
+                            explanation_note = method_note(explanation.mode, get_explain_check())
                             
-                        # Crear DataFrame y ordenar por impacto absoluto
-                        df_shap = pd.DataFrame({
-                            'Feature': input_data.columns,
-                            'Impact': shap_val_instance,
-                            'Value': input_data.iloc[0].values
-                        })
-                        df_shap['AbsImpact'] = df_shap['Impact'].abs()
-                        # Top 5 factores más influyentes
-                        df_top_shap = df_shap.sort_values(by='AbsImpact', ascending=False).head(5)
+                            # Crear DataFrame y ordenar por impacto absoluto
+                            df_shap = pd.DataFrame({
+                                'Feature': input_data.columns,
+                                'Impact': shap_val_instance,
+                                'Value': input_data.iloc[0].values
+                            })
+                            df_shap['AbsImpact'] = df_shap['Impact'].abs()
+                            # Top 5 factores más influyentes
+                            df_top_shap = df_shap.sort_values(by='AbsImpact', ascending=False).head(5)
                         
-                        # Generar filas HTML
-                        for _, row in df_top_shap.iterrows():
-                            impact_val = row['Impact']
-                            # Color: Rojo si aumenta riesgo, Verde si disminuye
-                            color = "#C0392B" if impact_val > 0 else "#27AE60"
-                            sign = "+" if impact_val > 0 else ""
-                            # Limpiar nombre de la variable
-                            feat_name_clean = row['Feature'].replace('Indice_resistencia', 'Índice RI').replace('BMI_square', 'BMI² (No lineal)').replace('BloodPressure', 'Presión Arterial').replace('Pregnancies', 'Embarazos').replace('Age', 'Edad').replace('Glucose', 'Glucosa 2h').replace('Insulin', 'Insulina').replace('Is_prediabetes', 'Prediabetes Detectada')
-
-                            shap_html_rows += f"""
-                                <tr>
-                                    <td style='padding:6px; border-bottom:1px solid #eee; font-weight:500;'>{feat_name_clean}</td>
-                                    <td style='padding:6px; border-bottom:1px solid #eee; text-align:center; color:#666;'>{row['Value']:.2f}</td>
-                                    <td style='padding:6px; border-bottom:1px solid #eee; text-align:right; font-weight:bold; color:{color};'>
-                                        {sign}{impact_val:.3f} (log-odds)
-                                    </td>
-                                </tr>
-                            """
-                    except Exception as e:
-                         print(f"Error SHAP Report: {e}")
-                         shap_html_rows = "<tr><td colspan='3' style='text-align:center; color:#999; font-style:italic;'>Análisis detallado no disponible.</td></tr>"
-
-                # 2. Determinar la recomendación activa
-                active_rec = "Reevaluar en 3-6 meses."
-                if glucose >= 200: active_rec = "Protocolo de confirmación diagnóstica urgente. Descartar cetoacidosis."
-                elif is_high and distancia_al_corte > 0.05: active_rec = "Derivación a Endocrinología. Solicitar HbA1c y perfil lipídico. Valorar inicio de metformina."
-                elif not is_high and distancia_al_corte <= 0.05: active_rec = "Repetir TTOG en 3-6 meses. Monitorización estrecha de glucemia basal."
-                else: active_rec = "Seguimiento rutinario anual según guías locales. Mantener estilos de vida saludables."
-
-                # 3. Generar el HTML del informe
-                report_html = create_html_report(
-                    patient_name, 
-                    date_str, 
-                    prob, 
-                    risk_label, 
-                    inputs_dict={
-                        "Glucosa 2h": f"{glucose} mg/dL",
-                        "Insulina 2h": f"{insulin} µU/ml",
-                        "Índice RI (Glucosa x Insulina)": f"{proxy_index}", # Nombre corregido
-                        "BMI": f"{bmi:.1f} kg/m²",
-                        "Edad": f"{age} años",
-                        "Presión Arterial": f"{blood_pressure} mm Hg",
-                        "Embarazos": f"{pregnancies}",
-                        "Carga Genética (DPF)": f"{dpf:.2f}"
-                    },
-                    shap_rows_html=shap_html_rows, # Pasamos las filas SHAP
-                    recommendation=active_rec
-                )
+                            # Generar filas HTML
+                            shap_html_rows = shap_rows_html(zip(df_top_shap['Feature'], df_top_shap['Value'], df_top_shap['Impact']))
+                        except Exception as e:
+                             print(f"Error SHAP Report: {e}")
+                             shap_html_rows = "<tr><td colspan='3' style='text-align:center; color:#999; font-style:italic;'>Análisis detallado no disponible.</td></tr>"
+
+                    # 2. Determinar la recomendación activa
+                    active_rec = recommendation_for(glucose, prob, threshold)
+
+                    # 3. Generar el HTML del informe
+                    with timer.span("informe HTML"):
+                        report_html = create_html_report(
+                            patient_name, 
+                            date_str, 
+                            prob, 
+                            risk_label, 
+                            inputs_dict={
+                                "Glucosa 2h": f"{glucose} mg/dL",
+                                "Insulina 2h": f"{insulin} µU/ml",
+                                "Índice RI (Glucosa x Insulina)": f"{proxy_index}", # Nombre corregido
+                                "BMI": f"{bmi:.1f} kg/m²",
+                                "Edad": f"{age} años",
+                                "Presión Arterial": f"{blood_pressure} mm Hg",
+                                "Embarazos": f"{pregnancies}",
+                                "Carga Genética (DPF)": f"{dpf:.2f}"
+                            },
+                            shap_rows_html=shap_html_rows, # Pasamos las filas SHAP
+                            recommendation=active_rec,
+                            explanation_note=explanation_note
+                        )
                 
-                # 4. Mostrar botón de descarga
-                st.download_button(
-                    label="📄 DESCARGAR INFORME CLÍNICO",
-                    data=report_html,
-                    file_name=f"CDSS_Diabetes_{patient_name.replace(' ', '_')}_{date_str.replace(' ', '_')}.html",
-                    mime="text/html",
-                    type="primary",
-                    use_container_width=True
-                )
-            else:
-                # Botón de cálculo inicial
-                if st.button("CALCULAR RIESGO", use_container_width=True, type="primary"):
-                    st.session_state.predict_clicked = True
-                    st.rerun()
-
-            fig, ax = plt.subplots(figsize=(3.2, 3.2))
-            fig.patch.set_facecolor('none')
-            ax.set_facecolor('none')
-
-            if st.session_state.predict_clicked:
-                ax.pie([prob, 1-prob], colors=[risk_color, '#F4F6F9'], startangle=90, counterclock=False, wedgeprops=dict(width=0.15, edgecolor='none'))
-                threshold_angle = 90 - (threshold * 360)
-                theta_rad = np.deg2rad(threshold_angle)
-                x1 = 0.85 * np.cos(theta_rad)
-                y1 = 0.85 * np.sin(theta_rad)
-                x2 = 1.15 * np.cos(theta_rad)
-                y2 = 1.15 * np.sin(theta_rad)
-                ax.plot([x1, x2], [y1, y2], color=CEMP_DARK, linestyle='--', linewidth=2)
-                center_text = f"{prob*100:.1f}%"
-            else:
-                ax.pie([100], colors=['#EEEEEE'], startangle=90, counterclock=False, wedgeprops=dict(width=0.15, edgecolor='none'))
-                center_text = "---"
-
-            chart_html = fig_to_html(fig) 
-            plt.close(fig)
+                    # 4. Mostrar botón de descarga
+                    st.download_button(
+                        label="📄 DESCARGAR INFORME CLÍNICO",
+                        data=report_html,
+                        file_name=f"CDSS_Diabetes_{patient_name.replace(' ', '_')}_{date_str.replace(' ', '_')}.html",
+                        mime="text/html",
+                        type="primary",
+                        use_container_width=True
+                    )
+                else:
+                    # Botón de cálculo inicial
+                    if st.button("CALCULAR RIESGO", use_container_width=True, type="primary"):
+                        st.session_state.predict_clicked = True
+                        st.session_state.record_pending = True
+                        st.rerun()
+
+                # SVG en línea (unos cientos de bytes) en lugar de un PNG en base64
+                with timer.span("gráfico: donut"):
+                    chart_html = donut_svg(prob, threshold, risk_color, CEMP_DARK, show_prob=st.session_state.predict_clicked)
+                center_text = f"{prob*100:.1f}%" if st.session_state.predict_clicked else "---"
+                # Versión que ha calculado la probabilidad (la misma que queda en historial y auditoría)
+                version_html = f"""<div style="margin-top: 6px; font-size: 0.65rem; color: #999;" title="Versión del modelo">MODELO: {html.escape(prediction_model)}</div>""" if st.session_state.predict_clicked else ""
             
-            prob_help = get_help_icon("Probabilidad calculada por el modelo de IA.")
+                prob_help = get_help_icon("Probabilidad calculada por el modelo de IA.")
             
-            st.markdown(f"""<div class="card" style="text-align:center; justify-content: center;">
+                st.markdown(f"""<div class="card" style="text-align:center; justify-content: center;">
                 <span class="card-header" style="justify-content:center; margin-bottom:15px;">PROBABILIDAD IA{prob_help}</span>
                 <div style="position:relative; display:inline-block; margin: auto;">
                     {chart_html}
@@ -1179,13 +1338,50 @@ elif st.session_state.page == "simulacion":
                     <span style="display: inline-block; width: 15px; border-top: 2px dashed {CEMP_DARK};"></span>
                     <span>Umbral de decisión</span>
                 </div>
+                {version_html}
             </div>""", unsafe_allow_html=True)
 
-    with tab2:
-        st.write("")
+            # --- HISTORIAL DEL PACIENTE ---
+            visits = []
+            if patient_name == DEFAULT_PATIENT_ID:
+                st.caption("Escribe el ID del paciente para guardar sus evaluaciones y ver su historial.")
+            else:
+                try:
+                    with timer.span("historial"):
+                        visits = load_history_store(HISTORY_PATH).visits(patient_name)
+                except Exception as e:
+                    st.warning(f"No se pudo leer el historial: {e}")
+            # La evaluación recién encolada puede no estar escrita aún (o haberse escrito justo después de leer):
+            # se añade si falta, en su sitio por fecha de consulta
+            if history_future is not None and not (history_future.done() and history_future.exception() is not None) \
+                    and not any(v['created_at'] == evaluation['created_at'] for v in visits):
+                visits.append(evaluation)
+                visits.sort(key=lambda v: (v['eval_date'], v['created_at']))
+            if visits:
+                with st.expander(f"📈 Historial de {patient_name} ({len(visits)} evaluaciones)", expanded=len(visits) > 1):
+                    dates = [datetime.date.fromisoformat(v['eval_date']) for v in visits]
+                    st.markdown(risk_trend_svg([d.toordinal() for d in dates], [format_date(d) for d in dates],
+                                               [v['prob'] for v in visits], threshold, GOOD_TEAL, CEMP_PINK, CEMP_DARK),
+                                unsafe_allow_html=True)
+                    st.dataframe(pd.DataFrame({
+                        'Fecha': [format_date(d) for d in dates],
+                        'Probabilidad': [v['prob'] for v in visits],
+                        'Riesgo': [risk_label_for(v['prob'] > v['threshold']) for v in visits],
+                        'Umbral': [v['threshold'] for v in visits],
+                        'Glucosa': [v['glucose'] for v in visits],
+                        'BMI': [v['bmi'] for v in visits],
+                        'Insulina': [v['insulin'] for v in visits],
+                        'Modelo': [v['model_version'] or "—" for v in visits],
+                    }).iloc[::-1], hide_index=True, use_container_width=True,
+                        column_config={"Probabilidad": st.column_config.ProgressColumn("Probabilidad", min_value=0.0, max_value=1.0, format="%.3f"),
+                                       "BMI": st.column_config.NumberColumn("BMI", format="%.1f")})
+
+    if tab2.open:
+        with tab2, timer.span("pestaña: Explicabilidad"):
+            st.write("")
         
-        # --- CABECERA CEREBRITO CON BORDE ROSA ---
-        st.markdown(f"""
+            # --- CABECERA CEREBRITO CON BORDE ROSA ---
+            st.markdown(f"""
         <div style="background-color:#F8F9FA; padding:15px; border-radius:10px; border-left:5px solid {CEMP_PINK}; margin-bottom:20px;">
             <h4 style="margin:0; color:#2C3E50;">🧠 Inteligencia Artificial Explicable (XAI)</h4>
             <p style="margin:5px 0 0 0; color:#666; font-size:0.9rem;">
@@ -1194,119 +1390,153 @@ elif st.session_state.page == "simulacion":
         </div>
         """, unsafe_allow_html=True)
 
-        c_exp1, c_exp2 = st.columns(2, gap="medium")
+            feat_names_es = ['Embarazos', 'Glucosa', 'Presión Art.', 'Insulina', 'BMI', 'Ant. Familiares', 'Edad', 'Índice Resist.', 'BMI²', 'Prediabetes']
+            global_shap = get_global_shap() if not isinstance(predictor, MockModel) else None
+            c_exp1, c_exp2 = st.columns(2, gap="medium")
         
-        # --- COLUMNA IZQUIERDA: POBLACIÓN GENERAL ---
-        with c_exp1:
-            st.markdown(f"""
+            # --- COLUMNA IZQUIERDA: POBLACIÓN GENERAL ---
+            with c_exp1:
+                st.markdown(f"""
             <div class="card-header-box">
                 <div class="card-title-text">VISIÓN GLOBAL DEL MODELO</div>
             </div>
             """, unsafe_allow_html=True)
             
-            if hasattr(st.session_state.model, 'named_steps'):
-                try:
-                    rf = st.session_state.model.named_steps['model']
-                    importances = rf.feature_importances_
-                    
-                    feat_names_es = ['Embarazos', 'Glucosa', 'Presión Art.', 'Insulina', 'BMI', 'Ant. Familiares', 'Edad', 'Índice Resist.', 'BMI²', 'Prediabetes']
-                    df_imp = pd.DataFrame({'Feature': feat_names_es, 'Importancia': importances})
-                    df_imp = df_imp.sort_values(by='Importancia', ascending=True)
-                    
-                    fig_imp, ax_imp = plt.subplots(figsize=(6, 5))
-                    fig_imp.patch.set_facecolor('white') 
-                    ax_imp.set_facecolor('white')
-                    
-                    bars = ax_imp.barh(df_imp['Feature'], df_imp['Importancia'], color=CEMP_PINK, alpha=0.8)
-                    ax_imp.spines['top'].set_visible(False)
-                    ax_imp.spines['right'].set_visible(False)
-                    ax_imp.spines['bottom'].set_visible(False)
-                    ax_imp.spines['left'].set_visible(False)
-                    ax_imp.tick_params(axis='y', colors=CEMP_DARK, labelsize=9)
-                    ax_imp.tick_params(axis='x', colors='#999', labelsize=8)
-                    
-                    for bar in bars:
-                        width = bar.get_width()
-                        ax_imp.text(width + 0.005, bar.get_y() + bar.get_height()/2, 
-                                    f'{width*100:.1f}%', ha='left', va='center', fontsize=8, color='#666')
+                global_view = "Importancia (Gini)"
+                if global_shap is not None:
+                    global_view = st.radio("Vista global", ["Resumen SHAP (cohorte)", "Importancia (Gini)"], key="global_view",
+                                           horizontal=True, label_visibility="collapsed")
+                if global_shap is not None and global_view == "Resumen SHAP (cohorte)":
+                    # Precalculado fuera de línea: solo se dibuja una vez por resumen cargado
+                    with timer.span("gráfico: beeswarm SHAP"):
+                        summary_key = (model_key, global_shap.manifest['created'])
+                        st.image(shap_beeswarm_png(summary_key, global_shap.shap_values, global_shap.features, feat_names_es), use_container_width=True)
+                    st.caption(f"Valores SHAP de {global_shap.n_rows:,} pacientes de referencia ({global_shap.manifest['data']}).".replace(",", "."))
+                elif predictor is engine or hasattr(get_pipeline(), 'named_steps'):
+                    try:
+                        # El motor compilado ya trae las importancias: no hace falta deserializar el pickle
+                        importances = engine.feature_importances_ if predictor is engine else get_pipeline().named_steps['model'].feature_importances_
                     
-                    st.image(fig_to_bytes(fig_imp), use_container_width=True)
-                    plt.close(fig_imp)
+                        # Solo depende del modelo: se rasteriza una vez por modelo cargado
+                        with timer.span("gráfico: importancia global"):
+                            st.image(importance_png(model_key, feat_names_es, importances, CEMP_PINK, CEMP_DARK), use_container_width=True)
 
-                except:
-                    st.warning("No se pudo extraer la importancia global del modelo cargado.")
-            else:
-                st.warning("Modelo simulado: No hay datos reales de importancia global.")
+                    except:
+                        st.warning("No se pudo extraer la importancia global del modelo cargado.")
+                else:
+                    st.warning("Modelo simulado: No hay datos reales de importancia global.")
 
-            st.markdown(f"""
+                st.markdown(f"""
             <div class="card-footer-box">
                 <span style="color: {CEMP_PINK}; font-weight: 800;">Interpretación del Modelo (General):</span><br>
                 Este gráfico muestra qué <b>datos son más importantes</b> para la predicción del riesgo de padecer diabetes. Las <b>barras más largas</b> (como Glucosa o Índice RI) indican los <b>factores que más influyen</b> en el diagnóstico final para la población general.
             </div>
             """, unsafe_allow_html=True)
 
-        # --- COLUMNA DERECHA: PACIENTE ESPECÍFICO ---
-        with c_exp2:
-            st.markdown(f"""
+            # --- COLUMNA DERECHA: PACIENTE ESPECÍFICO ---
+            with c_exp2:
+                st.markdown(f"""
             <div class="card-header-box">
                 <div class="card-title-text">ANÁLISIS INDIVIDUAL (SHAP)</div>
             </div>
             """, unsafe_allow_html=True)
             
-            if SHAP_AVAILABLE and hasattr(st.session_state.model, 'named_steps') and st.session_state.predict_clicked:
-                try:
-                    pipeline = st.session_state.model
-                    step1 = pipeline.named_steps['imputer'].transform(input_data)
-                    step2 = pipeline.named_steps['scaler'].transform(step1)
-                    
-                    model_step = pipeline.named_steps['model']
-                    explainer = shap.TreeExplainer(model_step)
-                    shap_values = explainer.shap_values(step2)
-                    
-                    if isinstance(shap_values, list): shap_val_instance = shap_values[1][0]
-                    elif len(shap_values.shape) == 3: shap_val_instance = shap_values[0, :, 1]
-                    else: shap_val_instance = shap_values[0]
-                    
-                    if isinstance(explainer.expected_value, np.ndarray): base_value = explainer.expected_value[1]
-                    else: base_value = explainer.expected_value
-
-                    exp = shap.Explanation(
-                        values=shap_val_instance,
-                        base_values=base_value,
-                        data=input_data.iloc[0].values, 
-                        feature_names=input_data.columns
-                    )
-                    
-                    fig_shap, ax_shap = plt.subplots(figsize=(6, 5))
-                    fig_shap.patch.set_facecolor('white')
-                    ax_shap.set_facecolor('white')
-
-                    shap.plots.waterfall(exp, show=False, max_display=10)
-                    plt.tight_layout()
-                    
-                    st.image(fig_to_bytes(fig_shap), use_container_width=True)
-                    plt.close(fig_shap)
+                if SHAP_AVAILABLE and st.session_state.predict_clicked and hasattr(get_pipeline(), 'named_steps'):
+                    try:
+                        pipeline = get_pipeline()
+                        # Mismo cálculo (y mismo método) que el informe: se sirve desde la caché
+                        with timer.span("shap"):
+                            explanation = load_explainer(pipeline, model_key, engine).explain(input_data, explain_mode, explain_budget)
+                        shap_val_instance = explanation.values
+                        base_value = explanation.base_value
+
+                        # PNG cacheado por paciente y método: volver a la pestaña no vuelve a dibujarlo
+                        with timer.span("gráfico: cascada SHAP"):
+                            waterfall = shap_waterfall_png(shap_val_instance, base_value, feature_row[0], FEATURE_COLUMNS)
+                            st.image(waterfall, use_container_width=True)
+                        st.caption(f"{method_note(explanation.mode, get_explain_check())} Calculado en {explanation.elapsed_ms:.1f} ms.")
+
+                        # Dónde cae cada contribución del paciente dentro de la cohorte de referencia:
+                        # la cohorte es SHAP exacto, así que solo se compara con explicaciones exactas
+                        if global_shap is not None and explanation.mode != MODE_EXACT:
+                            st.caption("Los percentiles en la cohorte de referencia solo se muestran con SHAP exacto.")
+                        elif global_shap is not None:
+                            percentiles = global_shap.percentiles(shap_val_instance)
+                            order = np.argsort(-np.abs(shap_val_instance), kind='stable')
+                            st.dataframe(pd.DataFrame({
+                                'Variable': [feat_names_es[i] for i in order],
+                                'Impacto SHAP': [shap_val_instance[i] for i in order],
+                                'Percentil en la cohorte': [percentiles[i] for i in order],
+                            }), hide_index=True, use_container_width=True,
+                                column_config={"Impacto SHAP": st.column_config.NumberColumn("Impacto SHAP", format="%+.3f"),
+                                               "Percentil en la cohorte": st.column_config.ProgressColumn(
+                                                   "Percentil en la cohorte", min_value=0.0, max_value=100.0, format="%.0f",
+                                                   help="Porcentaje de pacientes de referencia con una contribución menor o igual")})
 
-                except Exception as e:
-                    st.error(f"Error generando SHAP: {e}")
-            else:
-                 st.markdown("""
+                    except Exception as e:
+                        st.error(f"Error generando SHAP: {e}")
+                else:
+                     st.markdown("""
                     <div style="display:flex; justify-content:center; align-items:center; height:300px; color:#aaa; font-style:italic;">
                         <div>Calcula el riesgo primero para ver el análisis individual.</div>
                     </div>
                     """, unsafe_allow_html=True)
             
-            st.markdown(f"""
+                st.markdown(f"""
             <div class="card-footer-box">
                 <span style="color: {CEMP_PINK}; font-weight: 800;">Interpretación para {patient_name}:</span><br>
                 El análisis parte de una <b>'Línea Base' (aprox. 50%)</b>. A este valor se le <b>suman (barras rojas)</b> o <b>restan (barras azules)</b> las contribuciones específicas de los datos del paciente. El <b>resultado final ({prob*100:.1f}%)</b> es la suma de estos factores.
             </div>
             """, unsafe_allow_html=True)
 
-    with tab3:
-        st.write("")
-        # --- CABECERA DEL FRAMEWORK ---
-        st.markdown(f"""
+            # --- ANÁLISIS DE SENSIBILIDAD (ancho completo) ---
+            st.markdown(f"""
+        <div class="card-header-box" style="margin-top:25px;">
+            <div class="card-title-text">ANÁLISIS DE SENSIBILIDAD</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+            if st.session_state.predict_clicked and not isinstance(predictor, MockModel):
+                patient_raw = {'Pregnancies': pregnancies, 'Glucose': glucose, 'BloodPressure': blood_pressure, 'Insulin': insulin,
+                               'Weight': weight, 'Height': height, 'DPF': dpf, 'Age': age}
+                try:
+                    # Todos los barridos de todas las variables en una única llamada a predict_proba
+                    with timer.span("modelo: sensibilidad"):
+                        curves = load_sensitivity_cache(model_key).get_or_compute(
+                            tuple(round(float(v), 4) for v in patient_raw.values()),
+                            lambda: sensitivity_curves(predictor, patient_raw)
+                        )
+                    sens_labels = [('Glucose', 'Glucosa (mg/dL)', "{:.0f}"), ('Insulin', 'Insulina (µU/ml)', "{:.0f}"),
+                                   ('BloodPressure', 'Presión Art. (mm Hg)', "{:.0f}"), ('Age', 'Edad (años)', "{:.0f}"),
+                                   ('Weight', 'Peso (kg)', "{:.1f}"), ('Height', 'Altura (m)', "{:.2f}"),
+                                   ('Pregnancies', 'Embarazos', "{:.0f}"), ('DPF', 'Ant. Familiares (DPF)', "{:.2f}")]
+                    with timer.span("gráfico: sensibilidad"):
+                        for row in (sens_labels[:4], sens_labels[4:]):
+                            for col, (column, label, fmt) in zip(st.columns(4, gap="small"), row):
+                                values, probs = curves[column]
+                                with col:
+                                    st.markdown(sensitivity_svg(label, values, probs, patient_raw[column], threshold, CEMP_PINK, CEMP_DARK, fmt), unsafe_allow_html=True)
+                except Exception as e:
+                    st.error(f"Error en el análisis de sensibilidad: {e}")
+            else:
+                st.markdown("""
+                <div style="display:flex; justify-content:center; align-items:center; height:120px; color:#aaa; font-style:italic;">
+                    <div>Calcula el riesgo primero para ver el análisis de sensibilidad.</div>
+                </div>
+                """, unsafe_allow_html=True)
+
+            st.markdown(f"""
+        <div class="card-footer-box">
+            <span style="color: {CEMP_PINK}; font-weight: 800;">Cómo leerlo:</span><br>
+            Cada panel muestra cómo <b>cambiaría la probabilidad</b> si solo se modificase esa variable en todo el rango de su control, manteniendo fijos el resto de datos del paciente (las variables derivadas como BMI, Índice RI o prediabetes se recalculan en cada punto). El <b>punto</b> marca el valor actual y la <b>línea discontinua</b> el umbral de decisión.
+        </div>
+        """, unsafe_allow_html=True)
+
+    if tab3.open:
+        with tab3, timer.span("pestaña: Framework de Acción"):
+            st.write("")
+            # --- CABECERA DEL FRAMEWORK ---
+            st.markdown(f"""
         <div style="background-color:#F8F9FA; padding:15px; border-radius:10px; border-left:5px solid {GOOD_TEAL}; margin-bottom:20px;">
             <h4 style="margin:0; color:#2C3E50;">👩🏻‍⚕️ Acción Clínica Recomendada </h4>
             <p style="margin:5px 0 0 0; color:#666; font-size:0.9rem;">
@@ -1315,26 +1545,26 @@ elif st.session_state.page == "simulacion":
         </div>
         """, unsafe_allow_html=True)
 
-        # --- LÓGICA PARA DETERMINAR EL ESCENARIO ACTIVO ---
-        active_scenario = "bajo" # Default
-        if st.session_state.predict_clicked:
-            if glucose >= 200:
-                active_scenario = "urgente"
-            elif is_high and distancia_al_corte > 0.05:
-                active_scenario = "alto"
-            elif not is_high and distancia_al_corte > 0.05:
-                active_scenario = "bajo"
-            else:
-                active_scenario = "incertidumbre"
-
-        # --- DEFINICIÓN DE ESTILOS DE FILA ---
-        style_urgente = "matrix-row-active" if active_scenario == "urgente" else ""
-        style_alto = "matrix-row-active" if active_scenario == "alto" else ""
-        style_incertidumbre = "matrix-row-active" if active_scenario == "incertidumbre" else ""
-        style_bajo = "matrix-row-active" if active_scenario == "bajo" else ""
+            # --- LÓGICA PARA DETERMINAR EL ESCENARIO ACTIVO ---
+            active_scenario = "bajo" # Default
+            if st.session_state.predict_clicked:
+                if glucose >= 200:
+                    active_scenario = "urgente"
+                elif is_high and distancia_al_corte > 0.05:
+                    active_scenario = "alto"
+                elif not is_high and distancia_al_corte > 0.05:
+                    active_scenario = "bajo"
+                else:
+                    active_scenario = "incertidumbre"
+
+            # --- DEFINICIÓN DE ESTILOS DE FILA ---
+            style_urgente = "matrix-row-active" if active_scenario == "urgente" else ""
+            style_alto = "matrix-row-active" if active_scenario == "alto" else ""
+            style_incertidumbre = "matrix-row-active" if active_scenario == "incertidumbre" else ""
+            style_bajo = "matrix-row-active" if active_scenario == "bajo" else ""
         
-        # --- MATRIZ VISUAL (HTML SIN INDENTACIÓN) ---
-        st.markdown(f"""
+            # --- MATRIZ VISUAL (HTML SIN INDENTACIÓN) ---
+            st.markdown(f"""
 <div class="matrix-container">
 <div class="matrix-row {style_urgente}" style="border-left: 5px solid {URGENT_RED};">
     <div class="matrix-result">
@@ -1403,13 +1633,14 @@ elif st.session_state.page == "simulacion":
 </div>
 """, unsafe_allow_html=True)
 
-    with tab4:
-        st.write("")
+    if tab4.open:
+        with tab4, timer.span("pestaña: Ficha Técnica"):
+            st.write("")
         
-        c_tech_1, c_tech_2 = st.columns([1.3, 1], gap="medium")
+            c_tech_1, c_tech_2 = st.columns([1.3, 1], gap="medium")
         
-        with c_tech_1:
-            st.markdown(f"""
+            with c_tech_1:
+                st.markdown(f"""
             <div class="card">
                 <div class="tech-card-title">Especificaciones del Modelo</div>
                 <p style="font-size:0.9rem; color:#666; margin-bottom:15px; text-align: justify;">
@@ -1424,7 +1655,28 @@ elif st.session_state.page == "simulacion":
             </div>
             """, unsafe_allow_html=True)
 
-            st.markdown(f"""
+                cache_stats = load_prediction_cache(model_key).stats()
+                st.caption(f"Caché de predicciones: {cache_stats['hits']} aciertos · {cache_stats['misses']} fallos · {cache_stats['size']}/{cache_stats['maxsize']} entradas")
+                if not isinstance(predictor, MockModel):
+                    broker_stats = load_inference_broker(predictor, model_key).stats()
+                    st.caption(f"Broker de inferencia: {broker_stats['items']} peticiones en {broker_stats['batches']} lotes · máx. {broker_stats['largest_batch']} por lote")
+                registry_stats = load_registry().stats()
+                loaded_txt = " · ".join(f"{m['version']} ({m['nbytes'] / 1e6:.1f} MB)" for m in registry_stats['loaded'])
+                st.caption(f"Modelos en memoria: {loaded_txt or 'ninguno'} · {registry_stats['loads']} cargas, {registry_stats['evictions']} expulsiones")
+                stores = {"historial": load_history_store(HISTORY_PATH), "auditoría": load_audit_log(AUDIT_DIR)}
+                st.caption("Escrituras fallidas: " + " · ".join(f"{name} {store.failures}" for name, store in stores.items()))
+                for name, store in stores.items():
+                    if store.failures:
+                        st.warning(f"Hay entradas de {name} que no se han guardado. Último error: {store.last_error}")
+                startup = model_handle.timings if model_handle is not None else {}
+                if 'bundle_load' in startup:
+                    st.caption(f"Arranque: imports {startup['imports']:.2f} s · carga del bundle mmap {startup['bundle_load'] * 1000:.1f} ms")
+                else:
+                    st.caption(f"Arranque: imports {startup.get('imports', 0):.2f} s · carga del modelo {startup.get('model_load', 0):.2f} s")
+                if model_handle is not None and model_handle.engine_error:
+                    st.caption(f"Motor compilado desactivado (se usa el pipeline): {model_handle.engine_error}")
+
+                st.markdown(f"""
             <div class="card">
                 <div id="metrics-anchor" class="tech-card-title">Métricas de Rendimiento (Test)</div>
                 <p style="font-size:0.9rem; color:#666; margin-bottom:15px; text-align: justify;">
@@ -1469,8 +1721,8 @@ elif st.session_state.page == "simulacion":
             </div>
             """, unsafe_allow_html=True)
 
-        with c_tech_2:
-            st.markdown(f"""<div class="card" style="height:100%;">
+            with c_tech_2:
+                st.markdown(f"""<div class="card" style="height:100%;">
     <div class="tech-card-title">Origen de los Datos</div>
     <p style="font-size:0.9rem; color:#666; margin-bottom: 10px; text-align: justify;">
         <strong>Fuente:</strong> Instituto Nacional de Diabetes y Enfermedades Digestivas y Renales (NIDDK).
@@ -1513,3 +1765,147 @@ elif st.session_state.page == "simulacion":
         </p>
     </div>
     """, unsafe_allow_html=True)
+
+    # --- PANEL DE DEPURACIÓN DE TIEMPOS (?debug=1) ---
+    if timer.enabled:
+        current = timer.finish(REGISTRY, TIMING_LOG, page="simulacion", predict_clicked=st.session_state.predict_clicked)
+        with st.sidebar:
+            with st.expander("⏱️ Tiempos por fase (debug)", expanded=True):
+                rows_html = "".join(
+                    f"<tr><td style='padding:2px 4px;'>{name}</td><td style='text-align:right; padding:2px 4px;'><b>{current.get(name, 0) * 1000:.1f}</b></td>"
+                    f"<td style='text-align:right; padding:2px 4px;'>{s['p50_ms']:.1f}</td><td style='text-align:right; padding:2px 4px;'>{s['p95_ms']:.1f}</td>"
+                    f"<td style='text-align:right; padding:2px 4px; color:#999;'>{s['n']}</td></tr>"
+                    for name, s in sorted(REGISTRY.summary().items(), key=lambda item: -item[1]['p50_ms'])
+                )
+                counts, edges = REGISTRY.histogram("rerun_total", bins=12)
+                peak = max(int(counts.max()), 1)
+                bars_html = "".join(
+                    f"<div title='{lo:.0f}-{hi:.0f} ms: {c}' style='flex:1; background:{CEMP_PINK}; opacity:0.8; height:{c / peak * 100:.0f}%;'></div>"
+                    for c, lo, hi in zip(counts, edges[:-1], edges[1:])
+                )
+                st.markdown(f"""
+                <div style="font-size:0.7rem; color:#666; margin-bottom:4px;">Rerun completo (histograma del proceso, ms): {edges[0]:.0f} – {edges[-1]:.0f}</div>
+                <div style="display:flex; align-items:flex-end; gap:2px; height:40px; margin-bottom:10px;">{bars_html}</div>
+                <table style="width:100%; font-size:0.7rem; color:{CEMP_DARK}; border-collapse:collapse;">
+                    <tr style="color:#999;"><th style="text-align:left;">Fase</th><th>Ahora</th><th>p50</th><th>p95</th><th>n</th></tr>
+                    {rows_html}
+                </table>
+                """, unsafe_allow_html=True)
+                st.caption(f"Milisegundos. Log: {TIMING_LOG}")
+
+# =========================================================
+# 6. PÁGINA: COHORTE
+# =========================================================
+elif st.session_state.page == "cohorte":
+
+    import numpy as np
+    import pandas as pd
+
+    from cohort import SortedPager, alert_counts, risk_histogram, score_cohort
+    from svg_charts import risk_histogram_svg
+
+    CEMP_PINK = "#E97F87"
+    CEMP_DARK = "#2C3E50"
+    GOOD_TEAL = "#4DB6AC"
+    PAGE_SIZE = 50
+
+    with st.sidebar:
+        if st.button("⬅ Volver"):
+            volver_inicio()
+            st.rerun()
+
+        st.markdown(f'<div style="font-size:1.6rem; font-weight:800; color:{CEMP_DARK};">D<span style="color:{CEMP_PINK}">IA</span>BETES<span style="color:#BDC3C7">.</span><span style="color:{CEMP_PINK}">NME</span></div>', unsafe_allow_html=True)
+        st.caption("ANÁLISIS DE COHORTE")
+        cohort_file = st.file_uploader("CSV de pacientes", type="csv", key="cohort_csv",
+                                       help="Columnas: Pregnancies, Glucose, BloodPressure, Insulin, Weight, Height, DPF, Age (y opcionalmente ID).")
+        cohort_threshold = st.slider("Umbral de decisión", 0.0, 1.0, 0.27, 0.01, key="cohort_threshold")
+
+    st.markdown(f"<h1 style='color:{CEMP_DARK}; margin-bottom: 10px; font-size: 2.2rem;'>Análisis de Cohorte</h1>", unsafe_allow_html=True)
+
+    if cohort_file is None:
+        st.info("Sube un CSV de pacientes en la barra lateral para puntuar toda la cohorte.")
+        st.stop()
+
+    # Se puntúa una vez por fichero subido; los reruns (umbral, orden, página) reutilizan el resultado
+    cached = st.session_state.get('cohort_scored')
+    model_handle = start_warmup()
+    model_key = model_handle.version if model_handle is not None else "simulación"
+    if cached is None or cached[0] != (cohort_file.file_id, model_key):
+        predictor = load_engine(model_handle) or load_model(model_handle)
+        if isinstance(predictor, MockModel):
+            st.error("El análisis de cohorte necesita el modelo real.")
+            st.stop()
+        try:
+            with st.spinner("Puntuando la cohorte..."):
+                scored = score_cohort(pd.read_csv(cohort_file), predictor)
+        except ValueError as e:
+            st.error(f"No se pudo procesar el CSV: {e}")
+            st.stop()
+        st.session_state.cohort_scored = ((cohort_file.file_id, model_key), scored)
+        st.session_state.cohort_pagers = {}
+        st.session_state.cohort_page = 1  # La página anterior puede no existir en la cohorte nueva
+    scored = st.session_state.cohort_scored[1]
+
+    probs = scored['prob_diabetes'].to_numpy()
+    n_high = int((probs > cohort_threshold).sum())
+    n_alert = int((scored['n_alertas'] > 0).sum())
+
+    kpis = [("PACIENTES", f"{len(scored):,}".replace(",", "."), CEMP_DARK),
+            ("ALTO RIESGO", f"{n_high:,}".replace(",", ".") + f" ({n_high / max(len(scored), 1):.1%})", CEMP_PINK),
+            ("PROBABILIDAD MEDIA", f"{np.nanmean(probs):.1%}", CEMP_DARK),
+            ("CON ALGUNA ALERTA", f"{n_alert:,}".replace(",", "."), "#F39C12")]
+    for col, (label, value, color) in zip(st.columns(4, gap="small"), kpis):
+        with col:
+            st.markdown(f"""<div style="background:white; border:1px solid #EEE; border-radius:10px; padding:12px 16px;">
+                <div style="font-size:0.7rem; color:#999; font-weight:700; letter-spacing:0.5px;">{label}</div>
+                <div style="font-size:1.5rem; color:{color}; font-weight:800;">{value}</div>
+            </div>""", unsafe_allow_html=True)
+
+    st.write("")
+    c_hist, c_alerts = st.columns([1.8, 1], gap="medium")
+    with c_hist:
+        st.markdown("**Distribución del riesgo**")
+        counts, edges = risk_histogram(probs)
+        st.markdown(risk_histogram_svg(counts, edges, cohort_threshold, GOOD_TEAL, CEMP_PINK, CEMP_DARK), unsafe_allow_html=True)
+    with c_alerts:
+        st.markdown("**Hallazgos clínicos**")
+        alerts = alert_counts(scored)
+        peak = max(max(alerts.values()), 1)
+        st.markdown("".join(
+            f"""<div style="margin-bottom:8px;">
+                <div style="display:flex; justify-content:space-between; font-size:0.8rem; color:#555;"><span>{name}</span><b>{count}</b></div>
+                <div style="background:#F0F2F5; border-radius:4px; height:8px;"><div style="width:{count / peak * 100:.0f}%; background:{CEMP_PINK}; height:8px; border-radius:4px;"></div></div>
+            </div>""" for name, count in alerts.items()), unsafe_allow_html=True)
+
+    # --- TABLA: se ordena una vez por columna y solo se envía la página visible ---
+    # Fragmento: ordenar o cambiar de página solo vuelve a ejecutar la tabla, no los KPIs ni el histograma
+    @st.fragment
+    def cohort_table(scored, cohort_threshold):
+        st.markdown("**Pacientes**")
+        c_sort, c_dir, c_page = st.columns([2, 1, 1])
+        with c_sort:
+            sort_column = st.selectbox("Ordenar por", list(scored.columns), index=list(scored.columns).index('prob_diabetes'), key="cohort_sort")
+        with c_dir:
+            descending = st.toggle("Descendente", value=True, key="cohort_desc")
+        pagers = st.session_state.cohort_pagers
+        if (sort_column, descending) not in pagers:
+            if len(pagers) >= 4:
+                pagers.clear()  # Cada orden guarda una permutación de toda la cohorte
+            pagers[(sort_column, descending)] = SortedPager(scored, sort_column, ascending=not descending)
+        pager = pagers[(sort_column, descending)]
+        if st.session_state.get("cohort_view") != (sort_column, descending):
+            # Otro orden: la página N ya no muestra los mismos pacientes, se vuelve a la primera
+            st.session_state.cohort_view = (sort_column, descending)
+            st.session_state.cohort_page = 1
+        n_pages = pager.n_pages(PAGE_SIZE)
+        with c_page:
+            page = st.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, value=1, step=1, key="cohort_page")
+
+        page_df = pager.page(int(page), PAGE_SIZE).copy()
+        page_df.insert(0, 'alto_riesgo', page_df['prob_diabetes'] > cohort_threshold)
+        st.dataframe(page_df, hide_index=True, use_container_width=True,
+                     column_config={"prob_diabetes": st.column_config.ProgressColumn("prob_diabetes", min_value=0.0, max_value=1.0, format="%.3f")})
+        first = (int(page) - 1) * PAGE_SIZE + 1
+        st.caption(f"Filas {first}–{min(first + PAGE_SIZE - 1, len(scored))} de {len(scored)}")
+
+    cohort_table(scored, cohort_threshold)
@@ -0,0 +1,285 @@
+"""
+Explicación individual con presupuesto de latencia.
+
+Tres modos, de más exacto a más rápido:
+  - exact:     TreeSHAP sobre el bosque completo (PipelineExplainer, con su caché).
+  - subsample: TreeSHAP sobre una submuestra fija de árboles.
+  - saabas:    atribución por caminos del motor compilado (un recorrido del bosque).
+En modo auto se usa el más exacto cuya latencia estimada (p90 de las últimas llamadas
+medidas) cabe en el presupuesto; Saabas es el último recurso.
+
+La desviación de los modos aproximados frente a SHAP exacto se mide fuera de línea:
+    python approx_explain.py --data validacion.csv [--n 1000] [--subsample-trees 40]
+y se guarda junto al modelo (<modelo>_explain_check.json) para mostrarla en la app y en el informe.
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+from explain import SHAP_AVAILABLE, PipelineExplainer
+from fast_forest import CompiledForest, file_sha256
+
+MODE_AUTO, MODE_EXACT, MODE_SUBSAMPLE, MODE_SAABAS = "auto", "exact", "subsample", "saabas"
+MODE_LABELS = {
+    MODE_AUTO: "Automático (presupuesto)",
+    MODE_EXACT: "SHAP exacto (TreeSHAP)",
+    MODE_SUBSAMPLE: "SHAP sobre submuestra de árboles",
+    MODE_SAABAS: "Aproximación por caminos (Saabas)",
+}
+# Orden en que el modo auto prueba cada método
+AUTO_ORDER = (MODE_EXACT, MODE_SUBSAMPLE, MODE_SAABAS)
+
+DEFAULT_BUDGET_MS = 50.0
+SUBSAMPLE_TREES = 40
+LATENCY_WINDOW = 50
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos", "diabetes_rf_pipeline.pkl")
+
+PatientExplanation = namedtuple("PatientExplanation", "values base_value mode elapsed_ms")
+
+
+class SubsampleExplainer:
+    """TreeExplainer sobre una submuestra fija (semilla) de los árboles del Random Forest."""
+
+    def __init__(self, pipeline, n_trees=SUBSAMPLE_TREES, seed=0):
+        forest = pipeline.named_steps['model']
+        n_trees = min(n_trees, len(forest.estimators_))
+        chosen = np.sort(np.random.default_rng(seed).choice(len(forest.estimators_), size=n_trees, replace=False))
+        subforest = copy.copy(forest)
+        subforest.estimators_ = [forest.estimators_[i] for i in chosen]
+        subforest.n_estimators = n_trees
+        self.n_trees = n_trees
+        self.explainer = PipelineExplainer(with_model(pipeline, subforest), maxsize=1)
+
+    @property
+    def base_value(self):
+        return self.explainer.base_value
+
+    def explain_batch(self, input_data):
+        return self.explainer.explain_batch(input_data)
+
+
+def with_model(pipeline, model):
+    """Copia superficial del pipeline con otro paso 'model' (imputer y scaler compartidos)."""
+    clone = copy.copy(pipeline)
+    clone.steps = [(name, model if name == 'model' else step) for name, step in pipeline.steps]
+    return clone
+
+
+class BudgetedExplainer:
+    """Explicaciones por paciente en el modo pedido o, en auto, en el mejor que quepa en el presupuesto."""
+
+    def __init__(self, pipeline, forest=None, subsample_trees=SUBSAMPLE_TREES, maxsize=256):
+        self.exact = PipelineExplainer(pipeline, maxsize=maxsize)
+        self.subsample = SubsampleExplainer(pipeline, subsample_trees)
+        if forest is None:
+            try:
+                forest = CompiledForest.from_pipeline(pipeline)
+            except ValueError:
+                forest = None
+        self.forest = forest
+        self.cache = LRUCache(maxsize)
+        self._latency = {mode: deque(maxlen=LATENCY_WINDOW) for mode in AUTO_ORDER}
+        self._lock = threading.Lock()
+        self.calibrate(pipeline)
+
+    @property
+    def modes(self):
+        return AUTO_ORDER if self.forest is not None else AUTO_ORDER[:-1]
+
+    def calibrate(self, pipeline):
+        """Primera estimación de latencia de cada modo con un paciente de referencia (medianas del imputer)."""
+        imputer = pipeline.named_steps['imputer']
+        reference = pd.DataFrame([imputer.statistics_], columns=getattr(imputer, 'feature_names_in_', None))
+        for mode in self.modes:
+            for _ in range(2):  # La primera llamada incluye la puesta en marcha
+                start = time.perf_counter()
+                self._compute(mode, reference, single=False)
+                elapsed = (time.perf_counter() - start) * 1000
+            self._record(mode, elapsed)
+
+    def estimate_ms(self, mode):
+        """p90 de las últimas latencias medidas del modo."""
+        with self._lock:
+            values = list(self._latency[mode])
+        return float(np.percentile(values, 90)) if values else float('inf')
+
+    def explain(self, input_data, mode=MODE_AUTO, budget_ms=DEFAULT_BUDGET_MS):
+        """PatientExplanation del primer paciente de input_data."""
+        step2 = np.ascontiguousarray(self.exact.transform(input_data)[:1], dtype=np.float64)
+        key = step2.tobytes()
+        if mode == MODE_AUTO:
+            # La decisión también se cachea: informe y cascada muestran siempre el mismo modo
+            cache_key = (MODE_AUTO, float(budget_ms), key)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+            if key in self.exact.cache:
+                chosen = MODE_EXACT
+            else:
+                chosen = next((m for m in self.modes if self.estimate_ms(m) <= budget_ms), self.modes[-1])
+            result = self.explain(input_data, chosen)
+            self.cache.put(cache_key, result)
+            return result
+
+        if mode not in self.modes:
+            raise ValueError(f"Modo de explicación no disponible: {mode}")
+        cache_key = (mode, key)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        measured = not (mode == MODE_EXACT and key in self.exact.cache)
+        start = time.perf_counter()
+        values, base_value = self._compute(mode, input_data)
+        elapsed = (time.perf_counter() - start) * 1000
+        if measured:  # Un acierto de la caché de SHAP exacto no dice nada de su coste
+            self._record(mode, elapsed)
+        values = np.array(values[0], dtype=np.float64)
+        values.flags.writeable = False  # Compartido entre sesiones: solo lectura
+        result = PatientExplanation(values, base_value, mode, elapsed)
+        self.cache.put(cache_key, result)
+        return result
+
+    def explain_batch(self, input_data, mode):
+        """Vectores de todas las filas en un modo concreto, sin caché (chequeo offline)."""
+        return self._compute(mode, input_data, single=False)[0]
+
+    def _compute(self, mode, input_data, single=True):
+        if mode == MODE_EXACT:
+            if single:
+                return self.exact.explain(input_data)[None, :], self.exact.base_value
+            return self.exact.explain_batch(input_data), self.exact.base_value
+        if mode == MODE_SUBSAMPLE:
+            rows = input_data.iloc[:1] if single else input_data
+            return self.subsample.explain_batch(rows), self.subsample.base_value
+        rows = input_data.iloc[:1] if single else input_data
+        base_value, values = self.forest.path_contributions(rows)
+        return values, base_value
+
+    def _record(self, mode, elapsed_ms):
+        with self._lock:
+            self._latency[mode].append(elapsed_ms)
+
+
+# --- CHEQUEO OFFLINE DE DESVIACIÓN ---
+
+def check_path_for(model_path):
+    return os.path.splitext(model_path)[0] + "_explain_check.json"
+
+
+def deviation_check(explainer, X, top_k=3, timing_rows=50):
+    """Desviación de cada modo aproximado frente a SHAP exacto sobre las filas de X."""
+    exact = explainer.explain_batch(X, MODE_EXACT)
+    exact_top = np.argsort(-np.abs(exact), axis=1, kind='stable')[:, :top_k]
+    results = {}
+    for mode in explainer.modes:
+        values = explainer.explain_batch(X, mode)
+        diff = np.abs(values - exact)
+        top = np.argsort(-np.abs(values), axis=1, kind='stable')[:, :top_k]
+        overlap = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(top, exact_top)])
+        times = []
+        for i in range(min(timing_rows, len(X))):
+            start = time.perf_counter()
+            explainer._compute(mode, X.iloc[i:i + 1])
+            times.append((time.perf_counter() - start) * 1000)
+        results[mode] = {
+            "mean_abs_diff": float(diff.mean()),
+            "max_abs_diff": float(diff.max()),
+            "top1_agreement": float(np.mean(top[:, 0] == exact_top[:, 0])),
+            f"top{top_k}_overlap": float(overlap),
+            "p50_ms": float(np.percentile(times, 50)),
+            "p95_ms": float(np.percentile(times, 95)),
+        }
+    return results
+
+
+def load_deviation_check(model_path):
+    """Resultados del chequeo offline, o None si no existe o es de otro modelo."""
+    try:
+        with open(check_path_for(model_path), encoding="utf-8") as f:
+            check = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if check.get("model_sha256") != file_sha256(model_path):
+        return None
+    return check
+
+
+def deviation_note(check, mode):
+    """Frase con la desviación medida fuera de línea para un modo aproximado (None si es exacto o no hay datos)."""
+    if mode == MODE_EXACT or not check or mode not in check.get("modes", {}):
+        return None
+    stats = check["modes"][mode]
+    return (f"Desviación frente a SHAP exacto en el chequeo offline ({check['n_rows']} pacientes): "
+            f"media |Δ| {stats['mean_abs_diff']:.4f} · máx. {stats['max_abs_diff']:.3f} · "
+            f"variable principal coincidente en el {stats['top1_agreement'] * 100:.0f} %")
+
+
+def method_note(mode, check=None):
+    """Texto para la cascada y el informe: método usado y, si es aproximado, su desviación offline."""
+    note = f"Método de explicación: {MODE_LABELS[mode]}."
+    deviation = deviation_note(check, mode)
+    return f"{note} {deviation}." if deviation else note
+
+
+def _check_rows(data_path, n, seed):
+    """Una muestra de n pacientes reales del CSV (datos clínicos, como batch_scoring.py)."""
+    from features import build_feature_frame
+    X = build_feature_frame(pd.read_csv(data_path))
+    return X.sample(n=min(n, len(X)), random_state=seed).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide la desviación de las explicaciones aproximadas frente a SHAP exacto.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Ruta del pipeline (.pkl)")
+    parser.add_argument("--data", required=True, help="CSV con los datos clínicos de los pacientes a comparar")
+    parser.add_argument("--n", type=int, default=1000, help="Pacientes a comparar")
+    parser.add_argument("--subsample-trees", type=int, default=SUBSAMPLE_TREES, help="Árboles del modo submuestra")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if not SHAP_AVAILABLE:
+        print("Error: SHAP no está instalado", file=sys.stderr)
+        return 2
+    import joblib
+    try:
+        pipeline = joblib.load(args.model)
+        X = _check_rows(args.data, args.n, args.seed)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    explainer = BudgetedExplainer(pipeline, subsample_trees=args.subsample_trees)
+    modes = deviation_check(explainer, X)
+
+    payload = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "model_sha256": file_sha256(args.model),
+        "data": os.path.basename(args.data),
+        "n_rows": int(len(X)),
+        "subsample_trees": explainer.subsample.n_trees,
+        "modes": modes,
+    }
+    output = check_path_for(args.model)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+
+    print(f"{'modo':<10} {'media |Δ|':>10} {'máx |Δ|':>9} {'top-1':>6} {'p50 ms':>8}")
+    for mode, stats in modes.items():
+        print(f"{mode:<10} {stats['mean_abs_diff']:10.4f} {stats['max_abs_diff']:9.3f} "
+              f"{stats['top1_agreement'] * 100:5.0f}% {stats['p50_ms']:8.2f}")
+    print(f"\nResultados guardados en {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
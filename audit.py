@@ -0,0 +1,218 @@
+"""
+Registro de auditoría de cada cálculo de riesgo: ficheros JSONL de solo añadido, escritos en segundo plano.
+
+log() encola la entrada y vuelve al momento; un hilo propio (MicroBatcher) escribe cada lote
+de una vez, hace fsync y solo entonces resuelve los Future: una entrada confirmada está en disco
+y sobrevive a un reinicio o a una caída del proceso. Al superar max_segment_bytes el segmento
+se cierra y se comprime a .jsonl.gz; al arrancar, los segmentos que dejó abiertos un proceso
+anterior se reparan (se descarta una última línea a medio escribir) y se comprimen. Cada
+proceso tiene su segmento abierto con un flock exclusivo, así que varios procesos (workers de
+Streamlit, service.py) pueden compartir el directorio: solo se reparan los segmentos que nadie
+tiene bloqueados. Sin flock (Windows) no se repara ninguno.
+
+    python audit.py logs/audit --tail 20
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import time
+from collections import deque
+
+from batching import MicroBatcher
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SEGMENT_PREFIX = "audit-"
+DEFAULT_SEGMENT_BYTES = 8 * 1024 * 1024
+
+
+def _fsync_directory(directory):
+    """Hace duraderos los renombrados y borrados de ficheros del directorio (no existe en Windows)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _try_lock(f):
+    """Bloqueo exclusivo sin espera; False si otro proceso (u otro AuditLog) tiene el segmento abierto."""
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _truncate_torn_tail(f):
+    """Descarta una última línea sin '\\n' (escritura interrumpida: nunca llegó a confirmarse)."""
+    f.seek(0)
+    data = f.read()
+    end = data.rfind(b'\n') + 1
+    if end < len(data):
+        f.truncate(end)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def compress_segment(path):
+    """Comprime un segmento cerrado a path + '.gz' y borra el original una vez el .gz es duradero."""
+    target = path + ".gz"
+    tmp = target + ".tmp"
+    with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    with open(tmp, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, target)
+    _fsync_directory(os.path.dirname(path) or ".")
+    os.remove(path)
+    return target
+
+
+def segment_paths(directory):
+    """Segmentos (comprimidos o no) en orden de escritura: el nombre lleva la marca de tiempo en ns."""
+    paths = glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*.jsonl")) + \
+        glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*.jsonl.gz"))
+    return sorted(paths, key=lambda p: os.path.basename(p).split('.')[0])
+
+
+def iter_entries(directory):
+    """Recorre todas las entradas del registro, de la más antigua a la más reciente."""
+    for path in segment_paths(directory):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.endswith('\n'):
+                    yield json.loads(line)
+
+
+class AuditLog:
+    """Registro de auditoría con escritura diferida: log() no espera al disco."""
+
+    def __init__(self, directory, max_segment_bytes=DEFAULT_SEGMENT_BYTES, max_batch_size=256,
+                 max_wait_ms=50.0, max_queue=10000, compress=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.compress = compress
+        self._file = None
+        self._path = None
+        self.failures = 0  # Entradas que no llegaron a escribirse (el Future recibió la excepción)
+        self.last_error = None
+        self._recover()
+        self.batcher = MicroBatcher(self._write_batch, max_batch_size, max_wait_ms, max_queue, name="audit-writer")
+
+    def _recover(self):
+        """Cierra lo que dejaron a medias procesos ya terminados antes de abrir un segmento nuevo."""
+        if fcntl is None:
+            return  # Sin flock no se sabe si otro proceso sigue escribiendo en un segmento: no se toca
+        for path in glob.glob(os.path.join(self.directory, f"{SEGMENT_PREFIX}*.jsonl")):
+            try:
+                f = open(path, 'rb+')
+            except FileNotFoundError:
+                continue  # Lo ha reparado otro proceso mientras tanto
+            with f:
+                if not _try_lock(f):
+                    continue  # Segmento abierto por un proceso vivo
+                try:
+                    if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if os.path.exists(path + ".gz.tmp"):
+                    os.remove(path + ".gz.tmp")  # Compresión interrumpida: el .jsonl original sigue ahí
+                if os.path.exists(path + ".gz"):
+                    os.remove(path)  # Se cayó entre el renombrado del .gz y el borrado del original
+                    continue
+                _truncate_torn_tail(f)
+                if self.compress and os.path.getsize(path) > 0:
+                    compress_segment(path)  # Con el bloqueo aún tomado
+
+    def _open_segment(self):
+        self._path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{time.time_ns():020d}.jsonl")
+        # Sin búfer de Python: un lote fallido no deja bytes pendientes que se colarían en el siguiente,
+        # y el segmento se repara sin cerrarlo (cerrar soltaría el bloqueo)
+        self._file = open(self._path, 'ab', buffering=0)
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)  # Marca el segmento como vivo para _recover
+        _fsync_directory(self.directory)
+
+    def _rotate(self):
+        # Se comprime antes de cerrar: el bloqueo impide que otro proceso lo repare a la vez
+        path = self._path
+        if self.compress:
+            compress_segment(path)
+        self._file.close()
+        self._file, self._path = None, None
+
+    def log(self, entry):
+        """
+        Encola una entrada (dict serializable a JSON) y devuelve un Future que se resuelve cuando
+        está escrita y sincronizada en disco. Lanza QueueFullError si la cola está llena.
+        """
+        future = self.batcher.submit(dict(entry, logged_at=time.time()))
+        future.add_done_callback(self._count_failure)
+        return future
+
+    def _count_failure(self, future):
+        """Entradas de auditoría que no llegaron a disco: nadie espera su Future, así que se cuentan aquí."""
+        if not future.cancelled() and future.exception() is not None:
+            self.failures += 1
+            self.last_error = f"{type(future.exception()).__name__}: {future.exception()}"
+
+    def _write_batch(self, entries):
+        if self._file is None:
+            self._open_segment()
+        data = b"".join(json.dumps(e, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                        for e in entries)
+        start = self._file.tell()
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[self._file.write(view):]
+            os.fsync(self._file.fileno())  # Un fsync por lote: a partir de aquí las entradas están confirmadas
+        except OSError:
+            # Lote fallido (sus Future reciben la excepción): no se deja media línea para el siguiente
+            self._file.truncate(start)
+            raise
+        if self._file.tell() >= self.max_segment_bytes:
+            self._rotate()
+        return [True] * len(entries)
+
+    def close(self, timeout=None):
+        """Escribe lo que quede en la cola y cierra el segmento abierto (se comprime al siguiente arranque)."""
+        self.batcher.close(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta el registro de auditoría de la app.")
+    parser.add_argument("directory", nargs="?", default="logs/audit")
+    parser.add_argument("--tail", type=int, default=10, help="Últimas N entradas a mostrar (0 = todas)")
+    args = parser.parse_args()
+
+    shown = deque(maxlen=args.tail or None)
+    total = 0
+    for entry in iter_entries(args.directory):
+        shown.append(entry)
+        total += 1
+    for entry in shown:
+        print(json.dumps(entry, ensure_ascii=False))
+    print(f"{total} entradas en {len(segment_paths(args.directory))} segmentos", flush=True)
+
+
+if __name__ == "__main__":
+    main()
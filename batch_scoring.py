@@ -0,0 +1,69 @@
+"""
+Puntuación por lotes de cohortes de pacientes con el pipeline guardado.
+
+Lee el CSV por bloques (memoria constante sea cual sea su tamaño), calcula las
+variables derivadas igual que la app y llama a predict_proba una vez por bloque.
+
+Uso:
+    python batch_scoring.py cohorte.csv resultados.csv [--chunksize 50000] [--threshold 0.27]
+
+Columnas de entrada: Pregnancies, Glucose, BloodPressure, Insulin, Weight, Height, DPF, Age
+(cualquier otra columna, p. ej. un ID de paciente, se copia tal cual a la salida).
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import pandas as pd
+
+from features import DEFAULT_CHUNKSIZE, DEFAULT_THRESHOLD, build_feature_frame
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos", "diabetes_rf_pipeline.pkl")
+
+
+def score_frame(model, raw, threshold=DEFAULT_THRESHOLD):
+    """Devuelve el bloque original con la probabilidad y la etiqueta de riesgo añadidas."""
+    features = build_feature_frame(raw)
+    prob = model.predict_proba(features)[:, 1]
+    scored = raw.copy()
+    scored['prob_diabetes'] = prob
+    scored['alto_riesgo'] = (prob > threshold).astype(int)  # Mismo criterio que la app
+    return scored
+
+
+def score_csv(model, input_path, output_path, chunksize=DEFAULT_CHUNKSIZE, threshold=DEFAULT_THRESHOLD):
+    """Puntúa el CSV de entrada bloque a bloque y va escribiendo la salida. Devuelve el nº de filas."""
+    n_rows = 0
+    with open(output_path, 'w', newline='', encoding='utf-8') as out:
+        for i, chunk in enumerate(pd.read_csv(input_path, chunksize=chunksize)):
+            scored = score_frame(model, chunk, threshold)
+            scored.to_csv(out, header=(i == 0), index=False)
+            n_rows += len(scored)
+    return n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Puntuación por lotes de una cohorte en CSV.")
+    parser.add_argument("input", help="CSV con los datos clínicos de la cohorte")
+    parser.add_argument("output", help="CSV de salida con probabilidad y etiqueta")
+    parser.add_argument("--model", default=MODEL_PATH, help="Ruta del pipeline (.pkl)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Filas por bloque")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Umbral de decisión")
+    args = parser.parse_args(argv)
+
+    model = joblib.load(args.model)
+    start = time.perf_counter()
+    try:
+        n_rows = score_csv(model, args.input, args.output, args.chunksize, args.threshold)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    elapsed = time.perf_counter() - start
+    print(f"{n_rows} pacientes puntuados en {elapsed:.1f} s -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
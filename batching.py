@@ -0,0 +1,115 @@
+"""Micro-batching: agrupa peticiones concurrentes de un paciente en una sola llamada al modelo."""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class QueueFullError(RuntimeError):
+    """La cola de peticiones está llena: el llamante debe reintentar más tarde (backpressure)."""
+
+
+class BatcherClosedError(RuntimeError):
+    """El batcher ya está cerrado: su hilo no procesará más elementos."""
+
+
+class MicroBatcher:
+    """
+    Recoge elementos enviados desde varios hilos y los procesa por lotes en un hilo propio.
+
+    El lote se cierra al llegar a max_batch_size o cuando han pasado max_wait_ms desde que
+    llegó su primer elemento. process_batch recibe la lista de elementos y debe devolver
+    una secuencia de resultados en el mismo orden; cada llamante recibe el suyo en su Future.
+    """
+
+    def __init__(self, process_batch, max_batch_size=256, max_wait_ms=5.0, max_queue=4096, name="micro-batcher"):
+        if max_batch_size <= 0 or max_queue <= 0:
+            raise ValueError("max_batch_size y max_queue deben ser positivos")
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._lock = threading.Lock()  # Ningún elemento entra en la cola detrás de _STOP
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """
+        Encola un elemento y devuelve su Future. Sin timeout no espera: si la cola está llena
+        lanza QueueFullError; con timeout espera como máximo ese tiempo a que haya hueco.
+        Si el batcher ya se ha cerrado lanza BatcherClosedError sin encolar nada.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise BatcherClosedError("El batcher está cerrado")
+            try:
+                self._queue.put((item, future), block=timeout is not None, timeout=timeout)
+            except queue.Full:
+                raise QueueFullError("Cola de inferencia llena") from None
+        return future
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "largest_batch": self.largest_batch,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def close(self, timeout=None):
+        """Procesa lo que quede en la cola y detiene el hilo; los submit posteriores fallan al momento."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _worker(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    # Pasado el plazo solo se recoge lo que ya está en la cola
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self._run(batch)
+
+    def _run(self, batch):
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            results = self.process_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,267 @@
+"""
+Benchmark del camino caliente de cada rerun de app.py: cada fase por separado y la página completa.
+
+Uso:
+    python benchmark.py [--repeat 30] [--apptest-repeat 5] [--output benchmark.json] [--baseline anterior.json]
+
+Cada caso se mide con las cachés vacías (cold) y/o ya pobladas (warm) y se guardan p50/p95
+en JSON junto con las versiones de las dependencias y la huella del modelo, de modo que
+al comparar con --baseline se vea qué fase empeora al cambiar el modelo o las librerías.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import joblib
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from charts import clear_figure_cache, fig_to_bytes, fig_to_html, importance_png
+from explain import SHAP_AVAILABLE, PipelineExplainer
+from fast_forest import CompiledForest, bundle_is_current, file_sha256
+from features import FEATURE_COLUMNS, body_mass_index, build_feature_array, resistance_index
+from report import create_html_report, recommendation_for, risk_label_for, shap_rows_html
+from svg_charts import calibration_svg, donut_svg
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BASE_DIR, "app.py")
+MODEL_PATH = os.path.join(BASE_DIR, "modelos", "diabetes_rf_pipeline.pkl")
+BUNDLE_DIR = os.path.join(BASE_DIR, "modelos", "diabetes_rf_pipeline_bundle")
+
+# Paciente de referencia (valores de la barra lateral)
+PATIENT = {'pregnancies': 2, 'glucose': 150, 'blood_pressure': 70, 'insulin': 100,
+           'weight': 80.0, 'height': 1.65, 'dpf': 0.5, 'age': 45}
+THRESHOLD = 0.27
+PINK, DARK, GREEN = "#E97F87", "#2C3E50", "#8BC34A"
+
+
+def summarize(times):
+    ms = np.asarray(times) * 1000
+    return {
+        "n": int(ms.size),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "mean_ms": float(ms.mean()),
+        "min_ms": float(ms.min()),
+    }
+
+
+def measure(fn, repeat, setup=None):
+    """Tiempos de fn(); setup() se ejecuta antes de cada repetición, fuera del cronómetro."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def build_input_data(p=PATIENT):
+    """Igual que la app: variables derivadas y DataFrame de una fila con FEATURE_COLUMNS."""
+    bmi = body_mass_index(p['weight'], p['height'])
+    X = build_feature_array(p['pregnancies'], p['glucose'], p['blood_pressure'], p['insulin'], bmi, p['dpf'], p['age'])
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS)
+
+
+def waterfall_figure(shap_row, base_value, input_data):
+    import shap
+    exp = shap.Explanation(values=shap_row, base_values=base_value,
+                           data=input_data.iloc[0].values, feature_names=input_data.columns)
+    fig, ax = plt.subplots(figsize=(6, 5))
+    fig.patch.set_facecolor('white')
+    ax.set_facecolor('white')
+    shap.plots.waterfall(exp, show=False, max_display=10)
+    plt.tight_layout()
+    return fig
+
+
+def report_html(prob, shap_row, input_data):
+    """Mismo informe que la app: top 5 SHAP por impacto absoluto, etiqueta, variables y recomendación."""
+    p = PATIENT
+    bmi = body_mass_index(p['weight'], p['height'])
+    top = sorted(zip(input_data.columns, input_data.iloc[0].values, shap_row),
+                 key=lambda row: abs(row[2]), reverse=True)[:5]
+    return create_html_report(
+        "Paciente benchmark",
+        "1 Ene 2025",
+        prob,
+        risk_label_for(prob > THRESHOLD),
+        inputs_dict={
+            "Glucosa 2h": f"{p['glucose']} mg/dL",
+            "Insulina 2h": f"{p['insulin']} µU/ml",
+            "Índice RI (Glucosa x Insulina)": f"{int(resistance_index(p['glucose'], p['insulin']))}",
+            "BMI": f"{bmi:.1f} kg/m²",
+            "Edad": f"{p['age']} años",
+            "Presión Arterial": f"{p['blood_pressure']} mm Hg",
+            "Embarazos": f"{p['pregnancies']}",
+            "Carga Genética (DPF)": f"{p['dpf']:.2f}",
+        },
+        shap_rows_html=shap_rows_html(top),
+        recommendation=recommendation_for(p['glucose'], prob, THRESHOLD),
+    )
+
+
+def stage_benchmarks(repeat):
+    """Fases del rerun por separado. Devuelve {caso: {modo: resumen}}."""
+    results = {}
+    pipeline = joblib.load(MODEL_PATH)
+    input_data = build_input_data()
+
+    results["input_data"] = {"-": measure(build_input_data, repeat)}
+    results["predict_proba[pipeline]"] = {"-": measure(lambda: pipeline.predict_proba(input_data), repeat)}
+    if bundle_is_current(BUNDLE_DIR, MODEL_PATH):
+        engine = CompiledForest.load(BUNDLE_DIR, mmap_mode='r')
+    else:
+        engine = CompiledForest.from_pipeline(pipeline)
+    results["predict_proba[engine]"] = {"-": measure(lambda: engine.predict_proba(input_data), repeat)}
+    prob = float(engine.predict_proba(input_data)[0, 1])
+
+    if SHAP_AVAILABLE:
+        import shap
+        model = pipeline.named_steps['model']
+        results["tree_explainer_build"] = {"cold": measure(lambda: shap.TreeExplainer(model), max(3, repeat // 5))}
+        explainer = PipelineExplainer(pipeline)
+        results["shap_values"] = {
+            "cold": measure(lambda: explainer.explain(input_data), repeat, setup=explainer.cache.clear),
+            "warm": measure(lambda: explainer.explain(input_data), repeat),
+        }
+        shap_row, base_value = explainer.explain(input_data), explainer.base_value
+    else:
+        shap_row, base_value = np.zeros(len(FEATURE_COLUMNS)), 0.5
+
+    # Figuras Matplotlib: importancia (con su caché de PNG) y cascada SHAP
+    names = list(FEATURE_COLUMNS)
+    importances = engine.feature_importances_
+    results["figure:importance[importance_png]"] = {
+        "cold": measure(lambda: importance_png("bench", names, importances, PINK, DARK), max(3, repeat // 5),
+                        setup=clear_figure_cache),
+        "warm": measure(lambda: importance_png("bench", names, importances, PINK, DARK), repeat),
+    }
+    if SHAP_AVAILABLE:
+        def render(encode):
+            fig = waterfall_figure(shap_row, base_value, input_data)
+            encode(fig)
+            plt.close(fig)
+        results["figure:shap_waterfall[fig_to_bytes]"] = {"-": measure(lambda: render(fig_to_bytes), max(3, repeat // 5))}
+        results["figure:shap_waterfall[fig_to_html]"] = {"-": measure(lambda: render(fig_to_html), max(3, repeat // 5))}
+
+    # Gráficos SVG (donut y calibración)
+    results["svg:donut"] = {"-": measure(lambda: donut_svg(prob, THRESHOLD, PINK, DARK), repeat)}
+    results["svg:calibration"] = {"-": measure(lambda: calibration_svg(THRESHOLD, 0.27, PINK, DARK, GREEN), repeat)}
+
+    results["create_html_report"] = {"-": measure(lambda: report_html(prob, shap_row, input_data), repeat)}
+    return results
+
+
+def apptest_benchmarks(repeat):
+    """Página de simulación completa (tras CALCULAR RIESGO) a través de AppTest."""
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    def open_simulation():
+        at = AppTest.from_file(APP_PATH, default_timeout=300).run()
+        at.button[0].click().run()  # INICIAR
+        at.session_state["gluc"] = PATIENT['glucose']
+        next(b for b in at.button if b.label == "CALCULAR RIESGO").click().run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        return at
+
+    def clear_caches():
+        st.cache_resource.clear()
+        st.cache_data.clear()
+        clear_figure_cache()
+
+    os.chdir(BASE_DIR)  # app.py usa rutas relativas (modelos/...)
+    # Auditoría, historial y tiempos a un directorio temporal: el benchmark no deja rastro en logs/ ni datos/
+    with tempfile.TemporaryDirectory(prefix="cdss-bench-") as tmp:
+        overrides = {
+            "CDSS_AUDIT_DIR": os.path.join(tmp, "audit"),
+            "CDSS_HISTORY_DB": os.path.join(tmp, "historial.sqlite"),
+            "CDSS_TIMING_LOG": os.path.join(tmp, "timings.jsonl"),
+        }
+        saved = {name: os.environ.get(name) for name in overrides}
+        os.environ.update(overrides)
+        try:
+            at = open_simulation()
+            return {"apptest_rerun": {
+                # Mismo proceso: los módulos ya están importados; "cold" = cachés de la app vacías
+                "cold": measure(lambda: at.run(), repeat, setup=clear_caches),
+                "warm": measure(lambda: at.run(), repeat),
+            }}
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def environment():
+    versions = {"python": platform.python_version()}
+    for name in ("numpy", "pandas", "sklearn", "shap", "streamlit", "matplotlib"):
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "versions": versions,
+        "model_sha256": file_sha256(MODEL_PATH),
+    }
+
+
+def compare(results, baseline):
+    """Cambio del p50 respecto a un JSON anterior (se marcan subidas > 20 % y > 0.5 ms)."""
+    print("\nComparación con el baseline (p50):")
+    for case, modes in results.items():
+        for mode, summary in modes.items():
+            old = baseline.get("results", {}).get(case, {}).get(mode)
+            if old:
+                ratio = summary["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float('inf')
+                slower = ratio > 1.2 and summary["p50_ms"] - old["p50_ms"] > 0.5
+                flag = "  <-- más lento" if slower else ""
+                print(f"  {case:<40} {mode:<5} {old['p50_ms']:9.2f} -> {summary['p50_ms']:9.2f} ms  (x{ratio:.2f}){flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por fases del rerun de la app.")
+    parser.add_argument("--repeat", type=int, default=30, help="Repeticiones por caso")
+    parser.add_argument("--apptest-repeat", type=int, default=5, help="Repeticiones del rerun completo (0 = omitir)")
+    parser.add_argument("--output", default="benchmark.json", help="Fichero JSON de resultados")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args(argv)
+
+    results = stage_benchmarks(args.repeat)
+    if args.apptest_repeat > 0:
+        results.update(apptest_benchmarks(args.apptest_repeat))
+
+    print(f"{'caso':<40} {'modo':<5} {'p50 ms':>9} {'p95 ms':>9}")
+    for case, modes in results.items():
+        for mode, summary in modes.items():
+            print(f"{case:<40} {mode:<5} {summary['p50_ms']:9.2f} {summary['p95_ms']:9.2f}")
+
+    payload = {"environment": environment(), "repeat": args.repeat, "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
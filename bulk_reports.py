@@ -0,0 +1,195 @@
+"""
+Informes clínicos HTML en lote para una cohorte completa, escritos directamente en un ZIP.
+
+Uso:
+    python bulk_reports.py cohorte.csv informes.zip [--workers 4] [--chunksize 2000] [--threshold 0.27] [--id-column ID]
+
+El CSV (mismas columnas que batch_scoring.py) se lee por bloques. Si es la salida de
+batch_scoring.py, su columna prob_diabetes se usa tal cual; si no, cada bloque se puntúa con
+el motor compilado. El top-5 SHAP se calcula por bloque en una sola llamada (batch_scoring.py
+no lo guarda); los informes se generan en un pool de procesos con la maqueta precompilada de
+report.py y se añaden al ZIP según terminan, de modo que en memoria solo hay unos pocos lotes
+a la vez. El ZIP incluye resumen.csv; los ficheros se llaman como el paciente y, si dos
+identificadores coinciden (o coinciden al limpiarlos), se añade el número de fila.
+"""
+import argparse
+import csv
+import datetime
+import io
+import os
+import re
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+
+import numpy as np
+import pandas as pd
+
+from explain import SHAP_AVAILABLE, PipelineExplainer
+from features import DEFAULT_CHUNKSIZE, DEFAULT_THRESHOLD, FEATURE_COLUMNS, build_feature_frame
+from report import create_html_report, format_date, recommendation_for, risk_label_for, shap_rows_html
+from threshold_analysis import PROB_COLUMN
+from warmup import ModelWarmup
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos")
+MODEL_PATH = os.path.join(MODELS_DIR, "diabetes_rf_pipeline.pkl")
+BUNDLE_DIR = os.path.join(MODELS_DIR, "diabetes_rf_pipeline_bundle")
+
+TOP_SHAP = 5
+RENDER_BATCH = 250  # Informes por tarea del pool
+
+
+def _fmt(value, spec):
+    return "—" if value != value else format(value, spec)
+
+
+def render_batch(patients, date_str, threshold):
+    """Tarea del pool: [(fichero, id, prob, variables, top SHAP)] -> [(fichero, HTML en bytes)]."""
+    out = []
+    for name, patient_id, prob, f, top in patients:
+        # El ID y la fecha vienen del CSV / la línea de órdenes: texto libre que no debe interpretarse como HTML
+        html = create_html_report(
+            escape(str(patient_id)),
+            escape(date_str),
+            prob,
+            risk_label_for(prob > threshold),
+            inputs_dict=_inputs_dict(f),
+            shap_rows_html=shap_rows_html(top),
+            recommendation=recommendation_for(f['Glucose'], prob, threshold),
+        )
+        out.append((name, html.encode("utf-8")))
+    return out
+
+
+def _inputs_dict(f):
+    """Mismos campos y formato que el informe de la app."""
+    return {
+        "Glucosa 2h": f"{_fmt(f['Glucose'], '.0f')} mg/dL",
+        "Insulina 2h": f"{_fmt(f['Insulin'], '.0f')} µU/ml",
+        "Índice RI (Glucosa x Insulina)": _fmt(f['Indice_resistencia'], '.0f'),
+        "BMI": f"{_fmt(f['BMI'], '.1f')} kg/m²",
+        "Edad": f"{_fmt(f['Age'], '.0f')} años",
+        "Presión Arterial": f"{_fmt(f['BloodPressure'], '.0f')} mm Hg",
+        "Embarazos": _fmt(f['Pregnancies'], '.0f'),
+        "Carga Genética (DPF)": _fmt(f['DPF'], '.2f'),
+    }
+
+
+def _safe_name(value):
+    return re.sub(r"[^\w.-]+", "_", str(value)).strip("_") or "paciente"
+
+
+def report_name(patient_id, row_number, used):
+    """
+    Fichero del informe dentro del ZIP. Si el nombre ya se usó (ID repetido o que coincide con
+    otro tras limpiarlo) se le añade el número de fila del CSV; `used` guarda los ya asignados.
+    """
+    stem = f"CDSS_Diabetes_{_safe_name(patient_id)}"
+    name, suffix = stem, 0
+    while name in used:
+        suffix += 1
+        name = f"{stem}_fila{row_number}" if suffix == 1 else f"{stem}_fila{row_number}_{suffix}"
+    used.add(name)
+    return name + ".html"
+
+
+def score_chunk(raw, engine, explainer, id_column, offset):
+    """Puntúa (o toma prob_diabetes del CSV) y explica un bloque; devuelve [(fila, id, prob, variables, top SHAP)]."""
+    features = build_feature_frame(raw)
+    if PROB_COLUMN in raw.columns:
+        # Cohorte ya puntuada por batch_scoring.py: solo se puntúan las filas sin probabilidad
+        probs = pd.to_numeric(raw[PROB_COLUMN], errors='coerce').to_numpy(dtype=float, copy=True)
+        missing = np.isnan(probs)
+        if missing.any():
+            probs[missing] = np.asarray(engine.predict_proba(features[missing]))[:, 1]
+    else:
+        probs = np.asarray(engine.predict_proba(features))[:, 1]
+    if explainer is not None:
+        shap_values = explainer.explain_batch(features)
+        top = np.argsort(-np.abs(shap_values), axis=1, kind='stable')[:, :TOP_SHAP]
+    ids = raw[id_column].astype(str).tolist() if id_column in raw.columns else [str(offset + i + 1) for i in range(len(raw))]
+    values = features.to_numpy(dtype=float)
+
+    patients = []
+    for i in range(len(raw)):
+        f = dict(zip(FEATURE_COLUMNS, values[i]))
+        rows = [(FEATURE_COLUMNS[j], values[i, j], shap_values[i, j]) for j in top[i]] if explainer is not None else []
+        patients.append((offset + i + 1, ids[i], float(probs[i]), f, rows))
+    return patients
+
+
+def write_reports(input_csv, output_zip, model_path=MODEL_PATH, bundle_dir=BUNDLE_DIR, threshold=DEFAULT_THRESHOLD,
+                  chunksize=DEFAULT_CHUNKSIZE, workers=None, id_column="ID", date_str=None):
+    """Genera un informe por paciente dentro de output_zip. Devuelve el número de informes."""
+    loader = ModelWarmup(model_path, bundle_dir, modules=()).start()
+    engine = loader.load_engine() or loader.load_pipeline()
+    if engine is None:
+        raise FileNotFoundError(f"No se encontró el modelo en {model_path}")
+    explainer = PipelineExplainer(loader.load_pipeline()) if SHAP_AVAILABLE else None
+    date_str = date_str or format_date(datetime.date.today())
+    workers = workers or os.cpu_count() or 1
+
+    summary = io.StringIO()
+    summary_writer = csv.writer(summary)
+    summary_writer.writerow(["id", "fichero", "prob_diabetes", "alto_riesgo"])
+    count = 0
+    used_names = set()
+    in_flight = deque()
+
+    def write_done(future):
+        nonlocal count
+        for name, data in future.result():
+            archive.writestr(name, data)
+            count += 1
+
+    with zipfile.ZipFile(output_zip, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as archive, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        offset = 0
+        for raw in pd.read_csv(input_csv, chunksize=chunksize):
+            patients = []
+            for row_number, patient_id, prob, f, top in score_chunk(raw, engine, explainer, id_column, offset):
+                name = report_name(patient_id, row_number, used_names)
+                summary_writer.writerow([patient_id, name, f"{prob:.6f}", int(prob > threshold)])
+                patients.append((name, patient_id, prob, f, top))
+            offset += len(raw)
+            for start in range(0, len(patients), RENDER_BATCH):
+                in_flight.append(pool.submit(render_batch, patients[start:start + RENDER_BATCH], date_str, threshold))
+                # Como mucho dos tareas por proceso pendientes: la memoria no crece con la cohorte
+                while len(in_flight) > 2 * workers:
+                    write_done(in_flight.popleft())
+        while in_flight:
+            write_done(in_flight.popleft())
+        archive.writestr("resumen.csv", summary.getvalue())
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera un informe HTML por paciente de una cohorte, dentro de un ZIP.")
+    parser.add_argument("input", help="CSV de entrada con los datos clínicos (o la salida de batch_scoring.py)")
+    parser.add_argument("output", help="ZIP de salida")
+    parser.add_argument("--model", default=MODEL_PATH, help="Ruta del pipeline (.pkl)")
+    parser.add_argument("--bundle", default=BUNDLE_DIR, help="Directorio del bundle .npy")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Umbral de decisión")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Filas por bloque")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para generar los informes")
+    parser.add_argument("--id-column", default="ID", help="Columna con el identificador del paciente")
+    parser.add_argument("--date", default=None, help="Fecha que figura en los informes (por defecto, hoy)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        count = write_reports(args.input, args.output, args.model, args.bundle, args.threshold,
+                              args.chunksize, args.workers, args.id_column, args.date)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    elapsed = time.perf_counter() - start
+    print(f"{count} informes escritos en {args.output} en {elapsed:.1f} s ({count / elapsed:.0f} informes/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
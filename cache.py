@@ -0,0 +1,62 @@
+"""Caché LRU acotada y segura entre hilos, compartida por todas las sesiones de la app."""
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Diccionario con tamaño máximo que expulsa la entrada usada hace más tiempo."""
+
+    def __init__(self, maxsize=256):
+        if maxsize <= 0:
+            raise ValueError("maxsize debe ser positivo")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Devuelve el valor cacheado o lo calcula con compute() y lo guarda."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # El cálculo se hace fuera del lock para no bloquear al resto de sesiones
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
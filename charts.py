@@ -0,0 +1,140 @@
+"""Gráficos Matplotlib de la app con caché de PNG ya codificados (común a todas las sesiones)."""
+import base64
+import io
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from cache import LRUCache
+
+# PNG ya rasterizados, por clave = entradas que cambian el gráfico
+_figure_cache = LRUCache(maxsize=512)
+
+# st.image reescala (y recodifica) en cada llamada cualquier imagen más ancha que esto
+MAX_IMAGE_WIDTH = 2 * 730
+
+
+def fig_to_html(fig):
+    """Convierte una figura de Matplotlib a string HTML base64."""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', transparent=True, dpi=300)
+    buf.seek(0)
+    img_str = base64.b64encode(buf.read()).decode()
+    return f'<img src="data:image/png;base64,{img_str}" style="width:100%; object-fit:contain;">'
+
+def fig_to_bytes(fig):
+    """Convierte figura a bytes para st.image (Permite zoom con fondo BLANCO)."""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight', transparent=False, facecolor='white', dpi=300)
+    buf.seek(0)
+    return buf
+
+def figure_cache_stats():
+    return _figure_cache.stats()
+
+def clear_figure_cache():
+    _figure_cache.clear()
+
+
+def _cached_png(key, draw, transparent):
+    """Devuelve el PNG de la clave o lo dibuja con draw() y lo guarda en la caché."""
+    def render():
+        fig = draw()
+        buf = io.BytesIO()
+        if transparent:
+            fig.savefig(buf, format='png', bbox_inches='tight', transparent=True, dpi=300)
+        else:
+            fig.savefig(buf, format='png', bbox_inches='tight', transparent=False, facecolor='white', dpi=300)
+        plt.close(fig)
+        return _fit_width(buf.getvalue())
+    return _figure_cache.get_or_compute(key, render)
+
+
+def _fit_width(png):
+    """Reduce el PNG a MAX_IMAGE_WIDTH una sola vez, al guardarlo, con el mismo filtro que st.image."""
+    from PIL import Image
+    image = Image.open(io.BytesIO(png))
+    if image.width <= MAX_IMAGE_WIDTH:
+        return png
+    height = int(1.0 * image.height * MAX_IMAGE_WIDTH / image.width)
+    buf = io.BytesIO()
+    image.resize((MAX_IMAGE_WIDTH, height), resample=Image.BILINEAR).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+# --- IMPORTANCIA GLOBAL DEL MODELO ---
+def importance_png(model_key, feature_names, importances, bar_color, dark_color):
+    """Barras horizontales de feature_importances_. Solo depende del modelo cargado."""
+
+    def draw():
+        order = np.argsort(importances, kind='stable')
+        names = [feature_names[i] for i in order]
+        values = np.asarray(importances)[order]
+
+        fig_imp, ax_imp = plt.subplots(figsize=(6, 5))
+        fig_imp.patch.set_facecolor('white')
+        ax_imp.set_facecolor('white')
+
+        bars = ax_imp.barh(names, values, color=bar_color, alpha=0.8)
+        ax_imp.spines['top'].set_visible(False)
+        ax_imp.spines['right'].set_visible(False)
+        ax_imp.spines['bottom'].set_visible(False)
+        ax_imp.spines['left'].set_visible(False)
+        ax_imp.tick_params(axis='y', colors=dark_color, labelsize=9)
+        ax_imp.tick_params(axis='x', colors='#999', labelsize=8)
+
+        for bar in bars:
+            width = bar.get_width()
+            ax_imp.text(width + 0.005, bar.get_y() + bar.get_height()/2,
+                        f'{width*100:.1f}%', ha='left', va='center', fontsize=8, color='#666')
+        return fig_imp
+
+    key = ('importance', model_key, tuple(feature_names), bar_color, dark_color)
+    return _cached_png(key, draw, transparent=False)
+
+
+# --- CASCADA SHAP DEL PACIENTE ---
+def shap_waterfall_png(values, base_value, data, feature_names):
+    """Cascada SHAP de un paciente. La clave son los propios números: el mismo paciente no se vuelve a dibujar."""
+
+    def draw():
+        import shap
+        exp = shap.Explanation(values=np.asarray(values), base_values=base_value,
+                               data=np.asarray(data), feature_names=list(feature_names))
+        fig_shap, ax_shap = plt.subplots(figsize=(6, 5))
+        fig_shap.patch.set_facecolor('white')
+        ax_shap.set_facecolor('white')
+        shap.plots.waterfall(exp, show=False, max_display=10)
+        plt.tight_layout()
+        return fig_shap
+
+    key = ('shap_waterfall', np.asarray(values, dtype=float).tobytes(), float(base_value),
+           np.asarray(data, dtype=float).tobytes(), tuple(feature_names))
+    return _cached_png(key, draw, transparent=False)
+
+
+# --- RESUMEN SHAP DE LA COHORTE DE REFERENCIA ---
+BEESWARM_MAX_POINTS = 2000
+
+
+def shap_beeswarm_png(summary_key, shap_values, features, feature_names):
+    """Beeswarm de los valores SHAP precalculados de la cohorte. Se dibuja una vez por resumen cargado."""
+
+    def draw():
+        import shap
+        fig_bee = plt.figure(figsize=(6, 5))
+        fig_bee.patch.set_facecolor('white')
+        # Con unos miles de puntos la nube ya está definida; más solo alarga el dibujo
+        shap.summary_plot(np.asarray(shap_values[:BEESWARM_MAX_POINTS], dtype=float),
+                          np.asarray(features[:BEESWARM_MAX_POINTS], dtype=float),
+                          feature_names=list(feature_names), max_display=10, plot_size=None, show=False)
+        ax_bee, ax_bar = fig_bee.axes[0], fig_bee.axes[-1]
+        ax_bee.tick_params(labelsize=8)
+        ax_bee.set_xlabel("Impacto SHAP en la probabilidad", fontsize=9)
+        ax_bar.set_yticklabels(["Bajo", "Alto"], fontsize=8)
+        ax_bar.set_ylabel("Valor de la variable", fontsize=9)
+        plt.tight_layout()
+        return fig_bee
+
+    key = ('shap_beeswarm', summary_key, tuple(feature_names))
+    return _cached_png(key, draw, transparent=False)
@@ -0,0 +1,69 @@
+"""
+Panel de cohorte: variables derivadas, puntuación y alertas de un CSV de pacientes, todo por columnas.
+"""
+import numpy as np
+
+from features import build_feature_frame
+
+# Criterios de los HALLAZGOS CLAVE: el Panel General y la cohorte usan esta misma lista.
+# (columna de la cohorte, hallazgo, regla); las reglas valen para escalares y para columnas numéricas
+ALERT_RULES = (
+    ("alerta_diabetes", "Posible Diabetes", lambda f: f['Glucose'] >= 200),
+    ("alerta_prediabetes", "Posible Prediabetes", lambda f: (f['Glucose'] >= 140) & (f['Glucose'] < 200)),
+    ("alerta_obesidad_g3", "Obesidad Mórbida (G3)", lambda f: f['BMI'] >= 40),
+    ("alerta_obesidad_g2", "Obesidad G2", lambda f: (f['BMI'] >= 35) & (f['BMI'] < 40)),
+    ("alerta_obesidad_g1", "Obesidad G1", lambda f: (f['BMI'] >= 30) & (f['BMI'] < 35)),
+    ("alerta_sobrepeso", "Sobrepeso", lambda f: (f['BMI'] >= 25) & (f['BMI'] < 30)),
+    ("alerta_bajo_peso", "Bajo Peso", lambda f: (f['BMI'] > 0) & (f['BMI'] < 18.5)),
+    ("alerta_resistencia", "Resistencia Insulina", lambda f: f['Indice_resistencia'] > 19769.5),
+    ("alerta_hipertension", "Hipertensión Diastólica", lambda f: f['BloodPressure'] > 90),
+)
+
+
+def patient_alerts(values):
+    """Hallazgos de un paciente (dict con Glucose, BMI, Indice_resistencia y BloodPressure)."""
+    return [name for _, name, rule in ALERT_RULES if rule(values)]
+
+
+def score_cohort(raw, predictor):
+    """
+    Datos clínicos + variables del modelo + prob_diabetes + una columna por alerta y el nº de
+    alertas de toda la cohorte, con una sola llamada a predict_proba.
+    """
+    features = build_feature_frame(raw).reset_index(drop=True)
+    scored = raw.reset_index(drop=True)
+    for column in ('BMI', 'Indice_resistencia', 'BMI_square', 'Is_prediabetes'):
+        scored[column] = features[column].to_numpy()
+    scored['prob_diabetes'] = np.asarray(predictor.predict_proba(features))[:, 1]
+    # Las reglas se evalúan sobre las variables ya convertidas a número (una celda no numérica es NaN)
+    for column, _, rule in ALERT_RULES:
+        scored[column] = rule(features).to_numpy(dtype=bool)
+    scored['n_alertas'] = scored[[column for column, _, _ in ALERT_RULES]].sum(axis=1)
+    return scored
+
+
+def alert_counts(scored):
+    """Pacientes que cumplen cada criterio de alerta (columnas que deja score_cohort)."""
+    return {name: int(scored[column].sum()) for column, name, _ in ALERT_RULES}
+
+
+def risk_histogram(probs, bins=20):
+    counts, edges = np.histogram(probs[~np.isnan(probs)], bins=bins, range=(0.0, 1.0))
+    return counts, edges
+
+
+class SortedPager:
+    """Orden de las filas por una columna (calculado una vez) y acceso a una sola página."""
+
+    def __init__(self, frame, column, ascending=True):
+        # frame tiene RangeIndex (score_cohort): las etiquetas ordenadas son posiciones
+        self.frame = frame
+        self.order = frame[column].sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+
+    def n_pages(self, page_size):
+        return max(1, -(-len(self.order) // page_size))
+
+    def page(self, number, page_size):
+        """Filas de la página `number` (empezando en 1)."""
+        start = (number - 1) * page_size
+        return self.frame.iloc[self.order[start:start + page_size]]
@@ -0,0 +1,260 @@
+"""
+Variantes compactas del Random Forest y su fidelidad frente al pipeline original.
+
+    python compress_model.py [--data validacion.csv] [--trees 25 50 100] [--depths 3 4] [--save]
+
+Tres formas de reducir named_steps['model'] (imputer y scaler no cambian):
+  - tN:        los N primeros árboles (cada árbol es una muestra bootstrap independiente).
+  - dN:        todos los árboles cortados a profundidad N; los nodos de esa profundidad pasan
+               a ser hojas con la distribución de clases que ya tenían (no se reentrena nada).
+  - distilNxM: un bosque nuevo de N árboles de profundidad M entrenado con las probabilidades
+               del original sobre pacientes sintéticos (destilación con etiquetas blandas).
+
+Para cada variante se mide la latencia de una fila (pipeline sklearn y motor compilado), la
+memoria de los árboles, el tamaño del pickle y la concordancia con el original: AUC y su delta,
+pacientes que cambian de clase en el umbral y diferencia máxima de probabilidad. El informe se
+guarda junto al modelo (<modelo>_compression.json); con --save cada variante se escribe como
+<modelo>_<variante>.pkl, que el registro de versiones ya puede activar.
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from approx_explain import with_model
+from fast_forest import CompiledForest, file_sha256
+from features import DEFAULT_THRESHOLD, FEATURE_COLUMNS, build_feature_array, build_feature_frame
+from registry import engine_nbytes, pipeline_nbytes
+from threshold_analysis import OUTCOME_COLUMN, ThresholdAnalysis
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos", "diabetes_rf_pipeline.pkl")
+LATENCY_REPEAT = 200
+# Variables que build_feature_array calcula a partir de los datos clínicos (al final de FEATURE_COLUMNS)
+DERIVED_COLUMNS = ('Indice_resistencia', 'BMI_square', 'Is_prediabetes')
+
+
+def report_path_for(model_path):
+    """Informe de compresión junto al modelo: modelos/x.pkl -> modelos/x_compression.json."""
+    return os.path.splitext(model_path)[0] + "_compression.json"
+
+
+def first_trees(pipeline, n_trees):
+    """Pipeline con los n_trees primeros árboles del bosque."""
+    forest = copy.copy(pipeline.named_steps['model'])
+    forest.estimators_ = forest.estimators_[:n_trees]
+    forest.n_estimators = len(forest.estimators_)
+    return with_model(pipeline, forest)
+
+
+def truncate_tree(estimator, max_depth):
+    """
+    Copia del árbol cortada a max_depth. Los nodos se reindexan en preorden y solo se guardan
+    los alcanzables, así que la memoria baja de verdad (no quedan nodos huérfanos).
+    """
+    from sklearn.tree._tree import TREE_LEAF, TREE_UNDEFINED, Tree
+
+    tree = estimator.tree_
+    state = tree.__getstate__()
+    nodes, values = state['nodes'], state['values']
+    order, depths = [], []
+    stack = [(0, 0)]
+    while stack:
+        node, depth = stack.pop()
+        order.append(node)
+        depths.append(depth)
+        if depth < max_depth and nodes['left_child'][node] != TREE_LEAF:
+            stack.append((nodes['right_child'][node], depth + 1))
+            stack.append((nodes['left_child'][node], depth + 1))
+    order = np.asarray(order, dtype=np.intp)
+    new_index = np.full(nodes.shape[0], TREE_LEAF, dtype=np.intp)
+    new_index[order] = np.arange(order.size)
+
+    new_nodes = nodes[order].copy()
+    is_leaf = (np.asarray(depths) >= max_depth) | (new_nodes['left_child'] == TREE_LEAF)
+    new_nodes['left_child'] = np.where(is_leaf, TREE_LEAF, new_index[np.maximum(new_nodes['left_child'], 0)])
+    new_nodes['right_child'] = np.where(is_leaf, TREE_LEAF, new_index[np.maximum(new_nodes['right_child'], 0)])
+    new_nodes['feature'] = np.where(is_leaf, TREE_UNDEFINED, new_nodes['feature'])
+    new_nodes['threshold'] = np.where(is_leaf, TREE_UNDEFINED, new_nodes['threshold'])
+
+    truncated = Tree(tree.n_features, np.atleast_1d(np.asarray(estimator.n_classes_, dtype=np.intp)), tree.n_outputs)
+    truncated.__setstate__({
+        'max_depth': int(min(tree.max_depth, max_depth)),
+        'node_count': int(order.size),
+        'nodes': np.ascontiguousarray(new_nodes),
+        'values': np.ascontiguousarray(values[order]),
+    })
+    clone = copy.copy(estimator)
+    clone.tree_ = truncated
+    clone.max_depth = max_depth
+    return clone
+
+
+def limit_depth(pipeline, max_depth):
+    """Pipeline con todos los árboles cortados a max_depth."""
+    forest = copy.copy(pipeline.named_steps['model'])
+    forest.estimators_ = [truncate_tree(estimator, max_depth) for estimator in forest.estimators_]
+    forest.max_depth = max_depth
+    return with_model(pipeline, forest)
+
+
+def distill(pipeline, X_transfer, n_trees, max_depth, seed=0):
+    """
+    Bosque compacto que imita las probabilidades del original: cada paciente de transferencia entra
+    dos veces, como clase 0 con peso 1 - p y como clase 1 con peso p (p = probabilidad del original),
+    de modo que cada hoja estima la probabilidad media del original en su región.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    soft = np.asarray(pipeline.predict_proba(X_transfer))[:, 1]
+    preprocess = pipeline[:-1]
+    Xt = np.asarray(preprocess.transform(X_transfer), dtype=np.float64)
+    n = Xt.shape[0]
+    student = RandomForestClassifier(n_estimators=n_trees, max_depth=max_depth, max_features=None,
+                                     min_samples_leaf=20, random_state=seed, n_jobs=-1)
+    student.fit(np.vstack([Xt, Xt]), np.repeat([0, 1], n), sample_weight=np.concatenate([1.0 - soft, soft]))
+    student.n_jobs = None  # Como el original: una fila no compensa repartir entre procesos
+    return with_model(pipeline, student)
+
+
+def synthetic_rows(pipeline, n, seed, spread=1.5):
+    """
+    Pacientes sintéticos: datos clínicos alrededor de la media del scaler (sin negativos) y variables
+    derivadas calculadas con build_feature_array, así que son coherentes con los datos de partida.
+    """
+    scaler = pipeline.named_steps['scaler']
+    n_inputs = len(FEATURE_COLUMNS) - len(DERIVED_COLUMNS)
+    rng = np.random.default_rng(seed)
+    raw = scaler.mean_[:n_inputs] + scaler.scale_[:n_inputs] * rng.standard_normal((n, n_inputs)) * spread
+    return pd.DataFrame(build_feature_array(*np.maximum(raw, 0.0).T), columns=FEATURE_COLUMNS)
+
+
+def _warm_p50_ms(fn, repeat):
+    """Mediana en ms de fn() tras unas llamadas de calentamiento."""
+    for _ in range(5):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.percentile(np.asarray(times) * 1000, 50))
+
+
+def fidelity(original_probs, pipeline, X, y, threshold, repeat=LATENCY_REPEAT):
+    """Coste y concordancia con el original de un pipeline sobre el conjunto de evaluación X."""
+    probs = np.asarray(pipeline.predict_proba(X))[:, 1]
+    engine = CompiledForest.from_pipeline(pipeline)
+    one_row = X.iloc[:1]
+    diff = np.abs(probs - original_probs)
+    flips = (probs > threshold) != (original_probs > threshold)
+    forest = pipeline.named_steps['model']
+    return {
+        "n_trees": len(forest.estimators_),
+        "n_nodes": int(sum(e.tree_.node_count for e in forest.estimators_)),
+        "max_depth": int(max(e.tree_.max_depth for e in forest.estimators_)),
+        "pipeline_ms": _warm_p50_ms(lambda: pipeline.predict_proba(one_row), repeat),
+        "engine_ms": _warm_p50_ms(lambda: engine.predict_proba(one_row), repeat),
+        "tree_bytes": pipeline_nbytes(pipeline),
+        "engine_bytes": engine_nbytes(engine),
+        "pickle_bytes": len(pickle.dumps(pipeline, protocol=pickle.HIGHEST_PROTOCOL)),
+        "auc": ThresholdAnalysis(y, probs).auc,
+        "label_flips": int(flips.sum()),
+        "flip_rate": float(flips.mean()),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+    }
+
+
+def _evaluation_rows(pipeline, data_path, n, seed):
+    """Pacientes del CSV (datos clínicos y, si la hay, Outcome) o sintéticos; y = None sin Outcome."""
+    if not data_path:
+        return synthetic_rows(pipeline, n, seed, spread=1.0), None
+    df = pd.read_csv(data_path)
+    if len(df) > n:
+        df = df.sample(n=n, random_state=seed)
+    y = pd.to_numeric(df[OUTCOME_COLUMN], errors='coerce').to_numpy(dtype=float) if OUTCOME_COLUMN in df.columns else None
+    return build_feature_frame(df).reset_index(drop=True), y
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera variantes compactas del bosque y mide su fidelidad.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Ruta del pipeline (.pkl)")
+    parser.add_argument("--data", default=None, help="CSV de evaluación con datos clínicos (por defecto, pacientes sintéticos)")
+    parser.add_argument("--n", type=int, default=5000, help="Pacientes de evaluación")
+    parser.add_argument("--trees", type=int, nargs="*", default=[25, 50, 100], help="Variantes con menos árboles")
+    parser.add_argument("--depths", type=int, nargs="*", default=[3, 4], help="Variantes con profundidad limitada")
+    parser.add_argument("--distill", type=int, nargs=2, action="append", metavar=("ÁRBOLES", "PROFUNDIDAD"),
+                        help="Variante destilada (se puede repetir; por defecto 16 árboles de profundidad 8)")
+    parser.add_argument("--transfer", type=int, default=50000, help="Pacientes sintéticos para la destilación")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Umbral de decisión para contar cambios de clase")
+    parser.add_argument("--save", action="store_true", help="Guarda cada variante como <modelo>_<variante>.pkl")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import joblib
+    try:
+        pipeline = joblib.load(args.model)
+        X, y = _evaluation_rows(pipeline, args.data, args.n, args.seed)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    original_probs = np.asarray(pipeline.predict_proba(X))[:, 1]
+    # Sin Outcome, la referencia del AUC son las clases del original en el umbral
+    labels = y if y is not None else (original_probs > args.threshold).astype(float)
+
+    n_trees = len(pipeline.named_steps['model'].estimators_)
+    variants = {f"t{n}": (lambda n=n: first_trees(pipeline, n)) for n in args.trees if 0 < n < n_trees}
+    variants.update({f"d{d}": (lambda d=d: limit_depth(pipeline, d)) for d in args.depths if d > 0})
+    transfer = synthetic_rows(pipeline, args.transfer, args.seed + 1)
+    for trees, depth in args.distill or [(16, 8)]:
+        variants[f"distil{trees}x{depth}"] = lambda trees=trees, depth=depth: distill(pipeline, transfer, trees, depth, args.seed)
+
+    results = {"original": fidelity(original_probs, pipeline, X, labels, args.threshold)}
+    base_auc = results["original"]["auc"]
+    results["original"]["auc_delta"] = 0.0
+    for name, build in variants.items():
+        t = time.perf_counter()
+        variant = build()
+        build_s = time.perf_counter() - t
+        results[name] = fidelity(original_probs, variant, X, labels, args.threshold)
+        results[name]["auc_delta"] = results[name]["auc"] - base_auc
+        results[name]["build_s"] = build_s
+        if args.save:
+            path = f"{os.path.splitext(args.model)[0]}_{name}.pkl"
+            joblib.dump(variant, path)
+            results[name]["file"] = os.path.basename(path)
+
+    payload = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "model_sha256": file_sha256(args.model),
+        "data": os.path.basename(args.data) if args.data else "sintético",
+        "n_rows": int(len(X)),
+        "auc_reference": OUTCOME_COLUMN if y is not None else "original",
+        "threshold": args.threshold,
+        "variants": results,
+    }
+    output = report_path_for(args.model)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+
+    print(f"{'variante':<14} {'árboles':>7} {'nodos':>6} {'sklearn ms':>10} {'motor ms':>8} {'memoria KB':>10} "
+          f"{'pickle KB':>9} {'ΔAUC':>7} {'cambios':>8} {'máx |Δp|':>8}")
+    for name, r in results.items():
+        print(f"{name:<14} {r['n_trees']:7d} {r['n_nodes']:6d} {r['pipeline_ms']:10.2f} {r['engine_ms']:8.3f} "
+              f"{r['tree_bytes'] / 1024:10.0f} {r['pickle_bytes'] / 1024:9.0f} {r['auc_delta']:+7.4f} "
+              f"{r['label_flips']:8d} {r['max_abs_diff']:8.3f}")
+    reference = "Outcome" if y is not None else "las clases del original"
+    print(f"\nAUC frente a {reference}; cambios de clase en el umbral {args.threshold}. Informe en {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
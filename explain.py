@@ -0,0 +1,74 @@
+"""Explicabilidad SHAP del pipeline con explainer único y caché de resultados por paciente."""
+import numpy as np
+
+from cache import LRUCache
+
+# Intentamos importar SHAP de forma segura
+try:
+    import shap
+    SHAP_AVAILABLE = True
+except ImportError:
+    SHAP_AVAILABLE = False
+
+
+def positive_class_shap(shap_values):
+    """Extrae los valores SHAP de la clase positiva (Diabetes) como matriz (n, variables)."""
+    if isinstance(shap_values, list):
+        return np.asarray(shap_values[1])
+    if len(shap_values.shape) == 3:
+        return shap_values[:, :, 1]
+    return shap_values
+
+
+class PipelineExplainer:
+    """TreeExplainer construido una sola vez por pipeline, con caché LRU de vectores SHAP."""
+
+    def __init__(self, pipeline, maxsize=256):
+        if not SHAP_AVAILABLE:
+            raise ImportError("SHAP no está instalado")
+        self.pipeline = pipeline
+        self.explainer = shap.TreeExplainer(pipeline.named_steps['model'])
+        expected = self.explainer.expected_value
+        self.base_value = float(expected[1]) if isinstance(expected, (np.ndarray, list)) else float(expected)
+        self.cache = LRUCache(maxsize)
+
+    def transform(self, input_data):
+        """Aplica imputer y scaler: el vector que ve el Random Forest."""
+        step1 = self.pipeline.named_steps['imputer'].transform(input_data)
+        return self.pipeline.named_steps['scaler'].transform(step1)
+
+    def explain(self, input_data):
+        """Devuelve el vector SHAP (clase positiva) del primer paciente de input_data."""
+        step2 = np.ascontiguousarray(self.transform(input_data)[:1], dtype=np.float64)
+        return self.cache.get_or_compute(step2.tobytes(), lambda: self._compute(step2))
+
+    def explain_many(self, input_data):
+        """Vectores SHAP de todas las filas: las que no están en caché se calculan en una sola llamada."""
+        step2 = np.ascontiguousarray(self.transform(input_data), dtype=np.float64)
+        keys = [row.tobytes() for row in step2]
+        out = np.empty(step2.shape, dtype=np.float64)
+        missing = []
+        for i, key in enumerate(keys):
+            values = self.cache.get(key)
+            if values is None:
+                missing.append(i)
+            else:
+                out[i] = values
+        if missing:
+            computed = positive_class_shap(self.explainer.shap_values(step2[missing]))
+            for row, i in zip(computed, missing):
+                values = row.copy()
+                values.flags.writeable = False
+                self.cache.put(keys[i], values)
+                out[i] = values
+        return out
+
+    def explain_batch(self, input_data):
+        """Vectores SHAP de un lote grande en una sola llamada, sin pasar por la caché."""
+        step2 = np.ascontiguousarray(self.transform(input_data), dtype=np.float64)
+        return positive_class_shap(self.explainer.shap_values(step2))
+
+    def _compute(self, step2):
+        values = positive_class_shap(self.explainer.shap_values(step2))[0].copy()
+        values.flags.writeable = False  # Compartido entre sesiones: solo lectura
+        return values
@@ -0,0 +1,61 @@
+"""
+Exporta el pipeline a un bundle de arrays .npy (mapeables en memoria) con su manifest.json.
+
+Uso:
+    python export_model.py [--model modelos/diabetes_rf_pipeline.pkl] [--output modelos/diabetes_rf_pipeline_bundle]
+
+Sin --output, el bundle va junto al pipeline (modelos/<nombre>_bundle), donde lo busca el registro de versiones.
+
+El bundle solo se escribe si el motor compilado reproduce exactamente el pipeline.
+La app lo carga con mmap_mode='r' mientras su huella coincida con la del .pkl.
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+
+from fast_forest import CompiledForest
+from registry import bundle_dir_for
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos")
+MODEL_PATH = os.path.join(MODELS_DIR, "diabetes_rf_pipeline.pkl")
+
+
+def export_bundle(model_path, output_dir):
+    """Compila, valida y guarda el bundle. Devuelve el manifest escrito."""
+    pipeline = joblib.load(model_path)
+    engine = CompiledForest.from_pipeline(pipeline)
+    max_diff = engine.check_equivalence(pipeline)
+    return engine.save(output_dir, source_path=model_path, max_abs_diff=max_diff)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta el pipeline a un bundle .npy mapeable en memoria.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Ruta del pipeline (.pkl)")
+    parser.add_argument("--output", default=None, help="Directorio del bundle (por defecto, <modelo>_bundle)")
+    args = parser.parse_args(argv)
+    args.output = args.output or bundle_dir_for(args.model)
+
+    try:
+        manifest = export_bundle(args.model, args.output)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    print(f"Bundle escrito en {args.output}: {manifest['n_trees']} árboles, {manifest['n_nodes']} nodos "
+          f"(diferencia máx. con el pipeline {manifest['equivalence_max_abs_diff']:.1e})")
+
+    # Comparativa de tiempos de carga
+    t = time.perf_counter()
+    joblib.load(args.model)
+    t_pickle = time.perf_counter() - t
+    t = time.perf_counter()
+    CompiledForest.load(args.output, mmap_mode='r')
+    t_bundle = time.perf_counter() - t
+    print(f"Carga: joblib {t_pickle * 1000:.1f} ms · bundle mmap {t_bundle * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
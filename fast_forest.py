@@ -0,0 +1,229 @@
+"""
+Motor de inferencia vectorizado compilado a partir del pipeline (imputer + scaler + Random Forest).
+
+Aplana las medianas del imputer, los parámetros del scaler y todos los árboles de
+named_steps['model'] en arrays contiguos de NumPy y evalúa el bosque completo
+(una fila o un lote) recorriendo todos los árboles a la vez, nivel a nivel.
+
+Los arrays se pueden exportar a un bundle de ficheros .npy con un manifest.json y
+cargarse con mmap_mode='r': varios procesos del mismo servidor comparten así las
+mismas páginas físicas en lugar de deserializar cada uno su copia del pickle.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from warmup import file_sha256  # Se reexporta: export_model, benchmark y las herramientas lo importan de aquí
+
+# Filas por bloque al evaluar lotes grandes (acota la memoria de la matriz filas x árboles)
+BLOCK_ROWS = 4096
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# Arrays que se guardan en el bundle (un .npy por array)
+BUNDLE_ARRAYS = ('impute_values', 'scale_mean', 'scale_scale', 'feature', 'threshold', 'children', 'value', 'roots', 'feature_importances')
+
+
+class CompiledForest:
+    """Sustituto de pipeline.predict_proba sin sobrecoste de validación ni despacho por árbol."""
+
+    def __init__(self, feature_names, impute_values, scale_mean, scale_scale, feature, threshold,
+                 children, value, roots, max_depth, classes, feature_importances=None):
+        # ascontiguousarray no copia si el dtype ya coincide (los arrays mmap siguen compartidos)
+        self.feature_names = list(feature_names)
+        self.impute_values = np.ascontiguousarray(impute_values, dtype=np.float64)
+        self.scale_mean = np.ascontiguousarray(scale_mean, dtype=np.float64)
+        self.scale_scale = np.ascontiguousarray(scale_scale, dtype=np.float64)
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        # Hijos intercalados [derecho, izquierdo] por nodo: un único gather por nivel
+        self.children = np.ascontiguousarray(children, dtype=np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes)
+        if feature_importances is None:
+            feature_importances = np.full(len(self.feature_names), np.nan)
+        self.feature_importances_ = np.ascontiguousarray(feature_importances, dtype=np.float64)
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """Compila el pipeline. Lanza ValueError si contiene algo que el motor no reproduce."""
+        imputer = pipeline.named_steps['imputer']
+        scaler = pipeline.named_steps['scaler']
+        forest = pipeline.named_steps['model']
+
+        statistics = np.asarray(imputer.statistics_, dtype=np.float64)
+        if np.isnan(statistics).any() or not (isinstance(imputer.missing_values, float) and np.isnan(imputer.missing_values)):
+            raise ValueError("Imputer no soportado por el motor compilado")
+        n_features = statistics.shape[0]
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            node_ids = np.arange(n_nodes)
+            is_leaf = tree.children_left == -1
+            # Las hojas apuntan a sí mismas: el recorrido se queda quieto al llegar
+            left = np.where(is_leaf, node_ids, tree.children_left) + offset
+            right = np.where(is_leaf, node_ids, tree.children_right) + offset
+            children.append(np.stack([right, left], axis=1).ravel())
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            # Misma normalización que DecisionTreeClassifier.predict_proba
+            node_value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = node_value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(node_value / normalizer)
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n_nodes
+
+        feature_names = getattr(pipeline, 'feature_names_in_', None)
+        if feature_names is None:
+            feature_names = getattr(imputer, 'feature_names_in_', range(n_features))
+
+        return cls(feature_names, statistics, mean, scale, np.concatenate(features), np.concatenate(thresholds),
+                   np.concatenate(children), np.concatenate(values), roots, max_depth,
+                   forest.classes_, getattr(forest, 'feature_importances_', None))
+
+    def save(self, directory, source_path=None, max_abs_diff=None):
+        """Escribe un .npy por array y el manifest.json en directory."""
+        os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        for name in BUNDLE_ARRAYS:
+            array = getattr(self, 'feature_importances_' if name == 'feature_importances' else name)
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+            arrays[name] = {"dtype": str(array.dtype), "shape": list(array.shape)}
+        manifest = {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "feature_names": self.feature_names,
+            "classes": self.classes_.tolist(),
+            "n_trees": self.n_trees,
+            "n_nodes": int(self.threshold.shape[0]),
+            "max_depth": self.max_depth,
+            "arrays": arrays,
+            "source": None,
+            "equivalence_max_abs_diff": max_abs_diff,
+        }
+        if source_path is not None:
+            manifest["source"] = {"file": os.path.basename(source_path), "sha256": file_sha256(source_path)}
+        with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Carga un bundle exportado con save(). Con mmap_mode='r' los arrays no se copian a memoria."""
+        manifest = read_manifest(directory)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in BUNDLE_ARRAYS}
+        return cls(manifest["feature_names"], arrays['impute_values'], arrays['scale_mean'], arrays['scale_scale'],
+                   arrays['feature'], arrays['threshold'], arrays['children'], arrays['value'], arrays['roots'],
+                   manifest["max_depth"], manifest["classes"], arrays['feature_importances'])
+
+    @property
+    def n_trees(self):
+        return self.roots.shape[0]
+
+    def _as_array(self, X):
+        if isinstance(X, pd.DataFrame):
+            X = X[self.feature_names].to_numpy(dtype=np.float64)
+        return np.atleast_2d(np.asarray(X, dtype=np.float64))
+
+    def transform(self, X):
+        """Imputación por mediana + estandarización (equivalente a los dos primeros pasos del pipeline)."""
+        X = self._as_array(X)
+        X = np.where(np.isnan(X), self.impute_values, X)
+        return (X - self.scale_mean) / self.scale_scale
+
+    def _leaves(self, Xt):
+        """Índice global de la hoja alcanzada en cada árbol: matriz (filas, árboles)."""
+        # Los árboles de sklearn comparan en float32
+        Xt = Xt.astype(np.float32).astype(np.float64)
+        n_rows, n_features = Xt.shape
+        flat_x = Xt.ravel()
+        row_offset = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        nodes = np.repeat(self.roots[None, :], n_rows, axis=0)
+        for _ in range(self.max_depth):
+            go_left = flat_x[row_offset + self.feature[nodes]] <= self.threshold[nodes]
+            nodes = self.children[2 * nodes + go_left]
+        return nodes
+
+    def predict_proba(self, X):
+        """Probabilidades por clase, con la misma forma que pipeline.predict_proba."""
+        Xt = self.transform(X)
+        out = np.empty((Xt.shape[0], self.value.shape[1]), dtype=np.float64)
+        for start in range(0, Xt.shape[0], BLOCK_ROWS):
+            leaves = self._leaves(Xt[start:start + BLOCK_ROWS])
+            out[start:start + BLOCK_ROWS] = self.value[leaves].mean(axis=1)
+        return out
+
+    def path_contributions(self, X, class_index=1):
+        """
+        Atribución por caminos (Saabas): cada división suma a su variable el cambio de probabilidad
+        entre el nodo y el hijo recorrido. Devuelve (base, matriz (filas, variables)) con
+        base + contribuciones.sum(axis=1) == predict_proba(X)[:, class_index].
+        """
+        Xt = self.transform(X)
+        n_features = len(self.feature_names)
+        value = self.value[:, class_index]
+        base = float(value[self.roots].mean())
+        out = np.empty((Xt.shape[0], n_features), dtype=np.float64)
+        for start in range(0, Xt.shape[0], BLOCK_ROWS):
+            block = Xt[start:start + BLOCK_ROWS].astype(np.float32).astype(np.float64)
+            n_rows = block.shape[0]
+            flat_x = block.ravel()
+            row_offset = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+            nodes = np.repeat(self.roots[None, :], n_rows, axis=0)
+            totals = np.zeros(n_rows * n_features)
+            for _ in range(self.max_depth):
+                slots = row_offset + self.feature[nodes]
+                go_left = flat_x[slots] <= self.threshold[nodes]
+                children = self.children[2 * nodes + go_left]
+                # En las hojas el hijo es el propio nodo: su aportación es 0
+                totals += np.bincount(slots.ravel(), weights=(value[children] - value[nodes]).ravel(),
+                                      minlength=totals.size)
+                nodes = children
+            out[start:start + n_rows] = totals.reshape(n_rows, n_features) / self.n_trees
+        return base, out
+
+    def check_equivalence(self, pipeline, X=None, n_samples=2000, atol=1e-9, seed=0):
+        """
+        Compara el motor con el pipeline original y devuelve la diferencia máxima de probabilidad.
+        Si no se pasa X, genera pacientes sintéticos alrededor de la media del scaler (con algún NaN).
+        Lanza ValueError si la diferencia supera atol.
+        """
+        if X is None:
+            rng = np.random.default_rng(seed)
+            X = self.scale_mean + self.scale_scale * rng.standard_normal((n_samples, len(self.feature_names))) * 1.5
+            X[rng.random(X.shape) < 0.02] = np.nan
+            X = pd.DataFrame(X, columns=self.feature_names)
+        expected = np.asarray(pipeline.predict_proba(X))
+        max_diff = float(np.abs(self.predict_proba(X) - expected).max())
+        if not max_diff <= atol:
+            raise ValueError(f"El motor compilado difiere del pipeline (máx. {max_diff:.2e})")
+        return max_diff
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Versión de bundle no soportada: {manifest.get('format_version')}")
+    return manifest
+
+
+def bundle_is_current(directory, model_path):
+    """True si existe un bundle en directory exportado a partir del pickle actual de model_path."""
+    try:
+        source = read_manifest(directory).get("source") or {}
+    except (OSError, ValueError):
+        return False
+    return os.path.exists(model_path) and source.get("sha256") == file_sha256(model_path)
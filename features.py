@@ -0,0 +1,91 @@
+"""
+Construcción de las variables que espera el pipeline a partir de los datos clínicos.
+
+Las mismas funciones sirven para un paciente (escalares) y para columnas NumPy/pandas:
+la barra lateral, el Panel General, los lotes, el servicio y el benchmark comparten así
+exactamente el mismo cálculo de BMI, Índice RI, BMI² y prediabetes.
+"""
+import numpy as np
+import pandas as pd
+
+# Columnas EXACTAS (y en orden) con las que se entrenó el pipeline
+FEATURE_COLUMNS = ['Pregnancies', 'Glucose', 'BloodPressure', 'Insulin', 'BMI', 'DPF', 'Age', 'Indice_resistencia', 'BMI_square', 'Is_prediabetes']
+
+# Datos clínicos de entrada (los mismos que recoge la barra lateral de la app)
+RAW_COLUMNS = ['Pregnancies', 'Glucose', 'BloodPressure', 'Insulin', 'Weight', 'Height', 'DPF', 'Age']
+
+PREDIABETES_GLUCOSE = 140
+
+# Umbral de decisión de la app y filas por bloque al leer un CSV de cohorte (lotes, informes, servicio)
+DEFAULT_THRESHOLD = 0.27
+DEFAULT_CHUNKSIZE = 50_000
+
+# Decimales con los que los controles de la app fijan cada variable (clave de la caché de predicciones)
+FEATURE_DECIMALS = (0, 0, 0, 0, 6, 2, 0, 0, 4, 0)
+
+
+def _same_kind(value, *inputs):
+    """Devuelve un float si todas las entradas eran escalares; si no, el array."""
+    return float(value) if all(np.ndim(x) == 0 for x in inputs) else value
+
+
+def body_mass_index(weight, height):
+    """BMI = peso / altura². Como en la app, 0 si la altura no es válida; NaN si falta algún dato."""
+    weight = np.asarray(weight, dtype=float)
+    height = np.asarray(height, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bmi = np.where(height > 0, weight / (height * height), 0.0)
+    bmi = np.where(np.isnan(weight) | np.isnan(height), np.nan, bmi)
+    return _same_kind(bmi, weight, height)
+
+
+def resistance_index(glucose, insulin):
+    """Índice RI = int(glucosa × insulina) (truncado, igual que la barra lateral)."""
+    return _same_kind(np.trunc(np.asarray(glucose, dtype=float) * np.asarray(insulin, dtype=float)), glucose, insulin)
+
+
+def prediabetes_flag(glucose):
+    """1 si glucosa >= 140 mg/dL; los NaN se conservan para el imputer del pipeline."""
+    glucose = np.asarray(glucose, dtype=float)
+    flag = np.where(np.isnan(glucose), np.nan, (glucose >= PREDIABETES_GLUCOSE).astype(float))
+    return _same_kind(flag, glucose)
+
+
+def build_feature_array(pregnancies, glucose, blood_pressure, insulin, bmi, dpf, age, out=None):
+    """
+    Matriz float (n, 10) en el orden de FEATURE_COLUMNS. Acepta escalares (n = 1) o columnas,
+    que se combinan por broadcasting. Con `out` se escribe en un array ya reservado.
+    """
+    columns = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in
+                                    (pregnancies, glucose, blood_pressure, insulin, bmi, dpf, age)))
+    n = columns[0].size
+    if out is None:
+        out = np.empty((n, len(FEATURE_COLUMNS)), dtype=float)
+    for j, column in enumerate(columns):
+        out[:, j] = column.ravel()
+    glucose_col, insulin_col, bmi_col = out[:, 1], out[:, 3], out[:, 4]
+    np.trunc(glucose_col * insulin_col, out=out[:, 7])
+    np.square(bmi_col, out=out[:, 8])
+    out[:, 9] = prediabetes_flag(glucose_col)
+    return out
+
+
+def feature_key(values):
+    """Tupla cuantizada de las 10 variables de un paciente, en el orden de FEATURE_COLUMNS."""
+    return tuple(round(float(v), d) for v, d in zip(values, FEATURE_DECIMALS))
+
+
+def build_feature_array_from_raw(raw):
+    """Matriz de variables a partir de un DataFrame (o dict de columnas) con RAW_COLUMNS."""
+    missing = [c for c in RAW_COLUMNS if c not in raw]
+    if missing:
+        raise ValueError(f"Faltan columnas en los datos de entrada: {', '.join(missing)}")
+    col = {c: pd.to_numeric(pd.Series(raw[c]), errors='coerce').to_numpy(dtype=float) for c in RAW_COLUMNS}
+    return build_feature_array(col['Pregnancies'], col['Glucose'], col['BloodPressure'], col['Insulin'],
+                               body_mass_index(col['Weight'], col['Height']), col['DPF'], col['Age'])
+
+
+def build_feature_frame(raw):
+    """Calcula BMI, Índice RI, BMI² y prediabetes sobre un DataFrame de datos clínicos."""
+    index = raw.index if isinstance(raw, pd.DataFrame) else None
+    return pd.DataFrame(build_feature_array_from_raw(raw), columns=FEATURE_COLUMNS, index=index)
@@ -0,0 +1,172 @@
+"""
+Resumen SHAP global precalculado sobre una cohorte de referencia.
+
+    python global_shap.py --data cohorte.csv [--n 5000] [--chunksize 500] [--workers 4]
+
+La cohorte de referencia son pacientes reales (datos clínicos del CSV, como en batch_scoring.py).
+Los valores SHAP se calculan por bloques en un pool de procesos (cada proceso carga el pipeline
+y su TreeExplainer una sola vez) y se guardan junto al modelo, en <modelo>_global_shap/:
+shap_values.npy y features.npy (float32, pacientes x variables), shap_sorted.npy (las mismas
+contribuciones ordenadas, una fila por variable) y un manifest.json con la huella del modelo.
+La app los abre con mmap_mode='r' para dibujar el beeswarm y situar al paciente en percentiles
+por variable (búsqueda binaria sobre shap_sorted) sin calcular SHAP de la cohorte.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from explain import SHAP_AVAILABLE, PipelineExplainer
+from fast_forest import file_sha256
+from features import FEATURE_COLUMNS, build_feature_frame
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos", "diabetes_rf_pipeline.pkl")
+FORMAT_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+DEFAULT_CHUNKSIZE = 500
+
+_worker_explainer = None
+
+
+def summary_dir_for(model_path):
+    """Directorio del resumen junto al modelo: modelos/x.pkl -> modelos/x_global_shap."""
+    return os.path.splitext(model_path)[0] + "_global_shap"
+
+
+def _init_worker(model_path):
+    """Cada proceso del pool carga el pipeline y construye el TreeExplainer una sola vez."""
+    global _worker_explainer
+    import joblib
+    _worker_explainer = PipelineExplainer(joblib.load(model_path), maxsize=1)
+
+
+def _explain_chunk(X):
+    """Tarea del pool: matriz de variables -> matriz SHAP (clase positiva) en float32."""
+    frame = pd.DataFrame(X, columns=FEATURE_COLUMNS)
+    return _worker_explainer.explain_batch(frame).astype(np.float32)
+
+
+def compute_global_shap(model_path, X, chunksize=DEFAULT_CHUNKSIZE, workers=None):
+    """Valores SHAP de todas las filas de X, por bloques en paralelo y en el orden de X."""
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    chunks = [X[start:start + chunksize] for start in range(0, X.shape[0], chunksize)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        return np.concatenate(list(pool.map(_explain_chunk, chunks)))
+
+
+def save_summary(directory, shap_values, features, manifest):
+    """Escribe las matrices .npy y el manifest.json (este al final: sin él el resumen no se usa)."""
+    os.makedirs(directory, exist_ok=True)
+    shap_values = np.ascontiguousarray(shap_values, dtype=np.float32)
+    np.save(os.path.join(directory, "shap_values.npy"), shap_values)
+    # Ordenado aquí, una vez: la app no tiene que copiar ni ordenar la matriz al cargarla
+    np.save(os.path.join(directory, "shap_sorted.npy"), np.ascontiguousarray(np.sort(shap_values.T, axis=1)))
+    np.save(os.path.join(directory, "features.npy"), np.ascontiguousarray(features, dtype=np.float32))
+    with open(os.path.join(directory, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+class GlobalShapSummary:
+    """Valores SHAP de la cohorte de referencia y percentiles por variable."""
+
+    def __init__(self, shap_values, features, sorted_values, manifest):
+        self.shap_values = shap_values
+        self.features = features
+        self.sorted_values = sorted_values  # Variables x pacientes, cada fila ordenada (shap_sorted.npy)
+        self.manifest = manifest
+        self.feature_names = manifest["feature_names"]
+        self.base_value = manifest["base_value"]
+
+    @property
+    def n_rows(self):
+        return self.shap_values.shape[0]
+
+    @classmethod
+    def load(cls, model_path, mmap_mode='r'):
+        """Resumen guardado junto al modelo, o None si no existe o se calculó con otro modelo."""
+        directory = summary_dir_for(model_path)
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("format_version") != FORMAT_VERSION or manifest.get("model_sha256") != file_sha256(model_path):
+                return None
+            shap_values = np.load(os.path.join(directory, "shap_values.npy"), mmap_mode=mmap_mode)
+            features = np.load(os.path.join(directory, "features.npy"), mmap_mode=mmap_mode)
+            sorted_values = np.load(os.path.join(directory, "shap_sorted.npy"), mmap_mode=mmap_mode)
+        except (OSError, ValueError):
+            return None
+        return cls(shap_values, features, sorted_values, manifest)
+
+    def percentiles(self, values):
+        """
+        Porcentaje de la cohorte con una contribución SHAP menor o igual que la del paciente, por
+        variable. Solo es comparable con contribuciones de SHAP exacto (como las de la cohorte).
+        """
+        values = np.asarray(values, dtype=self.sorted_values.dtype)
+        counts = [np.searchsorted(self.sorted_values[j], values[j], side='right') for j in range(values.shape[0])]
+        return 100.0 * np.asarray(counts) / self.n_rows
+
+
+def _reference_rows(data_path, n, seed):
+    """Cohorte de referencia: una muestra de n pacientes del CSV (datos clínicos)."""
+    X = build_feature_frame(pd.read_csv(data_path))
+    return X.sample(n=min(n, len(X)), random_state=seed).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precalcula los valores SHAP de una cohorte de referencia.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Ruta del pipeline (.pkl)")
+    parser.add_argument("--data", required=True, help="CSV con los datos clínicos de la cohorte de referencia")
+    parser.add_argument("--n", type=int, default=5000, help="Pacientes de la cohorte de referencia")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Pacientes por tarea del pool")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos (por defecto, uno por CPU)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if not SHAP_AVAILABLE:
+        print("Error: SHAP no está instalado", file=sys.stderr)
+        return 2
+    import joblib
+    try:
+        pipeline = joblib.load(args.model)
+        X = _reference_rows(args.data, args.n, args.seed)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    shap_values = compute_global_shap(args.model, X[FEATURE_COLUMNS].to_numpy(dtype=np.float64),
+                                      args.chunksize, args.workers)
+    elapsed = time.perf_counter() - start
+    base_value = PipelineExplainer(pipeline, maxsize=1).base_value
+    # Aditividad: base + suma de contribuciones = probabilidad del modelo
+    additivity = float(np.abs(base_value + shap_values.astype(np.float64).sum(axis=1)
+                              - np.asarray(pipeline.predict_proba(X))[:, 1]).max())
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "model_sha256": file_sha256(args.model),
+        "data": os.path.basename(args.data),
+        "n_rows": int(shap_values.shape[0]),
+        "feature_names": list(FEATURE_COLUMNS),
+        "base_value": base_value,
+        "additivity_max_abs_diff": additivity,
+        "elapsed_s": round(elapsed, 2),
+    }
+    output = summary_dir_for(args.model)
+    save_summary(output, shap_values, X[FEATURE_COLUMNS].to_numpy(dtype=np.float32), manifest)
+    print(f"{shap_values.shape[0]} pacientes explicados en {elapsed:.1f} s "
+          f"(aditividad: máx. {additivity:.1e}). Resumen en {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Historial local de evaluaciones en SQLite: cada CALCULAR RIESGO queda guardado por paciente y fecha.
+
+Las escrituras se encolan y un hilo propio las agrupa en una sola transacción (MicroBatcher),
+de modo que la app no espera al disco. La base está en modo WAL: las lecturas no se bloquean
+mientras se escribe, y la consulta de un paciente recorre solo el índice (patient_id, eval_date),
+así que sigue en milisegundos con millones de evaluaciones guardadas.
+"""
+import os
+import sqlite3
+import threading
+
+from batching import MicroBatcher
+
+INPUT_COLUMNS = ('pregnancies', 'glucose', 'blood_pressure', 'insulin', 'weight', 'height', 'bmi', 'dpf', 'age')
+COLUMNS = ('patient_id', 'eval_date', 'created_at', 'prob', 'threshold', 'high_risk') + INPUT_COLUMNS + ('model_version',)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    eval_date TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    prob REAL NOT NULL,
+    threshold REAL NOT NULL,
+    high_risk INTEGER NOT NULL,
+    {', '.join(f'{c} REAL' for c in INPUT_COLUMNS)},
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_evaluations_patient_date ON evaluations (patient_id, eval_date, created_at);
+"""
+_INSERT = f"INSERT INTO evaluations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+_SELECT = f"""
+SELECT {', '.join(COLUMNS)} FROM evaluations
+WHERE patient_id = ? ORDER BY eval_date DESC, created_at DESC LIMIT ?
+"""
+
+
+class HistoryStore:
+    """Evaluaciones guardadas: record() encola y vuelve al momento; visits() lee por índice."""
+
+    def __init__(self, path, max_batch_size=512, max_wait_ms=20.0, max_queue=10000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        # Bases creadas antes de guardar la versión del modelo
+        if 'model_version' not in {row[1] for row in conn.execute("PRAGMA table_info(evaluations)")}:
+            conn.execute("ALTER TABLE evaluations ADD COLUMN model_version TEXT")
+            conn.commit()
+        conn.close()
+        self._local = threading.local()
+        self._writer = None  # Conexión propia del hilo escritor (se abre en ese hilo)
+        self.failures = 0  # Entradas que no llegaron a escribirse (el Future recibió la excepción)
+        self.last_error = None
+        self.batcher = MicroBatcher(self._write_batch, max_batch_size, max_wait_ms, max_queue, name="history-writer")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # En WAL no se corrompe; como mucho se pierde la última transacción
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, evaluation):
+        """
+        Encola una evaluación (dict con COLUMNS) y devuelve su Future sin esperar a la escritura.
+        Lanza QueueFullError si el escritor va tan atrasado que la cola está llena.
+        """
+        future = self.batcher.submit(tuple(evaluation[c] for c in COLUMNS))
+        future.add_done_callback(self._count_failure)
+        return future
+
+    def _count_failure(self, future):
+        """Evaluaciones que no llegaron a disco: nadie espera su Future, así que se cuentan aquí."""
+        if not future.cancelled() and future.exception() is not None:
+            self.failures += 1
+            self.last_error = f"{type(future.exception()).__name__}: {future.exception()}"
+
+    def _write_batch(self, rows):
+        if self._writer is None:
+            self._writer = self._connect()
+        with self._writer:  # Una transacción por lote
+            self._writer.executemany(_INSERT, rows)
+        return [True] * len(rows)
+
+    def visits(self, patient_id, limit=200):
+        """Últimas `limit` evaluaciones del paciente, de la más antigua a la más reciente."""
+        rows = self._reader().execute(_SELECT, (patient_id, limit)).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def close(self, timeout=None):
+        """Escribe lo que quede en la cola y cierra la conexión del escritor."""
+        self.batcher.close(timeout)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,202 @@
+"""
+Registro de versiones del modelo: descubre los pipelines .pkl de modelos/ y los carga al primer uso.
+
+Como mucho max_loaded versiones (y, si se fija, max_bytes de memoria medida) quedan cargadas;
+al pasarse se expulsa la usada hace más tiempo. La versión activa se lee en cada petición del
+fichero ACTIVE del directorio y se cambia con un os.replace atómico de ese fichero:
+
+    python registry.py --list
+    python registry.py --activate diabetes_rf_pipeline_v2
+
+Los reruns siguientes usan la versión nueva sin reiniciar el servidor; los que están en marcha
+terminan con el modelo que ya tenían (la expulsión solo suelta la referencia del registro).
+Sobrescribir un .pkl con otro contenido también cuenta como versión nueva (cambia su mtime).
+"""
+import argparse
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from warmup import HEAVY_MODULES, ModelWarmup
+
+ACTIVE_FILE = "ACTIVE"
+MODEL_SUFFIX = ".pkl"
+
+ModelVersion = namedtuple("ModelVersion", "name path bundle_dir mtime size")
+
+
+def bundle_dir_for(model_path):
+    """Directorio del bundle .npy de un pipeline (export_model.py): modelos/x.pkl -> modelos/x_bundle."""
+    return os.path.splitext(model_path)[0] + "_bundle"
+
+
+def _owned_nbytes(array):
+    """Bytes de un array en memoria propia (los mapeados desde disco se comparten y no cuentan)."""
+    import numpy as np
+    if isinstance(array, np.memmap) or isinstance(getattr(array, 'base', None), np.memmap):
+        return 0
+    return array.nbytes
+
+
+def pipeline_nbytes(pipeline):
+    """Memoria de los árboles del pipeline: arrays de nodos y de valores de cada estimador del bosque."""
+    total = 0
+    forest = getattr(pipeline, 'named_steps', {}).get('model') if pipeline is not None else None
+    for estimator in getattr(forest, 'estimators_', ()):
+        state = estimator.tree_.__getstate__()
+        total += state['nodes'].nbytes + state['values'].nbytes
+    return total
+
+
+def engine_nbytes(engine):
+    """Memoria propia del motor compilado (sin contar los arrays mapeados desde el bundle)."""
+    return sum(_owned_nbytes(getattr(engine, name)) for name in
+               ('impute_values', 'scale_mean', 'scale_scale', 'feature', 'threshold', 'children', 'value', 'roots'))
+
+
+def measure_nbytes(handle):
+    """Memoria medida de una versión cargada: árboles del pipeline y arrays del motor."""
+    engine = handle.engine
+    return pipeline_nbytes(handle.model) + (engine_nbytes(engine) if engine is not None else 0)
+
+
+class ModelRegistry:
+    """Versiones del modelo de un directorio, cargadas bajo demanda y expulsadas por LRU."""
+
+    def __init__(self, directory, default=None, max_loaded=2, max_bytes=None, modules=HEAVY_MODULES):
+        if max_loaded <= 0:
+            raise ValueError("max_loaded debe ser positivo")
+        self.directory = directory
+        self.default = default
+        self.max_loaded = max_loaded
+        self.max_bytes = max_bytes
+        self.modules = modules
+        self.loads = 0
+        self.evictions = 0
+        self._loaded = OrderedDict()  # (nombre, mtime) -> ModelWarmup
+        self._sizes = {}  # (nombre, mtime, pipeline cargado, motor cargado) -> bytes
+        self._lock = threading.Lock()
+
+    def versions(self):
+        """Pipelines disponibles en el directorio, por nombre (sin la extensión)."""
+        found = {}
+        try:
+            entries = os.scandir(self.directory)
+        except FileNotFoundError:
+            return found
+        with entries:
+            for entry in entries:
+                if entry.name.endswith(MODEL_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    name = entry.name[:-len(MODEL_SUFFIX)]
+                    found[name] = ModelVersion(name, entry.path, bundle_dir_for(entry.path), stat.st_mtime_ns, stat.st_size)
+        return dict(sorted(found.items()))
+
+    def _read_active(self):
+        try:
+            with open(os.path.join(self.directory, ACTIVE_FILE), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def active_name(self, versions=None):
+        """Versión activa: la de ACTIVE, si no la de por defecto y si no la más reciente (None si no hay ninguna)."""
+        versions = self.versions() if versions is None else versions
+        for name in (self._read_active(), self.default):
+            if name in versions:
+                return name
+        return max(versions.values(), key=lambda v: v.mtime).name if versions else None
+
+    def activate(self, name):
+        """Cambia la versión activa de todo el servidor (reemplazo atómico del fichero ACTIVE)."""
+        if name not in self.versions():
+            raise ValueError(f"Versión desconocida: {name}")
+        path = os.path.join(self.directory, ACTIVE_FILE)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(name + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def get(self, name=None):
+        """
+        Modelo de la versión pedida (la activa si no se indica), como ModelWarmup: la primera vez
+        empieza a cargarse en segundo plano. None si no hay ningún pipeline en el directorio.
+        """
+        versions = self.versions()
+        name = name or self.active_name(versions)
+        if name is None:
+            return None
+        if name not in versions:
+            raise ValueError(f"Versión desconocida: {name}")
+        version = versions[name]
+        key = (name, version.mtime)
+        with self._lock:
+            handle = self._loaded.get(key)
+            if handle is not None:
+                self._loaded.move_to_end(key)
+                self._evict()  # Lo que midan las versiones que han terminado de cargar desde la última vez
+                return handle
+            # La huella del pickle (etiqueta de la versión) se calcula en el hilo de precarga, no aquí
+            handle = ModelWarmup(version.path, version.bundle_dir, self.modules, label=True).start()
+            self._loaded[key] = handle
+            self.loads += 1
+            self._evict()
+        return handle
+
+    def _nbytes(self, key, handle):
+        size_key = key + (handle.model is not None, handle.engine is not None)
+        if size_key not in self._sizes:
+            self._sizes[size_key] = measure_nbytes(handle) if handle.ready else 0
+        return self._sizes[size_key]
+
+    def _evict(self):
+        """Expulsa las menos usadas hasta cumplir los límites; la recién pedida (la última) siempre se queda."""
+        while len(self._loaded) > 1:
+            over_bytes = self.max_bytes is not None and \
+                sum(self._nbytes(k, h) for k, h in self._loaded.items()) > self.max_bytes
+            if len(self._loaded) <= self.max_loaded and not over_bytes:
+                break
+            key, _ = self._loaded.popitem(last=False)
+            self._sizes = {k: v for k, v in self._sizes.items() if k[:2] != key}
+            self.evictions += 1
+
+    def stats(self):
+        """Versiones en memoria (de la menos a la más usada) con su memoria medida."""
+        with self._lock:
+            # Una versión que aún se está cargando se muestra por su nombre (no se espera a su huella)
+            loaded = [{"version": h.version if h.ready else os.path.basename(h.model_path), "ready": h.ready,
+                       "nbytes": self._nbytes(k, h)}
+                      for k, h in self._loaded.items()]
+        return {"loaded": loaded, "loads": self.loads, "evictions": self.evictions,
+                "max_loaded": self.max_loaded, "max_bytes": self.max_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lista las versiones del modelo o cambia la activa.")
+    parser.add_argument("--dir", default="modelos", help="Directorio de los pipelines (.pkl)")
+    parser.add_argument("--default", default="diabetes_rf_pipeline", help="Versión si no hay fichero ACTIVE")
+    parser.add_argument("--activate", metavar="NOMBRE", help="Versión que pasa a ser la activa")
+    parser.add_argument("--list", action="store_true", help="Muestra las versiones disponibles")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.dir, default=args.default)
+    if args.activate:
+        try:
+            registry.activate(args.activate)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Versión activa: {args.activate}")
+    if args.list or not args.activate:
+        versions = registry.versions()
+        active = registry.active_name(versions)
+        for version in versions.values():
+            bundle = "bundle" if os.path.isdir(version.bundle_dir) else "-"
+            print(f"{'*' if version.name == active else ' '} {version.name:<40} {version.size / 1024:>9.0f} KB  {bundle}")
+        if not versions:
+            print(f"No hay pipelines {MODEL_SUFFIX} en {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
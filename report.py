@@ -0,0 +1,201 @@
+"""
+Informe clínico HTML descargable de un paciente.
+
+La maqueta se compila una sola vez por color de riesgo: el HTML estático queda partido en
+segmentos y cada informe solo intercala sus valores (útil para generar miles en lote).
+"""
+from functools import lru_cache
+
+C_DARK = "#2C3E50"
+C_PINK = "#E97F87"
+C_TEAL = "#4DB6AC"
+C_GRAY = "#bdc3c7"
+C_BG_HEAD = "#F8F9FA"
+
+# Nombres legibles de las variables en la tabla SHAP
+FEATURE_LABELS = {
+    'Indice_resistencia': 'Índice RI',
+    'BMI_square': 'BMI² (No lineal)',
+    'BloodPressure': 'Presión Arterial',
+    'Pregnancies': 'Embarazos',
+    'Age': 'Edad',
+    'Glucose': 'Glucosa 2h',
+    'Insulin': 'Insulina',
+    'Is_prediabetes': 'Prediabetes Detectada',
+}
+
+_INPUT_ROW = "<tr><td style='padding:8px; border-bottom:1px solid #eee; color:#666;'>{}</td><td style='padding:8px; border-bottom:1px solid #eee; font-weight:bold; color:" + C_DARK + "; text-align:right;'>{}</td></tr>"
+
+_SHAP_ROW = """
+                                <tr>
+                                    <td style='padding:6px; border-bottom:1px solid #eee; font-weight:500;'>{}</td>
+                                    <td style='padding:6px; border-bottom:1px solid #eee; text-align:center; color:#666;'>{:.2f}</td>
+                                    <td style='padding:6px; border-bottom:1px solid #eee; text-align:right; font-weight:bold; color:{};'>
+                                        {}{:.3f} (log-odds)
+                                    </td>
+                                </tr>
+                            """
+
+_SLOT = "\x00"
+_SLOTS = ("patient_name", "date_str", "prob_text", "risk_label", "shap_section_html", "recommendation", "inputs_rows")
+
+
+def _layout(risk_color, patient_name, date_str, prob_text, risk_label, shap_section_html, recommendation, inputs_rows):
+    c_dark, c_pink, c_gray, c_bg_head = C_DARK, C_PINK, C_GRAY, C_BG_HEAD
+    return f"""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: 'Helvetica', sans-serif; color: #333; padding: 40px; max-width: 800px; margin: 0 auto; }}
+            .header {{ text-align: center; margin-bottom: 30px; border-bottom: 2px solid {c_pink}; padding-bottom: 20px; }}
+            /* ESTILOS DEL LOGO EXACTOS */
+            .logo {{ font-size: 26px; font-weight: 800; color: {c_dark}; letter-spacing: -1px; }}
+            .logo span.pink {{ color: {c_pink}; }}
+            .logo span.gray {{ color: {c_gray}; }}
+            
+            .meta {{ font-size: 11px; color: #999; margin-top: 5px; text-transform: uppercase; letter-spacing: 1px; }}
+            .patient-info {{ background: {c_bg_head}; padding: 15px; border-radius: 8px; margin-bottom: 30px; display: flex; justify-content: space-between; }}
+            .section {{ margin-bottom: 30px; }}
+            .section-title {{ color: {c_dark}; font-size: 14px; font-weight: 800; text-transform: uppercase; margin-bottom: 12px; border-left: 4px solid {c_pink}; padding-left: 10px; }}
+            .risk-box {{ padding: 25px; background: {risk_color}15; border-radius: 12px; border: 2px solid {risk_color}; text-align: center; margin-bottom: 30px; }}
+            .risk-val {{ font-size: 42px; font-weight: 900; color: {risk_color}; line-height: 1; }}
+            .risk-txt {{ font-size: 16px; font-weight: 800; color: {c_dark}; text-transform: uppercase; margin-top: 10px; }}
+            .rec-box {{ background: #fff; border: 1px solid #ddd; padding: 15px; border-radius: 8px; font-size: 13px; line-height: 1.5; border-left: 4px solid {risk_color}; }}
+            table {{ width: 100%; border-collapse: collapse; font-size: 13px; }}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <div class="logo">D<span class="pink">IA</span>BETES<span class="gray">.</span><span class="pink">NME</span></div>
+            <div class="meta">Clinical Decision Support System Report</div>
+        </div>
+        
+        <div class="patient-info">
+            <div><span style="color:#999; font-size:11px;">PACIENTE:</span><br><strong>{patient_name}</strong></div>
+            <div style="text-align:right;"><span style="color:#999; font-size:11px;">FECHA:</span><br><strong>{date_str}</strong></div>
+        </div>
+
+        <div class="risk-box">
+            <div class="risk-val">{prob_text}</div>
+            <div class="risk-txt">{risk_label}</div>
+            <div style="font-size:12px; color:#777; margin-top:8px; font-weight:500;">Probabilidad estimada de Diabetes Tipo 2</div>
+        </div>
+
+        {shap_section_html}
+
+        <div class="section">
+            <div class="section-title">Protocolo de Acción Recomendado</div>
+            <div class="rec-box">
+                <strong>Intervención Sugerida:</strong><br>
+                {recommendation}
+            </div>
+        </div>
+
+        <div class="section">
+            <div class="section-title">Datos Clínicos Registrados</div>
+            <table>
+                {inputs_rows}
+            </table>
+        </div>
+
+        <div style="font-size:10px; color:#aaa; text-align:center; margin-top:50px; border-top:1px solid #eee; padding-top:15px; line-height:1.4;">
+            Documento generado automáticamente por el prototipo DIABETES.NME.<br>
+            Herramienta de soporte a la decisión clínica desarrollada con fines académicos. <strong>No sustituye el criterio médico profesional.</strong><br>
+            <strong style="color:{c_dark};">TFM Desarrollado por: Nerea Moreno Escamilla</strong> | CEMP 2025
+        </div>
+    </body>
+    </html>
+    """
+
+
+def _shap_section(shap_rows_html, explanation_note=None):
+    note_html = f"""    <p style="font-size:11px; color:#999; font-style:italic; margin-top:8px;">{explanation_note}</p>
+        """ if explanation_note else ""
+    return f"""
+        <div class="section">
+            <div class="section-title">Análisis Individual: Factores Determinantes (SHAP)</div>
+            <p style="font-size:12px; color:#666; margin-bottom:15px;">Desglose de las variables que más han influido (positiva o negativamente) en el cálculo del riesgo para este paciente concreto.</p>
+            <table style="width:100%; font-size:12px;">
+                <thead>
+                    <tr style="background:#eee; color:#777;">
+                        <th style="padding:8px; text-align:left;">Variable Clínica</th>
+                        <th style="padding:8px; text-align:center;">Valor Paciente</th>
+                        <th style="padding:8px; text-align:right;">Contribución al Riesgo</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {shap_rows_html}
+                </tbody>
+            </table>
+        {note_html}</div>
+        """
+
+
+class ReportTemplate:
+    """Maqueta del informe ya partida en segmentos estáticos y huecos para un color de riesgo."""
+
+    def __init__(self, risk_color):
+        marked = _layout(risk_color, *(f"{_SLOT}{name}{_SLOT}" for name in _SLOTS))
+        parts = marked.split(_SLOT)
+        self.static = parts[0::2]
+        self.slots = parts[1::2]
+
+    def render(self, **values):
+        out = [self.static[0]]
+        for slot, static in zip(self.slots, self.static[1:]):
+            out.append(values[slot])
+            out.append(static)
+        return "".join(out)
+
+
+@lru_cache(maxsize=None)
+def get_template(risk_color):
+    return ReportTemplate(risk_color)
+
+
+MESES_ES = {1: "Ene", 2: "Feb", 3: "Mar", 4: "Abr", 5: "May", 6: "Jun",
+            7: "Jul", 8: "Ago", 9: "Sep", 10: "Oct", 11: "Nov", 12: "Dic"}
+
+
+def format_date(date):
+    return f"{date.day} {MESES_ES[date.month]} {date.year}"
+
+
+def risk_label_for(is_high):
+    return "ALTO RIESGO" if is_high else "BAJO RIESGO"
+
+
+def recommendation_for(glucose, prob, threshold):
+    """Protocolo de acción según la glucosa y la distancia de la probabilidad al umbral."""
+    is_high = prob > threshold
+    distancia_al_corte = abs(prob - threshold)
+    if glucose >= 200: return "Protocolo de confirmación diagnóstica urgente. Descartar cetoacidosis."
+    elif is_high and distancia_al_corte > 0.05: return "Derivación a Endocrinología. Solicitar HbA1c y perfil lipídico. Valorar inicio de metformina."
+    elif not is_high and distancia_al_corte <= 0.05: return "Repetir TTOG en 3-6 meses. Monitorización estrecha de glucemia basal."
+    else: return "Seguimiento rutinario anual según guías locales. Mantener estilos de vida saludables."
+
+
+def shap_rows_html(rows):
+    """Filas de la tabla SHAP a partir de (variable, valor, impacto), ya ordenadas."""
+    out = []
+    for feature, value, impact in rows:
+        # Color: Rojo si aumenta riesgo, Verde si disminuye
+        color = "#C0392B" if impact > 0 else "#27AE60"
+        sign = "+" if impact > 0 else ""
+        out.append(_SHAP_ROW.format(FEATURE_LABELS.get(feature, feature), value, color, sign, impact))
+    return "".join(out)
+
+
+def create_html_report(patient_name, date_str, prob, risk_label, inputs_dict, shap_rows_html, recommendation,
+                       explanation_note=None):
+    """Genera un informe HTML completo con logo correcto y tabla SHAP (y, si se indica, el método de explicación)."""
+    risk_color = C_PINK if "ALTO" in risk_label else C_TEAL
+    return get_template(risk_color).render(
+        patient_name=patient_name,
+        date_str=date_str,
+        prob_text=f"{prob*100:.1f}%",
+        risk_label=risk_label,
+        shap_section_html=_shap_section(shap_rows_html, explanation_note) if shap_rows_html else "",
+        recommendation=recommendation,
+        inputs_rows="".join(_INPUT_ROW.format(k, v) for k, v in inputs_dict.items()),
+    )
@@ -0,0 +1,58 @@
+"""
+Análisis de sensibilidad del paciente actual: cada variable clínica se recorre en el rango de
+su deslizador con el resto fijo, y todos los barridos se puntúan en una sola llamada al modelo.
+"""
+import numpy as np
+import pandas as pd
+
+from features import RAW_COLUMNS, build_feature_frame
+
+# Rangos de los deslizadores de input_biomarker en la barra lateral
+SLIDER_RANGES = {
+    'Pregnancies': (0, 20),
+    'Glucose': (50, 350),
+    'BloodPressure': (0, 150),
+    'Insulin': (0, 900),
+    'Weight': (30.0, 250.0),
+    'Height': (1.00, 2.20),
+    'DPF': (0.0, 2.5),
+    'Age': (18, 90),
+}
+
+# Variables que la app solo admite como enteros
+INTEGER_COLUMNS = {'Pregnancies', 'Glucose', 'BloodPressure', 'Insulin', 'Age'}
+
+
+def sweep_values(column, current, n_points=200):
+    """Puntos del barrido de una variable; incluye el valor del paciente para que su punto sea exacto."""
+    low, high = SLIDER_RANGES[column]
+    values = np.linspace(low, high, n_points)
+    if column in INTEGER_COLUMNS:
+        values = np.round(values)
+    return np.union1d(values, [current])
+
+
+def sweep_frame(patient, n_points=200):
+    """
+    Datos clínicos de todos los barridos apilados (una fila por punto) y, por variable,
+    el slice de filas que le corresponde con sus valores.
+    """
+    blocks, sweeps, start = [], {}, 0
+    for column in RAW_COLUMNS:
+        values = sweep_values(column, patient[column], n_points)
+        block = pd.DataFrame({c: np.full(len(values), float(patient[c])) for c in RAW_COLUMNS})
+        block[column] = values
+        blocks.append(block)
+        sweeps[column] = (slice(start, start + len(values)), values)
+        start += len(values)
+    return pd.concat(blocks, ignore_index=True), sweeps
+
+
+def sensitivity_curves(predictor, patient, n_points=200):
+    """
+    Curvas {variable: (valores, probabilidades)} para un paciente dado como dict de RAW_COLUMNS.
+    Las variables derivadas (BMI, Índice RI, BMI², prediabetes) se recalculan en cada punto.
+    """
+    raw, sweeps = sweep_frame(patient, n_points)
+    prob = np.asarray(predictor.predict_proba(build_feature_frame(raw)))[:, 1]
+    return {column: (values, prob[rows]) for column, (rows, values) in sweeps.items()}
@@ -0,0 +1,236 @@
+"""
+Servicio HTTP local de puntuación (sin Streamlit) para integraciones como la HCE.
+
+Reutiliza la carga del modelo de la app (bundle mmap o pipeline) y el mismo cálculo de
+variables derivadas. Las peticiones concurrentes que llegan con pocos milisegundos de
+diferencia se agrupan en una única llamada a predict_proba (micro-batching), y las
+colas tienen un tamaño máximo: cuando se llenan el servicio responde 503 (backpressure), y una
+lista con más pacientes que el tamaño de la cola se rechaza de entrada con 413.
+
+Uso:
+    python service.py [--host 127.0.0.1] [--port 8502] [--max-batch 256] [--max-wait-ms 5] [--max-queue 4096]
+
+Endpoints:
+    POST /predict   {"Pregnancies": 2, "Glucose": 150, "BloodPressure": 70, "Insulin": 100,
+                     "Weight": 80, "Height": 1.65, "DPF": 0.5, "Age": 45}  (o una lista de pacientes)
+    POST /explain   igual que /predict, con las contribuciones SHAP de cada variable
+    GET  /health
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from batching import MicroBatcher, QueueFullError
+from explain import PipelineExplainer
+from features import DEFAULT_THRESHOLD, FEATURE_COLUMNS, RAW_COLUMNS, body_mass_index, build_feature_array
+from warmup import ModelWarmup
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos")
+MODEL_PATH = os.path.join(MODELS_DIR, "diabetes_rf_pipeline.pkl")
+BUNDLE_DIR = os.path.join(MODELS_DIR, "diabetes_rf_pipeline_bundle")
+
+MAX_BODY_BYTES = 1 << 20
+REQUEST_TIMEOUT = 10.0
+
+
+def parse_patient(data):
+    """Valida un paciente del JSON de entrada. Los valores null se dejan al imputer del pipeline."""
+    if not isinstance(data, dict):
+        raise ValueError("Cada paciente debe ser un objeto JSON")
+    missing = [c for c in RAW_COLUMNS if c not in data]
+    if missing:
+        raise ValueError(f"Faltan campos: {', '.join(missing)}")
+    patient = {}
+    for column in RAW_COLUMNS:
+        value = data[column]
+        if value is None:
+            patient[column] = math.nan
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            patient[column] = float(value)
+        else:
+            raise ValueError(f"Valor no numérico en {column}")
+    return patient
+
+
+class ScoringService:
+    """Modelo compartido y un batcher por endpoint."""
+
+    def __init__(self, model_path=MODEL_PATH, bundle_dir=BUNDLE_DIR, threshold=DEFAULT_THRESHOLD,
+                 max_batch_size=256, max_wait_ms=5.0, max_queue=4096):
+        self.threshold = threshold
+        self.loader = ModelWarmup(model_path, bundle_dir, modules=()).start()
+        self.engine = self.loader.load_engine()
+        if self.engine is None and self.loader.load_pipeline() is None:
+            raise FileNotFoundError(f"No se encontró el modelo en {model_path}")
+        self._explainer = None
+        self._explainer_lock = threading.Lock()
+        self.predict_batcher = MicroBatcher(self._predict_batch, max_batch_size, max_wait_ms, max_queue, name="predict-batcher")
+        self.explain_batcher = MicroBatcher(self._explain_batch, max_batch_size, max_wait_ms, max_queue, name="explain-batcher")
+
+    def explainer(self):
+        """PipelineExplainer creado la primera vez que se pide una explicación."""
+        with self._explainer_lock:
+            if self._explainer is None:
+                self._explainer = PipelineExplainer(self.loader.load_pipeline())
+            return self._explainer
+
+    def _score(self, patients):
+        """Matriz de variables construida directamente desde los dicts; el motor compilado la usa tal cual."""
+        col = {c: np.fromiter((p[c] for p in patients), dtype=float, count=len(patients)) for c in RAW_COLUMNS}
+        features = build_feature_array(col['Pregnancies'], col['Glucose'], col['BloodPressure'], col['Insulin'],
+                                       body_mass_index(col['Weight'], col['Height']), col['DPF'], col['Age'])
+        if self.engine is not None:
+            return features, np.asarray(self.engine.predict_proba(features))[:, 1]
+        frame = pd.DataFrame(features, columns=FEATURE_COLUMNS)  # El pipeline se entrenó con nombres de columna
+        return features, np.asarray(self.loader.load_pipeline().predict_proba(frame))[:, 1]
+
+    def _result(self, prob):
+        return {"prob_diabetes": float(prob), "alto_riesgo": bool(prob > self.threshold), "threshold": self.threshold}
+
+    def _predict_batch(self, patients):
+        _, probs = self._score(patients)
+        return [self._result(p) for p in probs]
+
+    def _explain_batch(self, patients):
+        features, probs = self._score(patients)
+        explainer = self.explainer()
+        contributions = explainer.explain_many(pd.DataFrame(features, columns=FEATURE_COLUMNS))
+        results = []
+        for prob, row in zip(probs, contributions):
+            result = self._result(prob)
+            result["base_value"] = explainer.base_value
+            result["contributions"] = {name: float(v) for name, v in zip(FEATURE_COLUMNS, row)}
+            results.append(result)
+        return results
+
+    def health(self):
+        return {
+            "status": "ok",
+            "engine": "compiled" if self.engine is not None else "pipeline",
+            "predict": self.predict_batcher.stats(),
+            "explain": self.explain_batcher.stats(),
+        }
+
+    def close(self):
+        self.predict_batcher.close()
+        self.explain_batcher.close()
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    server_version = "DiabetesNME/1.0"
+    verbose = False
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, self.server.service.health())
+        else:
+            self._send(404, {"error": "Ruta no encontrada"})
+
+    def do_POST(self):
+        batchers = {"/predict": self.server.service.predict_batcher, "/explain": self.server.service.explain_batcher}
+        batcher = batchers.get(self.path)
+        if batcher is None:
+            self._send(404, {"error": "Ruta no encontrada"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Sin una longitud válida no se sabe cuánto leer: rfile.read(-1) esperaría a que el cliente cierre
+            self._send(400, {"error": "Content-Length no válido"})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send(413, {"error": "Petición demasiado grande"})
+            return
+        try:
+            data = json.loads(self.rfile.read(length) or b"null")
+            many = isinstance(data, list)
+            patients = [parse_patient(p) for p in (data if many else [data])]
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+
+        if len(patients) > batcher.max_queue:
+            # No cabría ni con la cola vacía: reintentar (503) no serviría de nada
+            self._send(413, {"error": f"Demasiados pacientes en una petición ({len(patients)}); "
+                                      f"el máximo es {batcher.max_queue}, divida la lista"})
+            return
+        try:
+            futures = [batcher.submit(p) for p in patients]
+        except QueueFullError as e:
+            self._send(503, {"error": str(e)}, {"Retry-After": "1"})
+            return
+        try:
+            results = [f.result(timeout=REQUEST_TIMEOUT) for f in futures]
+        except TimeoutError:
+            self._send(504, {"error": "Tiempo de espera agotado"})
+            return
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+        self._send(200, results if many else results[0])
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # backlog de conexiones (el valor por defecto, 5, se queda corto con ráfagas)
+
+
+def make_server(service, host="127.0.0.1", port=8502):
+    server = ScoringServer((host, port), ScoringHandler)
+    server.service = service
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de puntuación con micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--model", default=MODEL_PATH, help="Ruta del pipeline (.pkl)")
+    parser.add_argument("--bundle", default=BUNDLE_DIR, help="Directorio del bundle .npy")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Umbral de decisión")
+    parser.add_argument("--max-batch", type=int, default=256, help="Pacientes máximos por lote")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Espera máxima para completar un lote")
+    parser.add_argument("--max-queue", type=int, default=4096, help="Peticiones en cola antes de responder 503")
+    parser.add_argument("--verbose", action="store_true", help="Registrar cada petición")
+    args = parser.parse_args(argv)
+
+    ScoringHandler.verbose = args.verbose
+    service = ScoringService(args.model, args.bundle, args.threshold, args.max_batch, args.max_wait_ms, args.max_queue)
+    server = make_server(service, args.host, args.port)
+    print(f"Servicio escuchando en http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""Gráficos SVG en línea generados directamente a partir de los números (sin Matplotlib)."""
+import math
+from functools import lru_cache
+
+import numpy as np
+
+# Geometría del donut (mismas proporciones que el pie de Matplotlib con width=0.15)
+_RING_RADIUS = 0.925
+_RING_WIDTH = 0.15
+_RING_LENGTH = 2 * math.pi * _RING_RADIUS
+
+# Lienzo del gráfico de calibración
+_CAL_W, _CAL_H = 600, 250
+_CAL_LEFT, _CAL_RIGHT, _CAL_TOP, _CAL_BOTTOM = 10, 590, 10, 215
+_CAL_XMIN, _CAL_XMAX = -0.2, 1.25
+
+
+def donut_svg(prob, threshold, risk_color, dark_color, show_prob=True):
+    """Donut de probabilidad con la marca discontinua del umbral de decisión."""
+    parts = [f'<svg viewBox="-1.2 -1.2 2.4 2.4" xmlns="http://www.w3.org/2000/svg" style="width:100%; display:block;">']
+    if show_prob:
+        arc = _RING_LENGTH * min(1.0, max(0.0, float(prob)))
+        parts.append(f'<circle r="{_RING_RADIUS}" fill="none" stroke="#F4F6F9" stroke-width="{_RING_WIDTH}"/>')
+        # El trazo del círculo empieza a las 3 en punto y avanza en sentido horario: se gira -90º
+        parts.append(f'<circle r="{_RING_RADIUS}" fill="none" stroke="{risk_color}" stroke-width="{_RING_WIDTH}" '
+                     f'stroke-dasharray="{arc:.4f} {_RING_LENGTH:.4f}" transform="rotate(-90)"/>')
+        theta = math.radians(90 - float(threshold) * 360)
+        x1, y1 = 0.85 * math.cos(theta), -0.85 * math.sin(theta)
+        x2, y2 = 1.15 * math.cos(theta), -1.15 * math.sin(theta)
+        parts.append(f'<line x1="{x1:.4f}" y1="{y1:.4f}" x2="{x2:.4f}" y2="{y2:.4f}" stroke="{dark_color}" '
+                     f'stroke-width="0.03" stroke-dasharray="0.08 0.04"/>')
+    else:
+        parts.append(f'<circle r="{_RING_RADIUS}" fill="none" stroke="#EEEEEE" stroke-width="{_RING_WIDTH}"/>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def _cal_x(value):
+    return _CAL_LEFT + (value - _CAL_XMIN) / (_CAL_XMAX - _CAL_XMIN) * (_CAL_RIGHT - _CAL_LEFT)
+
+
+def _density_paths(x, y_sanos, y_enfermos):
+    """Trazados (área y línea) de las densidades de ambas clases, con la misma escala vertical."""
+    y_max = max(y_sanos.max(), y_enfermos.max(), 1e-9) * 1.05
+
+    def paths(y):
+        px = _cal_x(x)
+        py = _CAL_BOTTOM - y / y_max * (_CAL_BOTTOM - _CAL_TOP)
+        line = 'M' + ' L'.join(f'{a:.1f},{b:.1f}' for a, b in zip(px, py))
+        area = f'{line} L{px[-1]:.1f},{_CAL_BOTTOM} L{px[0]:.1f},{_CAL_BOTTOM} Z'
+        return area, line
+
+    return paths(y_sanos), paths(y_enfermos)
+
+
+@lru_cache(maxsize=1)
+def _calibration_paths():
+    """Densidades sintéticas de ambas clases (sin conjunto de validación). No dependen del umbral."""
+    x = np.linspace(-0.15, 1.25, 120)
+    y_sanos = 1.9 * np.exp(-((x - 0.1)**2) / (2 * 0.11**2)) + \
+              0.5 * np.exp(-((x - 0.55)**2) / (2 * 0.15**2))
+    y_enfermos = 0.35 * np.exp(-((x - 0.28)**2) / (2 * 0.1**2)) + \
+                 1.4 * np.exp(-((x - 0.68)**2) / (2 * 0.16**2))
+    return _density_paths(x, y_sanos, y_enfermos)
+
+
+def calibration_svg(threshold, optimal_threshold, pink_color, dark_color, optimal_color, densities=None):
+    """
+    Densidades de ambas clases con el umbral óptimo y el seleccionado por el usuario.
+    densities = (x, y_sanos, y_enfermos) de un conjunto de validación; sin él se dibujan las sintéticas.
+    """
+    if densities is None:
+        (sanos_area, sanos_line), (enf_area, enf_line) = _calibration_paths()
+    else:
+        (sanos_area, sanos_line), (enf_area, enf_line) = _density_paths(*densities)
+    x_opt = _cal_x(optimal_threshold)
+    x_sel = _cal_x(float(threshold))
+    legend = [
+        ('rect', '#BDC3C7', 'Clase 0: No Diabetes'),
+        ('rect', pink_color, 'Clase 1: Diabetes'),
+        ('line', optimal_color, f'Óptimo ({optimal_threshold})'),
+        ('line', dark_color, 'Tu Selección'),
+    ]
+    parts = [
+        f'<svg viewBox="0 0 {_CAL_W} {_CAL_H}" xmlns="http://www.w3.org/2000/svg" style="width:100%; display:block;" '
+        f'font-family="Helvetica, Arial, sans-serif">',
+        f'<path d="{sanos_area}" fill="#BDC3C7" fill-opacity="0.3"/>',
+        f'<path d="{sanos_line}" fill="none" stroke="gray" stroke-width="0.8" stroke-opacity="0.6"/>',
+        f'<path d="{enf_area}" fill="{pink_color}" fill-opacity="0.3"/>',
+        f'<path d="{enf_line}" fill="none" stroke="{pink_color}" stroke-width="0.8" stroke-opacity="0.6"/>',
+        f'<line x1="{x_opt:.1f}" y1="{_CAL_TOP}" x2="{x_opt:.1f}" y2="{_CAL_BOTTOM}" stroke="{optimal_color}" stroke-width="1.5" stroke-dasharray="6 3"/>',
+        f'<line x1="{x_sel:.1f}" y1="{_CAL_TOP}" x2="{x_sel:.1f}" y2="{_CAL_BOTTOM}" stroke="{dark_color}" stroke-width="2" stroke-dasharray="6 3"/>',
+    ]
+    for tick in (0.0, 0.2, 0.4, 0.6, 0.8, 1.0, 1.2):
+        parts.append(f'<text x="{_cal_x(tick):.1f}" y="{_CAL_BOTTOM + 14}" font-size="9" fill="#888" text-anchor="middle">{tick:.1f}</text>')
+    parts.append(f'<text x="{(_CAL_LEFT + _CAL_RIGHT) / 2:.0f}" y="{_CAL_H - 4}" font-size="10" fill="#888" text-anchor="middle">Probabilidad Predicha</text>')
+    for i, (kind, color, label) in enumerate(legend):
+        y = _CAL_TOP + 8 + i * 13
+        if kind == 'rect':
+            parts.append(f'<rect x="470" y="{y - 4}" width="14" height="7" fill="{color}" fill-opacity="0.3"/>')
+        else:
+            parts.append(f'<line x1="470" y1="{y}" x2="484" y2="{y}" stroke="{color}" stroke-width="1.5" stroke-dasharray="4 2"/>')
+        parts.append(f'<text x="490" y="{y + 3}" font-size="8" fill="#555">{label}</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+# Lienzo de cada panel de sensibilidad
+_SENS_W, _SENS_H = 300, 150
+_SENS_LEFT, _SENS_RIGHT, _SENS_TOP, _SENS_BOTTOM = 30, 292, 22, 126
+
+
+def sensitivity_svg(title, values, probs, current, threshold, line_color, dark_color, value_format="{:.0f}"):
+    """Probabilidad al variar una sola entrada, con el umbral y el valor actual del paciente."""
+    values = np.asarray(values, dtype=float)
+    probs = np.asarray(probs, dtype=float)
+    span = (values[-1] - values[0]) or 1.0
+
+    def sx(v):
+        return _SENS_LEFT + (v - values[0]) / span * (_SENS_RIGHT - _SENS_LEFT)
+
+    def sy(p):
+        return _SENS_BOTTOM - p * (_SENS_BOTTOM - _SENS_TOP)
+
+    line = 'M' + ' L'.join(f'{a:.1f},{b:.1f}' for a, b in zip(sx(values), sy(probs)))
+    y_thr = sy(float(threshold))
+    x_cur, y_cur = sx(float(current)), sy(float(np.interp(current, values, probs)))
+    parts = [
+        f'<svg viewBox="0 0 {_SENS_W} {_SENS_H}" xmlns="http://www.w3.org/2000/svg" style="width:100%; display:block;" '
+        f'font-family="Helvetica, Arial, sans-serif">',
+        f'<text x="{_SENS_LEFT}" y="13" font-size="11" font-weight="bold" fill="{dark_color}">{title}</text>',
+        f'<rect x="{_SENS_LEFT}" y="{_SENS_TOP}" width="{_SENS_RIGHT - _SENS_LEFT}" height="{_SENS_BOTTOM - _SENS_TOP}" fill="#FAFAFA" stroke="#EEE"/>',
+        f'<line x1="{_SENS_LEFT}" y1="{y_thr:.1f}" x2="{_SENS_RIGHT}" y2="{y_thr:.1f}" stroke="{dark_color}" stroke-width="1" stroke-dasharray="4 3"/>',
+        f'<path d="{line}" fill="none" stroke="{line_color}" stroke-width="2"/>',
+        f'<line x1="{x_cur:.1f}" y1="{_SENS_TOP}" x2="{x_cur:.1f}" y2="{_SENS_BOTTOM}" stroke="#BBB" stroke-width="1"/>',
+        f'<circle cx="{x_cur:.1f}" cy="{y_cur:.1f}" r="4" fill="white" stroke="{dark_color}" stroke-width="2"/>',
+    ]
+    for p in (0.0, 0.5, 1.0):
+        parts.append(f'<text x="{_SENS_LEFT - 4}" y="{sy(p) + 3:.1f}" font-size="8" fill="#888" text-anchor="end">{p:.0%}</text>')
+    parts.append(f'<text x="{_SENS_LEFT}" y="{_SENS_BOTTOM + 12}" font-size="8" fill="#888">{value_format.format(values[0])}</text>')
+    parts.append(f'<text x="{_SENS_RIGHT}" y="{_SENS_BOTTOM + 12}" font-size="8" fill="#888" text-anchor="end">{value_format.format(values[-1])}</text>')
+    x_label = min(max(x_cur, _SENS_LEFT + 20), _SENS_RIGHT - 20)
+    parts.append(f'<text x="{x_label:.1f}" y="{_SENS_BOTTOM + 22}" font-size="9" font-weight="bold" fill="{dark_color}" text-anchor="middle">{value_format.format(current)}</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+# Lienzo del histograma de riesgo de la cohorte
+_HIST_W, _HIST_H = 600, 220
+_HIST_LEFT, _HIST_RIGHT, _HIST_TOP, _HIST_BOTTOM = 45, 590, 15, 185
+
+
+def risk_histogram_svg(counts, edges, threshold, low_color, high_color, dark_color):
+    """Distribución de probabilidades de la cohorte; las barras por encima del umbral en el color de riesgo."""
+    counts = np.asarray(counts)
+    peak = max(int(counts.max()), 1) if counts.size else 1
+
+    def sx(p):
+        return _HIST_LEFT + p * (_HIST_RIGHT - _HIST_LEFT)
+
+    def sy(c):
+        return _HIST_BOTTOM - c / peak * (_HIST_BOTTOM - _HIST_TOP)
+
+    parts = [
+        f'<svg viewBox="0 0 {_HIST_W} {_HIST_H}" xmlns="http://www.w3.org/2000/svg" style="width:100%; display:block;" '
+        f'font-family="Helvetica, Arial, sans-serif">',
+    ]
+    for c, lo, hi in zip(counts, edges[:-1], edges[1:]):
+        color = high_color if (lo + hi) / 2 > threshold else low_color
+        parts.append(f'<rect x="{sx(lo) + 1:.1f}" y="{sy(c):.1f}" width="{sx(hi) - sx(lo) - 2:.1f}" height="{_HIST_BOTTOM - sy(c):.1f}" '
+                     f'fill="{color}" fill-opacity="0.85"><title>{lo:.2f}–{hi:.2f}: {int(c)}</title></rect>')
+    x_thr = sx(float(threshold))
+    parts.append(f'<line x1="{x_thr:.1f}" y1="{_HIST_TOP - 5}" x2="{x_thr:.1f}" y2="{_HIST_BOTTOM}" stroke="{dark_color}" stroke-width="2" stroke-dasharray="6 3"/>')
+    parts.append(f'<text x="{x_thr + 4:.1f}" y="{_HIST_TOP + 5}" font-size="10" fill="{dark_color}">Umbral {float(threshold):.2f}</text>')
+    parts.append(f'<line x1="{_HIST_LEFT}" y1="{_HIST_BOTTOM}" x2="{_HIST_RIGHT}" y2="{_HIST_BOTTOM}" stroke="#CCC"/>')
+    for tick in (0.0, 0.2, 0.4, 0.6, 0.8, 1.0):
+        parts.append(f'<text x="{sx(tick):.1f}" y="{_HIST_BOTTOM + 14}" font-size="9" fill="#888" text-anchor="middle">{tick:.1f}</text>')
+    for c in (0, peak // 2, peak):
+        parts.append(f'<text x="{_HIST_LEFT - 6}" y="{sy(c) + 3:.1f}" font-size="9" fill="#888" text-anchor="end">{c}</text>')
+    parts.append(f'<text x="{(_HIST_LEFT + _HIST_RIGHT) / 2:.0f}" y="{_HIST_H - 4}" font-size="10" fill="#888" text-anchor="middle">Probabilidad Predicha</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+# Lienzo de la trayectoria de riesgo de un paciente
+_TREND_W, _TREND_H = 600, 200
+_TREND_LEFT, _TREND_RIGHT, _TREND_TOP, _TREND_BOTTOM = 40, 585, 12, 170
+
+
+def risk_trend_svg(days, labels, probs, threshold, low_color, high_color, dark_color):
+    """
+    Probabilidad de cada visita del paciente. `days` sitúa las visitas en el eje X (ordinal de la
+    fecha; si todas son del mismo día se reparten por orden); cada punto toma el color de su lado del umbral.
+    """
+    days = np.asarray(days, dtype=float)
+    probs = np.asarray(probs, dtype=float)
+    span = days[-1] - days[0]
+    if span <= 0:
+        days, span = np.arange(days.size, dtype=float), max(days.size - 1, 1)
+
+    def sx(d):
+        return _TREND_LEFT + (d - days[0]) / span * (_TREND_RIGHT - _TREND_LEFT) if days.size > 1 else (_TREND_LEFT + _TREND_RIGHT) / 2
+
+    def sy(p):
+        return _TREND_BOTTOM - p * (_TREND_BOTTOM - _TREND_TOP)
+
+    xs = [sx(d) for d in days]
+    y_thr = sy(float(threshold))
+    parts = [
+        f'<svg viewBox="0 0 {_TREND_W} {_TREND_H}" xmlns="http://www.w3.org/2000/svg" style="width:100%; display:block;" '
+        f'font-family="Helvetica, Arial, sans-serif">',
+        f'<rect x="{_TREND_LEFT}" y="{_TREND_TOP}" width="{_TREND_RIGHT - _TREND_LEFT}" height="{_TREND_BOTTOM - _TREND_TOP}" fill="#FAFAFA" stroke="#EEE"/>',
+        f'<line x1="{_TREND_LEFT}" y1="{y_thr:.1f}" x2="{_TREND_RIGHT}" y2="{y_thr:.1f}" stroke="{dark_color}" stroke-width="1" stroke-dasharray="4 3"/>',
+        f'<text x="{_TREND_RIGHT - 4}" y="{y_thr - 4:.1f}" font-size="9" fill="{dark_color}" text-anchor="end">Umbral {float(threshold):.2f}</text>',
+    ]
+    if len(xs) > 1:
+        line = 'M' + ' L'.join(f'{x:.1f},{sy(p):.1f}' for x, p in zip(xs, probs))
+        parts.append(f'<path d="{line}" fill="none" stroke="#BBB" stroke-width="2"/>')
+    for x, p, label in zip(xs, probs, labels):
+        color = high_color if p > threshold else low_color
+        parts.append(f'<circle cx="{x:.1f}" cy="{sy(p):.1f}" r="5" fill="{color}" stroke="white" stroke-width="1.5">'
+                     f'<title>{label}: {p:.1%}</title></circle>')
+    for p in (0.0, 0.5, 1.0):
+        parts.append(f'<text x="{_TREND_LEFT - 5}" y="{sy(p) + 3:.1f}" font-size="9" fill="#888" text-anchor="end">{p:.0%}</text>')
+    parts.append(f'<text x="{xs[0]:.1f}" y="{_TREND_BOTTOM + 14}" font-size="9" fill="#888" text-anchor="start">{labels[0]}</text>')
+    if len(xs) > 1:
+        parts.append(f'<text x="{xs[-1]:.1f}" y="{_TREND_BOTTOM + 14}" font-size="9" fill="#888" text-anchor="end">{labels[-1]}</text>')
+    parts.append(f'<text x="{(_TREND_LEFT + _TREND_RIGHT) / 2:.0f}" y="{_TREND_H - 4}" font-size="10" fill="#888" text-anchor="middle">Visitas</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
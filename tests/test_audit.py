@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from audit import AuditLog, iter_entries, segment_paths
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_open_segment_of_a_live_log_is_not_recovered(tmp_path):
+    live = AuditLog(str(tmp_path))
+    live.log({"i": 1}).result(5)
+    other = AuditLog(str(tmp_path))  # Como un segundo worker que arranca con el primero vivo
+    live.log({"i": 2}).result(5)
+    other.log({"i": 3}).result(5)
+    live.close()
+    other.close()
+    assert sorted(e["i"] for e in iter_entries(str(tmp_path))) == [1, 2, 3]
+
+
+def test_segment_of_a_dead_process_is_repaired(tmp_path):
+    code = (f"import os, sys; sys.path.insert(0, {ROOT!r}); from audit import AuditLog\n"
+            f"log = AuditLog({str(tmp_path)!r})\n"
+            "[f.result(5) for f in [log.log({'i': i}) for i in range(50)]]\n"
+            "log._file.write(b'{\"i\": 99')\n"
+            "os._exit(1)\n")
+    subprocess.run([sys.executable, "-c", code], check=False)
+    AuditLog(str(tmp_path)).close()
+    assert [e["i"] for e in iter_entries(str(tmp_path))] == list(range(50))
+    assert all(path.endswith(".gz") for path in segment_paths(str(tmp_path)))
@@ -0,0 +1,73 @@
+import csv
+import io
+import zipfile
+
+import pandas as pd
+
+from bulk_reports import report_name, write_reports
+
+ROWS = """ID,Pregnancies,Glucose,BloodPressure,Insulin,Weight,Height,DPF,Age
+12/A,2,150,70,100,80,1.65,0.5,45
+12 A,1,95,80,60,60,1.70,0.3,30
+7,0,120,75,80,70,1.75,0.2,38
+7,3,210,90,150,95,1.60,0.8,55
+"""
+
+
+def test_report_name_repeats_get_row_number():
+    used = set()
+    names = [report_name(pid, row, used) for row, pid in enumerate(["12/A", "12 A", "7", "7", "12_A_fila2"], start=1)]
+    assert names == ["CDSS_Diabetes_12_A.html", "CDSS_Diabetes_12_A_fila2.html", "CDSS_Diabetes_7.html",
+                     "CDSS_Diabetes_7_fila4.html", "CDSS_Diabetes_12_A_fila2_fila5.html"]
+    assert len(set(names)) == len(names)
+
+
+def read_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        summary = list(csv.DictReader(io.StringIO(archive.read("resumen.csv").decode("utf-8"))))
+    return names, summary
+
+
+def read_report(path, name):
+    with zipfile.ZipFile(path) as archive:
+        return archive.read(name).decode("utf-8")
+
+
+def test_duplicate_ids_get_distinct_entries(tmp_path):
+    source = tmp_path / "cohorte.csv"
+    source.write_text(ROWS, encoding="utf-8")
+    output = tmp_path / "informes.zip"
+    assert write_reports(str(source), str(output), workers=1, date_str="01/01/2026") == 4
+
+    names, summary = read_zip(output)
+    assert len(names) == len(set(names)) == 5
+    assert [row["fichero"] for row in summary] == [n for n in names if n != "resumen.csv"]
+    assert [row["id"] for row in summary] == ["12/A", "12 A", "7", "7"]
+
+
+def test_scored_cohort_probabilities_are_kept(tmp_path):
+    scored = pd.read_csv(io.StringIO(ROWS))
+    scored["prob_diabetes"] = [0.9, 0.1, None, 0.3]
+    source = tmp_path / "puntuada.csv"
+    scored.to_csv(source, index=False)
+    output = tmp_path / "informes.zip"
+    write_reports(str(source), str(output), workers=1, date_str="01/01/2026")
+
+    _, summary = read_zip(output)
+    probs = [float(row["prob_diabetes"]) for row in summary]
+    assert probs[0] == 0.9 and probs[1] == 0.1 and probs[3] == 0.3
+    assert 0.0 <= probs[2] <= 1.0
+
+
+def test_patient_id_is_escaped_in_report(tmp_path):
+    source = tmp_path / "cohorte.csv"
+    source.write_text(ROWS.replace("12/A,", "<b>1</b>,", 1), encoding="utf-8")
+    output = tmp_path / "informes.zip"
+    write_reports(str(source), str(output), workers=1, date_str="01/01/2026")
+
+    names, summary = read_zip(output)
+    assert summary[0]["id"] == "<b>1</b>"
+    html = read_report(output, summary[0]["fichero"])
+    assert "&lt;b&gt;1&lt;/b&gt;" in html
+    assert "<b>1</b>" not in html
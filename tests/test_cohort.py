@@ -0,0 +1,47 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from cohort import ALERT_RULES, alert_counts, patient_alerts, score_cohort
+
+
+class ConstantModel:
+    def predict_proba(self, X):
+        return np.tile([0.6, 0.4], (len(X), 1))
+
+
+# Celdas no numéricas en Glucose y BloodPressure: la columna queda como texto al leer el CSV
+DIRTY_CSV = """ID,Pregnancies,Glucose,BloodPressure,Insulin,Weight,Height,DPF,Age
+1,2,desconocido,95,80,70,1.70,0.5,40
+2,1,210,70,100,120,1.70,0.3,55
+3,0,150,,90,80,1.70,0.2,33
+4,3,100,abc,85,45,1.70,0.4,28
+"""
+
+
+def score_dirty():
+    raw = pd.read_csv(io.StringIO(DIRTY_CSV))
+    assert not pd.api.types.is_numeric_dtype(raw['Glucose'])
+    return score_cohort(raw, ConstantModel())
+
+
+def test_dirty_csv_alert_counts():
+    counts = alert_counts(score_dirty())
+    assert counts == {
+        "Posible Diabetes": 1, "Posible Prediabetes": 1, "Obesidad Mórbida (G3)": 1, "Obesidad G2": 0,
+        "Obesidad G1": 0, "Sobrepeso": 1, "Bajo Peso": 1, "Resistencia Insulina": 1, "Hipertensión Diastólica": 1,
+    }
+
+
+def test_dirty_csv_alerts_per_patient():
+    assert score_dirty()['n_alertas'].tolist() == [1, 3, 2, 1]
+
+
+def test_patient_alerts_match_cohort_columns():
+    scored = score_dirty()
+    for _, row in scored.iterrows():
+        values = {'Glucose': pd.to_numeric(row['Glucose'], errors='coerce'), 'BMI': row['BMI'],
+                  'Indice_resistencia': row['Indice_resistencia'],
+                  'BloodPressure': pd.to_numeric(row['BloodPressure'], errors='coerce')}
+        assert patient_alerts(values) == [name for column, name, _ in ALERT_RULES if row[column]]
@@ -0,0 +1,106 @@
+"""
+Análisis del umbral de decisión sobre un conjunto de validación etiquetado.
+
+Las probabilidades se ordenan una vez y con sumas acumuladas se obtienen la matriz de
+confusión y las métricas para todos los umbrales posibles; consultar un umbral concreto
+es una búsqueda binaria (searchsorted) sobre las probabilidades ordenadas.
+"""
+import numpy as np
+import pandas as pd
+
+from features import build_feature_frame
+
+OUTCOME_COLUMN = 'Outcome'
+PROB_COLUMN = 'prob_diabetes'  # Columna que escribe batch_scoring.py
+
+
+class ThresholdAnalysis:
+    """Métricas en cada umbral. Como en la app, un paciente es positivo si prob > umbral."""
+
+    def __init__(self, y_true, scores):
+        y = np.asarray(y_true, dtype=float)
+        s = np.asarray(scores, dtype=float)
+        valid = ~(np.isnan(y) | np.isnan(s))
+        y, s = y[valid].astype(bool), s[valid]
+        if y.size == 0:
+            raise ValueError("El conjunto de validación no tiene filas válidas")
+
+        order = np.argsort(s, kind='mergesort')
+        self.scores = s[order]
+        self.labels = y[order]
+        self.n = y.size
+        self.positives = int(y.sum())
+        self.negatives = self.n - self.positives
+
+        # Con k = nº de probabilidades <= umbral, esas k filas son negativas predichas
+        fn = np.concatenate([[0], np.cumsum(self.labels)])
+        tn = np.arange(self.n + 1) - fn
+        self.fn, self.tn = fn, tn
+        self.tp, self.fp = self.positives - fn, self.negatives - tn
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.sensitivity = self.tp / self.positives
+            self.specificity = self.tn / self.negatives
+            self.ppv = np.where(self.tp + self.fp > 0, self.tp / (self.tp + self.fp), np.nan)
+            self.f2 = np.where(self.tp > 0, 5 * self.tp / (5 * self.tp + 4 * self.fn + self.fp), 0.0)
+            self.accuracy = (self.tp + self.tn) / self.n
+        self.auc = self._auc()
+
+    def _auc(self):
+        """AUC-ROC (Mann-Whitney) con rangos medios para los empates, sobre el orden ya calculado."""
+        if self.positives == 0 or self.negatives == 0:
+            return float('nan')
+        _, first, counts = np.unique(self.scores, return_index=True, return_counts=True)
+        mean_rank = first + (counts + 1) / 2.0
+        ranks = np.repeat(mean_rank, counts)
+        return float((ranks[self.labels].sum() - self.positives * (self.positives + 1) / 2)
+                     / (self.positives * self.negatives))
+
+    def index(self, threshold):
+        return int(np.searchsorted(self.scores, threshold, side='right'))
+
+    def at(self, threshold):
+        """Matriz de confusión y métricas para un umbral (O(log n))."""
+        k = self.index(threshold)
+        return {
+            'threshold': float(threshold),
+            'tp': int(self.tp[k]), 'fp': int(self.fp[k]), 'tn': int(self.tn[k]), 'fn': int(self.fn[k]),
+            'sensitivity': float(self.sensitivity[k]),
+            'specificity': float(self.specificity[k]),
+            'ppv': float(self.ppv[k]),
+            'f2': float(self.f2[k]),
+            'accuracy': float(self.accuracy[k]),
+        }
+
+    def class_densities(self, bins=60, smooth=2.0):
+        """Densidades (histograma suavizado) de las probabilidades de cada clase en [0, 1]."""
+        edges = np.linspace(0.0, 1.0, bins + 1)
+        centers = (edges[:-1] + edges[1:]) / 2
+        offsets = np.arange(-3 * int(np.ceil(smooth)), 3 * int(np.ceil(smooth)) + 1)
+        kernel = np.exp(-offsets ** 2 / (2 * smooth ** 2))
+        kernel /= kernel.sum()
+
+        def density(values):
+            if values.size == 0:
+                return np.zeros(bins)
+            hist, _ = np.histogram(values, bins=edges, density=True)
+            return np.convolve(hist, kernel, mode='same')
+
+        return centers, density(self.scores[~self.labels]), density(self.scores[self.labels])
+
+
+def analysis_from_frame(df, predictor=None):
+    """
+    ThresholdAnalysis de un DataFrame con la columna Outcome y, o bien las probabilidades ya
+    calculadas (prob_diabetes), o bien los datos clínicos para puntuarlos con predictor.
+    """
+    if OUTCOME_COLUMN not in df.columns:
+        raise ValueError(f"Falta la columna {OUTCOME_COLUMN} en el conjunto de validación")
+    y = pd.to_numeric(df[OUTCOME_COLUMN], errors='coerce').to_numpy(dtype=float)
+    if PROB_COLUMN in df.columns:
+        scores = pd.to_numeric(df[PROB_COLUMN], errors='coerce').to_numpy(dtype=float)
+    else:
+        if predictor is None:
+            raise ValueError("Hace falta un modelo para puntuar el conjunto de validación")
+        scores = np.asarray(predictor.predict_proba(build_feature_frame(df)))[:, 1]
+    return ThresholdAnalysis(y, scores)
@@ -0,0 +1,124 @@
+"""
+Instrumentación ligera de tiempos por rerun.
+
+Cada rerun crea un SpanRecorder; con él desactivado, span() devuelve siempre el mismo
+contexto vacío y el coste es una comprobación de un booleano. Activado, las duraciones
+se acumulan en ventanas móviles por proceso (TimingRegistry) y se añaden a un log JSONL.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class TimingRegistry:
+    """Últimas `window` duraciones de cada span, comunes a todas las sesiones del proceso."""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            values = self._spans.get(name)
+            if values is None:
+                values = self._spans[name] = deque(maxlen=self.window)
+            values.append(seconds)
+
+    def summary(self):
+        """{span: {n, p50_ms, p95_ms, max_ms, last_ms}} con las duraciones de la ventana actual."""
+        with self._lock:
+            snapshot = {name: np.fromiter(values, dtype=float) for name, values in self._spans.items()}
+        return {
+            name: {
+                "n": int(ms.size),
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p95_ms": float(np.percentile(ms, 95)),
+                "max_ms": float(ms.max()),
+                "last_ms": float(ms[-1]),
+            }
+            for name, ms in ((name, values * 1000) for name, values in snapshot.items())
+        }
+
+    def histogram(self, name, bins=10):
+        """Recuentos y bordes (ms) del histograma de un span."""
+        with self._lock:
+            values = np.fromiter(self._spans.get(name, ()), dtype=float) * 1000
+        return np.histogram(values, bins=bins) if values.size else (np.zeros(bins, dtype=int), np.zeros(bins + 1))
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "start")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.spans.append((self.name, time.perf_counter() - self.start))
+        return False
+
+
+class SpanRecorder:
+    """Spans de un rerun. Los tramos con el mismo nombre se suman."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = []
+        self.start = time.perf_counter()
+
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def totals(self):
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def finish(self, registry, log_path=None, **context):
+        """Cierra el rerun: vuelca los spans (y el total) al registro y, si hay log_path, al JSONL."""
+        if not self.enabled:
+            return None
+        totals = self.totals()
+        totals["rerun_total"] = time.perf_counter() - self.start
+        for name, seconds in totals.items():
+            registry.record(name, seconds)
+        if log_path:
+            entry = {"ts": time.time(), **context, "spans_ms": {k: round(v * 1000, 3) for k, v in totals.items()}}
+            append_jsonl(log_path, entry)
+        return totals
+
+
+_log_lock = threading.Lock()
+
+
+def append_jsonl(path, entry):
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    directory = os.path.dirname(path)
+    with _log_lock:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+# Registro del proceso (como la caché de figuras de charts.py)
+REGISTRY = TimingRegistry()
@@ -0,0 +1,141 @@
+"""
+Importación de dependencias pesadas y carga del modelo en segundo plano, con tiempos de arranque.
+
+Si existe un bundle .npy exportado del pickle actual, se carga mapeado en memoria y el
+pickle no se deserializa hasta que alguien lo necesite (SHAP).
+"""
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+
+# Lo que la portada no necesita y la simulación sí
+HEAVY_MODULES = ("numpy", "pandas", "joblib", "sklearn.ensemble", "matplotlib.pyplot", "shap")
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path):
+    """Huella del pickle de origen (para saber si un bundle está desactualizado). Solo biblioteca estándar."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelWarmup:
+    """Importa las dependencias y deserializa el modelo en un hilo aparte, midiendo cada fase por separado."""
+
+    def __init__(self, model_path, bundle_dir=None, modules=HEAVY_MODULES, label=False):
+        self.model_path = model_path
+        self.label = label  # Si se calcula la etiqueta de versión (registry.py) en el hilo de precarga
+        self.sha256 = None
+        self.bundle_dir = bundle_dir
+        self.modules = modules
+        self.model = None
+        self.engine = None
+        self.error = None
+        self.timings = {}
+        self.engine_error = None  # Por qué no hay motor compilado (la Ficha Técnica lo muestra)
+        self._lock = threading.RLock()
+        self._done = threading.Event()
+        self._labelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            if self.label:
+                # Lo primero: la etiqueta está lista antes que los imports y la carga
+                try:
+                    self.sha256 = file_sha256(self.model_path)
+                except OSError:
+                    pass
+                finally:
+                    self._labelled.set()
+            start = time.perf_counter()
+            for name in self.modules:
+                t = time.perf_counter()
+                try:
+                    importlib.import_module(name)
+                except ImportError:
+                    pass  # Dependencias opcionales (p. ej. SHAP)
+                self.timings[f"import {name}"] = time.perf_counter() - t
+            self.timings["imports"] = time.perf_counter() - start
+
+            if self.bundle_dir is not None:
+                from fast_forest import CompiledForest, bundle_is_current
+                if bundle_is_current(self.bundle_dir, self.model_path):
+                    t = time.perf_counter()
+                    self.engine = CompiledForest.load(self.bundle_dir, mmap_mode='r')
+                    self.timings["bundle_load"] = time.perf_counter() - t
+                    return
+
+            if os.path.exists(self.model_path):
+                import joblib
+                t = time.perf_counter()
+                self.model = joblib.load(self.model_path)
+                self.timings["model_load"] = time.perf_counter() - t
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+            # Los tiempos quedan en self.timings (Ficha Técnica); aquí solo para quien active el logging
+            logger.info("Arranque de %s: imports %.2f s · carga del modelo %.2f s", os.path.basename(self.model_path),
+                        self.timings.get('imports', 0), self.timings.get('model_load', self.timings.get('bundle_load', 0)))
+
+    @property
+    def version(self):
+        """
+        Etiqueta legible y única de la versión (fichero@huella del pickle) para mostrar y auditar.
+        La huella se calcula en el hilo de precarga; si aún no ha terminado, se espera.
+        """
+        if not self.label:
+            return None
+        self._labelled.wait()
+        name = os.path.basename(self.model_path)
+        return f"{name}@{self.sha256[:12]}" if self.sha256 else name
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Espera a que termine la carga y devuelve el pipeline (None si no existe o si se cargó el bundle)."""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.model
+
+    def load_pipeline(self):
+        """Pipeline sklearn (None si no existe el .pkl). Si la precarga usó el bundle, se deserializa ahora, una sola vez."""
+        self.result()
+        with self._lock:
+            if self.model is None and os.path.exists(self.model_path):
+                import joblib
+                t = time.perf_counter()
+                self.model = joblib.load(self.model_path)
+                self.timings["model_load"] = time.perf_counter() - t
+            return self.model
+
+    def load_engine(self):
+        """Motor compilado: el bundle mmap o, si no hay, compilado y validado desde el pipeline. None si no es posible."""
+        self.result()
+        with self._lock:
+            if self.engine is None and self.engine_error is None:
+                pipeline = self.load_pipeline()
+                try:
+                    from fast_forest import CompiledForest
+                    engine = CompiledForest.from_pipeline(pipeline)
+                    engine.check_equivalence(pipeline)
+                    self.engine = engine
+                except Exception as e:
+                    logger.warning("Motor compilado desactivado para %s: %s", os.path.basename(self.model_path), e)
+                    self.engine_error = f"{type(e).__name__}: {e}"
+            return self.engine
@@ -0,0 +1,83 @@
+"""
+Superficie de riesgo precalculada (Glucosa × BMI) para la exploración «what-if».
+
+Con el resto de variables del paciente fijas, se puntúa una rejilla de glucosa y BMI en
+una sola llamada a predict_proba. Mientras los deslizadores se muevan dentro de la
+rejilla, la probabilidad se obtiene por interpolación bilineal sin llamar al modelo.
+"""
+import base64
+import io
+
+import numpy as np
+import pandas as pd
+
+from features import FEATURE_COLUMNS, PREDIABETES_GLUCOSE, build_feature_array
+
+# Rangos de la rejilla: el deslizador de glucosa completo y el BMI clínicamente habitual.
+# El nodo extra en 139 evita interpolar a través del salto de Is_prediabetes (glucosa entera)
+GLUCOSE_GRID = np.union1d(np.arange(50.0, 350.0 + 1e-9, 5.0), [PREDIABETES_GLUCOSE - 1.0])  # 62 puntos
+BMI_GRID = np.arange(10.0, 60.0 + 1e-9, 0.5)  # 101 puntos
+
+
+class RiskSurface:
+    """Probabilidades de la rejilla: prob[i, j] corresponde a bmi[i] y glucose[j]."""
+
+    def __init__(self, glucose, bmi, prob):
+        self.glucose = glucose
+        self.bmi = bmi
+        self.prob = prob
+        self._png = None
+
+    def contains(self, glucose, bmi):
+        return (self.glucose[0] <= glucose <= self.glucose[-1]) and (self.bmi[0] <= bmi <= self.bmi[-1])
+
+    def lookup(self, glucose, bmi):
+        """Probabilidad interpolada (bilineal) o None si el punto cae fuera de la rejilla."""
+        if not self.contains(glucose, bmi):
+            return None
+        j, tx = _cell(self.glucose, glucose)
+        i, ty = _cell(self.bmi, bmi)
+        p = self.prob
+        top = p[i, j] * (1 - tx) + p[i, j + 1] * tx
+        bottom = p[i + 1, j] * (1 - tx) + p[i + 1, j + 1] * tx
+        return float(top * (1 - ty) + bottom * ty)
+
+    def position(self, glucose, bmi):
+        """Posición del punto en el mapa, en % desde la izquierda y desde arriba."""
+        x = (glucose - self.glucose[0]) / (self.glucose[-1] - self.glucose[0]) * 100
+        y = (self.bmi[-1] - bmi) / (self.bmi[-1] - self.bmi[0]) * 100
+        return min(100, max(0, x)), min(100, max(0, y))
+
+    def png_data_uri(self, colors):
+        """Mapa de calor (un píxel por punto de la rejilla) como data URI; se rasteriza una vez."""
+        if self._png is None:
+            from matplotlib.colors import LinearSegmentedColormap
+            from matplotlib.image import imsave
+            buf = io.BytesIO()
+            cmap = LinearSegmentedColormap.from_list("riesgo", colors)
+            imsave(buf, self.prob, cmap=cmap, vmin=0.0, vmax=1.0, origin='lower', format='png')
+            self._png = "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+        return self._png
+
+
+def _cell(grid, value):
+    """Índice de la celda que contiene value y su posición relativa dentro de ella (0-1)."""
+    k = int(np.searchsorted(grid, value, side='right')) - 1
+    k = min(max(k, 0), len(grid) - 2)
+    return k, (value - grid[k]) / (grid[k + 1] - grid[k])
+
+
+def surface_frame(pregnancies, blood_pressure, insulin, dpf, age, glucose=GLUCOSE_GRID, bmi=BMI_GRID):
+    """Filas del modelo para toda la rejilla, con las variables derivadas recalculadas en cada punto."""
+    g, b = np.meshgrid(glucose, bmi)
+    X = build_feature_array(pregnancies, g.ravel(), blood_pressure, insulin, b.ravel(), dpf, age)
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS)
+
+
+def compute_risk_surface(predictor, pregnancies, blood_pressure, insulin, dpf, age,
+                         glucose=GLUCOSE_GRID, bmi=BMI_GRID):
+    """Puntúa la rejilla completa en una única llamada al modelo."""
+    X = surface_frame(pregnancies, blood_pressure, insulin, dpf, age, glucose, bmi)
+    prob = np.asarray(predictor.predict_proba(X))[:, 1].reshape(len(bmi), len(glucose))
+    prob.flags.writeable = False  # Compartida entre sesiones: solo lectura
+    return RiskSurface(glucose, bmi, prob)